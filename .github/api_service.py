@@ -0,0 +1,379 @@
+# ----- api_service.py -----
+# Small read-only HTTP API over job_postings, social_media_posts and the
+# daily rollups, so consumers stop running their own aggregations on Atlas/Neon.
+#
+# Responses are cached in memory with a TTL. A background thread polls the
+# ingest version stamps (see ingest_version.py) every few seconds; when a
+# collector run bumps a stamp the whole cache is dropped. Repeated dashboard
+# loads are therefore served from memory without touching either database.
+#
+# Endpoints (all GET, JSON):
+#   /health
+#   /jobs/latest?limit=50&source=Web3.Career
+#   /tags/demand?days=30&top=25
+#   /skills/demand?days=30&top=25&category=language
+#   /sentiment/series?days=30&dimension=all&source=reddit
+#   /history/jobs?since=2024-01-01&until=2024-02-01&source=Web3.Career&limit=50   # hot + cold storage
+#   /history/posts?since=2024-01-01&until=2024-02-01&source=reddit&limit=50
+#
+# Usage:
+#   python api_service.py [--port 8080] [--ttl 300]          # live databases (POSTGRES_URI / MONGO_URI)
+#   python api_service.py --fixture sample_data.json          # in-memory stand-in, no databases needed
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_TTL_SECONDS = 300
+VERSION_POLL_SECONDS = 10
+MAX_LIMIT = 500
+
+
+class TTLCache:
+    """Thread-safe response cache. Entries expire after `ttl` seconds or when the data version changes."""
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def set_version(self, version):
+        """Returns True if the version changed (and the cache was cleared)."""
+        with self._lock:
+            if version == self.version:
+                return False
+            self.version = version
+            self._entries.clear()
+            return True
+
+    def get_or_compute(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            version = self.version
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = compute() # Outside the lock - a slow query must not block cache hits
+        with self._lock:
+            if self.version != version:
+                return value # Data changed while we were computing - don't cache a stale answer
+            if len(self._entries) >= self.max_entries:
+                # Drop the entry closest to expiry
+                self._entries.pop(min(self._entries, key=lambda k: self._entries[k][0]))
+            self._entries[key] = (now + self.ttl, value)
+        return value
+
+
+# --- Backends ---
+class LiveBackend:
+    """Reads Neon (job_postings + job rollups) and Atlas (social posts + sentiment rollups)."""
+
+    def __init__(self, postgres_uri, mongo_uri):
+        from psycopg2.pool import ThreadedConnectionPool
+        from pymongo import MongoClient
+        self._pg_pool = ThreadedConnectionPool(1, 4, postgres_uri)
+        self._mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        self._db = self._mongo_client['web3_data']
+
+    def _pg(self, work):
+        conn = self._pg_pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                result = work(cur)
+            conn.rollback() # Read-only; don't leave a transaction open
+            return result
+        finally:
+            self._pg_pool.putconn(conn)
+
+    def version(self):
+        import ingest_version
+        pg_versions = self._pg(ingest_version.read_postgres)
+        mongo_versions = ingest_version.read_mongo(self._db)
+        return tuple(sorted({**pg_versions, **mongo_versions}.items()))
+
+    def latest_jobs(self, limit, source=None):
+        def work(cur):
+            query = """
+                SELECT title, company_name, location, salary_range, tags, skills, source, job_url,
+                       is_remote, collected_at
+                FROM job_postings
+            """
+            params = []
+            if source:
+                query += " WHERE source = %s"
+                params.append(source)
+            query += " ORDER BY collected_at DESC LIMIT %s;"
+            params.append(limit)
+            cur.execute(query, params)
+            columns = [c[0] for c in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+        return self._pg(work)
+
+    def tag_demand(self, days, top):
+        import rollups
+        rows = self._pg(lambda cur: rollups.tag_demand(cur, days, top))
+        return [{'tag': tag, 'postings': postings, 'remote_postings': remote} for tag, postings, remote in rows]
+
+    def skill_demand(self, days, top, category=None):
+        import skills
+        # Job postings and social posts are counted separately - a posting and a tweet aren't the same signal
+        jobs = self._pg(lambda cur: skills.job_skill_demand(cur, days, top, category))
+        posts = skills.post_skill_demand(self._db, days, top, category)
+        return {'jobs': [{'skill': skill, 'postings': postings, 'remote_postings': remote} for skill, postings, remote in jobs],
+                'posts': [{'skill': skill, 'mentions': mentions} for skill, mentions in posts]}
+
+    def sentiment_series(self, days, dimension, source=None):
+        import rollups
+        return rollups.sentiment_series(self._db, days, dimension, source)
+
+    def history_jobs(self, since, until, source=None, limit=50):
+        import retention
+        return self._pg(lambda cur: retention.find_jobs(cur, since, until, source, limit))
+
+    def history_posts(self, since, until, source=None, limit=50):
+        import retention
+        return retention.find_posts(self._db, since, until, source, limit)
+
+    def close(self):
+        self._pg_pool.closeall()
+        self._mongo_client.close()
+
+
+class MemoryBackend:
+    """In-memory stand-in with the same interface as LiveBackend, for local runs and tests.
+
+    Fixture format: {"jobs": [...job_postings rows...], "tag_rollups": [{"day", "tag", "postings",
+    "remote_postings"}], "sentiment_rollups": [{"day", "source", "dimension", "key", "count",
+    "compound_sum"}]}. Dates are ISO strings. Call bump() to simulate a collector run.
+    """
+
+    def __init__(self, jobs=None, tag_rollups=None, sentiment_rollups=None):
+        self.jobs = jobs or []
+        self.tag_rollups = tag_rollups or []
+        self.sentiment_rollups = sentiment_rollups or []
+        self.queries = 0 # How often the "database" was actually hit
+        self._version = 0
+
+    @classmethod
+    def from_fixture(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        for row in data.get('jobs', []):
+            row['collected_at'] = datetime.fromisoformat(row['collected_at'])
+        for row in data.get('tag_rollups', []) + data.get('sentiment_rollups', []):
+            row['day'] = datetime.fromisoformat(row['day'])
+        return cls(data.get('jobs'), data.get('tag_rollups'), data.get('sentiment_rollups'))
+
+    def bump(self):
+        self._version += 1
+
+    def version(self):
+        return self._version
+
+    def latest_jobs(self, limit, source=None):
+        self.queries += 1
+        rows = [j for j in self.jobs if not source or j.get('source') == source]
+        return sorted(rows, key=lambda j: j['collected_at'], reverse=True)[:limit]
+
+    def tag_demand(self, days, top):
+        self.queries += 1
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        totals = {}
+        for row in self.tag_rollups:
+            if row['day'] >= cutoff:
+                t = totals.setdefault(row['tag'], [0, 0])
+                t[0] += row['postings']
+                t[1] += row.get('remote_postings', 0)
+        ranked = sorted(totals.items(), key=lambda kv: kv[1][0], reverse=True)[:top]
+        return [{'tag': tag, 'postings': p, 'remote_postings': r} for tag, (p, r) in ranked]
+
+    def skill_demand(self, days, top, category=None):
+        self.queries += 1
+        names = None
+        if category:
+            import skills
+            names = set(skills.names_in(category))
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        totals = {}
+        for job in self.jobs:
+            if job['collected_at'] < cutoff:
+                continue
+            for skill in job.get('skills') or []:
+                if names is None or skill in names:
+                    t = totals.setdefault(skill, [0, 0])
+                    t[0] += 1
+                    t[1] += 1 if job.get('is_remote') else 0
+        ranked = sorted(totals.items(), key=lambda kv: (-kv[1][0], kv[0]))[:top]
+        return {'jobs': [{'skill': skill, 'postings': p, 'remote_postings': r} for skill, (p, r) in ranked],
+                'posts': []} # Fixtures carry no social posts
+
+    def sentiment_series(self, days, dimension, source=None):
+        self.queries += 1
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        rows = [r for r in self.sentiment_rollups
+                if r['dimension'] == dimension and r['day'] >= cutoff and (not source or r['source'] == source)]
+        return [{'day': r['day'], 'source': r['source'], 'key': r['key'], 'count': r['count'],
+                 'avg_compound': r['compound_sum'] / r['count'] if r['count'] else None}
+                for r in sorted(rows, key=lambda r: r['day'])]
+
+    def history_jobs(self, since, until, source=None, limit=50):
+        self.queries += 1
+        rows = [j for j in self.jobs
+                if since <= j['collected_at'] < (until or datetime.utcnow()) and (not source or j.get('source') == source)]
+        return sorted(rows, key=lambda j: j['collected_at'], reverse=True)[:limit]
+
+    def history_posts(self, since, until, source=None, limit=50):
+        self.queries += 1
+        return [] # Fixtures carry no social posts
+
+    def close(self):
+        pass
+
+
+# --- HTTP layer ---
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _int_param(params, name, default, maximum=None):
+    value = int(params.get(name, [default])[0])
+    if value < 1:
+        raise ValueError(f"'{name}' must be positive")
+    return min(value, maximum) if maximum else value
+
+
+def _date_param(params, name, default=None):
+    value = params.get(name, [None])[0]
+    return datetime.fromisoformat(value) if value else default
+
+
+class QueryService:
+    """Routes requests to the backend through the cache. Independent of the HTTP server for testing."""
+
+    def __init__(self, backend, ttl=DEFAULT_TTL_SECONDS):
+        self.backend = backend
+        self.cache = TTLCache(ttl)
+        self.refresh_version()
+
+    def refresh_version(self):
+        try:
+            if self.cache.set_version(self.backend.version()):
+                print(f"Data version is now {self.cache.version} - response cache cleared.")
+        except Exception as version_err:
+            print(f">>> Warning: Could not read ingest versions: {version_err}")
+
+    def handle(self, path, params):
+        """Returns (status, body_bytes)."""
+        if path == '/health':
+            body = {'status': 'ok', 'version': self.cache.version,
+                    'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses}
+            return 200, json.dumps(body, default=_json_default).encode('utf-8')
+
+        routes = {
+            '/jobs/latest': lambda: self.backend.latest_jobs(
+                _int_param(params, 'limit', 50, MAX_LIMIT), params.get('source', [None])[0]),
+            '/tags/demand': lambda: self.backend.tag_demand(
+                _int_param(params, 'days', 30), _int_param(params, 'top', 25, MAX_LIMIT)),
+            '/skills/demand': lambda: self.backend.skill_demand(
+                _int_param(params, 'days', 30), _int_param(params, 'top', 25, MAX_LIMIT), params.get('category', [None])[0]),
+            '/sentiment/series': lambda: self.backend.sentiment_series(
+                _int_param(params, 'days', 30), params.get('dimension', ['all'])[0], params.get('source', [None])[0]),
+            '/history/jobs': lambda: self.backend.history_jobs(
+                _date_param(params, 'since', datetime.utcnow() - timedelta(days=30)), _date_param(params, 'until'),
+                params.get('source', [None])[0], _int_param(params, 'limit', 50, MAX_LIMIT)),
+            '/history/posts': lambda: self.backend.history_posts(
+                _date_param(params, 'since', datetime.utcnow() - timedelta(days=30)), _date_param(params, 'until'),
+                params.get('source', [None])[0], _int_param(params, 'limit', 50, MAX_LIMIT)),
+        }
+        if path not in routes:
+            return 404, b'{"error": "not found"}'
+        cache_key = (path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        try:
+            # Cache the encoded body, so hits skip JSON encoding as well
+            body = self.cache.get_or_compute(
+                cache_key, lambda: json.dumps(routes[path](), default=_json_default).encode('utf-8'))
+        except ValueError as param_err:
+            return 400, json.dumps({'error': str(param_err)}).encode('utf-8')
+        return 200, body
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            try:
+                status, body = service.handle(parsed.path, parse_qs(parsed.query))
+            except Exception as handler_err:
+                print(f"  > Error handling {self.path}: {handler_err}")
+                status, body = 500, b'{"error": "internal error"}'
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Keep the console for version/cache messages
+
+    return Handler
+
+
+def start_version_poller(service, interval=VERSION_POLL_SECONDS):
+    def poll():
+        while True:
+            time.sleep(interval)
+            service.refresh_version()
+    thread = threading.Thread(target=poll, name='version-poller', daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read API over the collected data.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8080)))
+    parser.add_argument('--ttl', type=int, default=DEFAULT_TTL_SECONDS)
+    parser.add_argument('--poll', type=int, default=VERSION_POLL_SECONDS, help='Seconds between version checks')
+    parser.add_argument('--fixture', help='Serve an in-memory JSON fixture instead of the live databases')
+    args = parser.parse_args(argv)
+
+    if args.fixture:
+        backend = MemoryBackend.from_fixture(args.fixture)
+    else:
+        if not os.environ.get('POSTGRES_URI') or not os.environ.get('MONGO_URI'):
+            print(">>> Error: POSTGRES_URI and MONGO_URI are required (or use --fixture).")
+            return 1
+        backend = LiveBackend(os.environ['POSTGRES_URI'], os.environ['MONGO_URI'])
+
+    service = QueryService(backend, ttl=args.ttl)
+    start_version_poller(service, args.poll)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"--- Read API listening on http://{args.host}:{args.port} (ttl={args.ttl}s) ---")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        backend.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,641 @@
+# ----- async_collector.py -----
+# Runs all four collectors on one asyncio event loop.
+# Every HTTP fetch (Web3.Career, CryptoJobsList, Reddit, Twitter) shares one
+# aiohttp session with keep-alive connections. HTML parsing runs in worker
+# threads, so it overlaps with requests that are still waiting on the network.
+# Rows and documents come from documents.py, the same builders the synchronous
+# scripts use, and are written in batches:
+#   job_postings       -> asyncpg, one INSERT ... SELECT per batch (+ raw payloads, rollups, version stamp)
+#   social_media_posts -> pymongo AsyncMongoClient, unordered insert_many per batch
+# Each source still writes its own run_metrics file, so run reports and the
+# collector_runs ledger look the same as with the per-script runner.
+# Requests are retried on transient errors, each source has its own circuit
+# breaker, and Reddit listings / Twitter queries are checkpointed once their
+# batch is written, so a crashed run resumes where it stopped (see resilience.py).
+# A database that is down (or stops answering mid-run) doesn't stop collection:
+# its batches go to the local write spool and spool.py writes them later.
+#
+# Usage:
+#   python async_collector.py                              # all sources
+#   python async_collector.py --only reddit --only twitter
+#   python async_collector.py --shard 2/4                  # runner 2 of 4 (units from sources.json)
+#   python async_collector.py --profile                    # flame graph + hot functions (profiling.py)
+#   COLLECTOR_ENGINE=async python run_all_tasks.py         # use this engine from the task runner
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from urllib.parse import urljoin
+
+import documents
+import ingest_version
+import job_history
+import job_raw_store
+import migrations
+import profiling
+import raw_archive
+import rate_limits
+import resilience
+import retention
+import rollups
+import seen_filter # Local Bloom filters of IDs already stored
+import source_registry
+import spool
+from run_metrics import RunMetrics
+
+REQUEST_TIMEOUT = 25
+CONNECTIONS_PER_HOST = 4
+PG_BATCH_SIZE = 200
+MONGO_BATCH_SIZE = 200
+
+# --- Endpoints (what to fetch from them - subreddits, queries, limits - is in sources.json) ---
+WEB3CAREER_ENDPOINT = "https://web3.career/api/v1"
+WEB3CAREER_PARAMS = {'show_description': 'true'}
+
+CRYPTOJOBSLIST_URL = 'https://cryptojobslist.com/'
+CRYPTOJOBSLIST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
+}
+
+REDDIT_TOKEN_URL = 'https://www.reddit.com/api/v1/access_token'
+REDDIT_API = 'https://oauth.reddit.com'
+
+TWITTER_SEARCH_URL = 'https://api.twitter.com/2/tweets/search/recent'
+
+JOB_SOURCES = ['web3career', 'cryptojobslist']
+SOCIAL_SOURCES = ['reddit', 'twitter']
+
+
+def asyncpg_sql(sql):
+    """Reuse a psycopg2 statement with asyncpg: %s placeholders become $1, $2, ..."""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f'${next(counter)}', sql)
+
+
+# --- Batch writers ---
+class BatchWriter:
+    """Buffer items and write them `batch_size` at a time; subclasses implement _write(batch) -> inserted.
+
+    finish_unit() ties a checkpoint unit to the data buffered for it: the unit is
+    checkpointed after that data has been written, and never if a batch failed meanwhile.
+    A batch that fails because the database is unreachable goes to the spool instead
+    (see spool.py) and counts as written.
+    With a seen-filter, items whose _key() it already holds are dropped before buffering,
+    and every item of a successfully written batch is added to it (see seen_filter.py).
+    """
+
+    def __init__(self, metrics, batch_size, checkpoint=None, spool_writer=None, seen=None):
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.spool_writer = spool_writer
+        self.seen = seen
+        self.inserted = 0
+        self.updated = 0 # Stored rows rewritten because their content changed (job rows only)
+        self.skipped = 0
+        self.spooled = 0
+        self.failed_batches = 0
+        self._pending = []
+        self._units = [] # (unit, failed_batches when the unit started)
+        self._lock = asyncio.Lock()
+
+    async def _buffer(self, items):
+        if self.seen is not None:
+            fresh = self.seen.drop_seen(items, self._key)
+            if len(fresh) < len(items):
+                self.skipped += len(items) - len(fresh)
+                self.metrics.incr('filtered', len(items) - len(fresh))
+            items = fresh
+        self._pending.extend(items)
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def finish_unit(self, unit, failures_at_start):
+        self._units.append((unit, failures_at_start))
+        if not self._pending:
+            await self.flush() # Nothing buffered - checkpoint right away
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            units, self._units = self._units, []
+            if batch:
+                start = time.perf_counter()
+                try:
+                    updated_before = self.updated
+                    inserted = await self._write(batch)
+                    self.inserted += inserted
+                    self.skipped += len(batch) - inserted - (self.updated - updated_before)
+                    if self.seen is not None:
+                        self.seen.mark(self._key(item) for item in batch) # New or duplicate, the database has them all
+                except Exception as write_err:
+                    if self.spool_writer is not None and spool.is_connection_error(write_err):
+                        self._spool(batch)
+                        self.spooled += len(batch)
+                    else:
+                        print(f"  > [{self.metrics.source}] Batch write of {len(batch)} items failed: {write_err}")
+                        self.metrics.incr('errors')
+                        self.failed_batches += 1
+                        self.skipped += len(batch)
+                finally:
+                    self.metrics.add_time('db_write', time.perf_counter() - start)
+            if self.checkpoint:
+                self.checkpoint.mark(*[unit for unit, failures in units if failures == self.failed_batches])
+
+    async def close(self):
+        await self.flush()
+        if self.seen is not None:
+            self.seen.save()
+
+
+class PostgresJobWriter(BatchWriter):
+    """Upserts each batch of job rows with a single INSERT ... SELECT in one transaction.
+
+    Known URLs are only rewritten when their content hash changed (see job_history.py).
+    The raw payload (job_postings_raw) and the daily rollups are written in the same
+    transaction, only for rows that were new; the ingest version stamp on any change.
+    Every URL added - seen-filtered or not - gets its last_seen_on stamp on close
+    (see retention.py).
+    """
+
+    def __init__(self, pool, version_source, columns, metrics, batch_size=PG_BATCH_SIZE, checkpoint=None,
+                 spool_writer=None, seen=None):
+        super().__init__(metrics, batch_size, checkpoint, spool_writer, seen)
+        self.pool = pool
+        self.version_source = version_source
+        self.columns = columns
+        column_list = ', '.join(columns)
+        # jsonb_populate_recordset uses job_postings' own column types, so no per-column casts
+        self._insert_sql = job_history.upsert_sql(
+            columns, f"SELECT {column_list} FROM jsonb_populate_recordset(NULL::job_postings, $1::jsonb)")
+        self.listed_urls = set()
+
+    async def add(self, job, raw_payload=None):
+        self.listed_urls.add(job['job_url'])
+        await self._buffer([(job, raw_payload)])
+
+    async def close(self):
+        await super().close()
+        if self.pool is None or not self.listed_urls:
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                today = datetime.utcnow().date()
+                await conn.execute(asyncpg_sql(retention.MARK_LISTED_SQL), today, list(self.listed_urls), today)
+        except Exception as mark_err:
+            # Only delays cold storage for these postings; the next run stamps them
+            print(f">>> Warning: [{self.metrics.source}] could not stamp last_seen_on for {len(self.listed_urls)} postings: {mark_err}")
+
+    def _key(self, item):
+        return job_history.seen_key(item[0]['job_url'], item[0]['content_hash'])
+
+    def _spool(self, batch):
+        for job, raw in batch:
+            self.spool_writer.add_job(self.version_source, self.columns, job, raw)
+
+    async def _write(self, batch):
+        if self.pool is None:
+            raise ConnectionError("PostgreSQL is unreachable")
+        batch = job_history.unique_by_url(batch, lambda item: item[0])
+        rows = json.dumps([{c: job[c] for c in self.columns} for job, _ in batch], default=str)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                written = {r['job_url']: r['inserted'] for r in await conn.fetch(self._insert_sql, rows)}
+                new_jobs = [(job, raw) for job, raw in batch if written.get(job['job_url'])]
+                await self._write_side_tables(conn, new_jobs, changed=bool(written))
+        self.updated += len(written) - len(new_jobs)
+        return len(new_jobs)
+
+    async def _write_side_tables(self, conn, new_jobs, changed):
+        if not changed:
+            return
+        raw_rows = [(job['job_url'], job['source'], job.get('external_id'), raw) for job, raw in new_jobs if raw is not None]
+        if raw_rows:
+            # zstd at level 10 is CPU work - keep it off the event loop
+            compressed = await asyncio.to_thread(
+                lambda: [(url, source, ext_id, job_raw_store.compress_payload(raw)) for url, source, ext_id, raw in raw_rows])
+            await conn.executemany(asyncpg_sql(job_raw_store.INSERT_SQL), compressed)
+
+        job_rollup = rollups.JobRollupAccumulator()
+        for job, _ in new_jobs:
+            day = (job.get('collected_at') or datetime.utcnow()).date()
+            job_rollup.add(day, job['source'], job['company_name'], job['tags'], job['is_remote'])
+        if job_rollup.tags:
+            await conn.executemany(asyncpg_sql(rollups.UPSERT_TAG_SQL), [k + tuple(v) for k, v in job_rollup.tags.items()])
+        if job_rollup.companies:
+            await conn.executemany(asyncpg_sql(rollups.UPSERT_COMPANY_SQL), [k + tuple(v) for k, v in job_rollup.companies.items()])
+
+        await conn.execute(asyncpg_sql(ingest_version.BUMP_SQL), self.version_source, datetime.utcnow()) # New or edited rows
+
+
+class MongoBatchWriter(BatchWriter):
+    """Writes each batch of documents with an unordered insert_many.
+    Duplicates are rejected by the unique (source, source_specific_id) index.
+    The source's ingest version is bumped once on close if anything was new."""
+
+    def __init__(self, collection, version_source, metrics, batch_size=MONGO_BATCH_SIZE, checkpoint=None,
+                 spool_writer=None, seen=None):
+        super().__init__(metrics, batch_size, checkpoint, spool_writer, seen)
+        self.collection = collection
+        self.version_source = version_source
+
+    async def add(self, docs):
+        await self._buffer(docs)
+
+    def _key(self, doc):
+        return doc['source_specific_id']
+
+    def _spool(self, batch):
+        self.spool_writer.add_posts(self.version_source, batch)
+
+    async def _write(self, batch):
+        from pymongo.errors import BulkWriteError
+        if self.collection is None:
+            raise ConnectionError("MongoDB is unreachable")
+        try:
+            result = await self.collection.insert_many(batch, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as bwe:
+            # ordered=False reports duplicates here after inserting everything else
+            if any(err.get('code') != 11000 for err in bwe.details.get('writeErrors', [])):
+                raise
+            return bwe.details.get('nInserted', 0)
+
+    async def close(self):
+        await super().close()
+        if not self.inserted:
+            return
+        try:
+            await ingest_version.bump_mongo_async(self.collection.database, self.version_source)
+        except Exception as version_err:
+            print(f">>> [{self.version_source}] Warning: Could not bump ingest version: {version_err}")
+            self.metrics.incr('errors')
+
+
+# --- Per-source collection ---
+class SourceRun:
+    def __init__(self, name, session, writer, archive=None, units=None):
+        self.name = name
+        self.units = units if units is not None else source_registry.units_for(name) # Registry units to fetch
+        self.session = session
+        self.writer = writer
+        self.metrics = writer.metrics
+        self.checkpoint = writer.checkpoint
+        self.archive = archive or raw_archive.RawArchiveWriter(name)
+        self.unit_errors = 0
+
+    async def fetch(self, method, url, **kwargs):
+        """One HTTP request, retried on transient errors. Returns (status, body bytes)."""
+        return await resilience.retry_async(self._fetch_once, method, url, label=f"[{self.name}] {method} {url}", **kwargs)
+
+    async def _fetch_once(self, method, url, **kwargs):
+        if not await rate_limits.acquire_async(self.name):
+            raise RuntimeError(f"rate limit exhausted for another {rate_limits.blocked_for(self.name):.0f}s - skipped {url}")
+        start = time.perf_counter()
+        body = b''
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                body = await response.read()
+                rate_limits.observe(self.name, response.headers, response.status)
+                response.raise_for_status()
+                return response.status, body
+        finally:
+            self.metrics.add_time('http_fetch', time.perf_counter() - start)
+            self.metrics.incr('bytes_fetched', len(body))
+
+    async def parse(self, func, *args):
+        """Run a CPU-bound parser in a worker thread so other fetches keep going."""
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self.metrics.add_time('parse', time.perf_counter() - start)
+
+
+async def collect_web3career(run):
+    api_key = os.environ.get('WEB3_CAREER_API_KEY')
+    if not api_key:
+        raise RuntimeError("WEB3_CAREER_API_KEY secret not found.")
+    for unit in run.units:
+        await web3career_request(run, api_key, {**WEB3CAREER_PARAMS, 'limit': unit['limit']})
+
+
+async def web3career_request(run, api_key, params):
+    _, body = await run.fetch('GET', WEB3CAREER_ENDPOINT, params={**params, 'token': api_key})
+    raw_data = await run.parse(json.loads, body)
+    run.archive.append(raw_data, meta={'endpoint': WEB3CAREER_ENDPOINT, 'params': params})
+    jobs_list = documents.web3career_entries(raw_data)
+    if jobs_list is None:
+        print(">>> [web3career] Warning: API response structure not as expected (list[2] not found or not a list).")
+        return
+    run.metrics.incr('fetched', len(jobs_list))
+    for job_entry in jobs_list:
+        job = documents.web3career_job(job_entry) if isinstance(job_entry, dict) else None
+        if job and job['title'] and job['job_url']:
+            await run.writer.add(job, raw_payload=job_entry)
+        else:
+            run.writer.skipped += 1
+
+
+def parse_cryptojobslist_page(html, collected_at):
+    """(row count, [job rows]) for one listing page - runs in a worker thread."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'lxml')
+    job_rows = documents.cryptojobslist_rows(soup)
+    if job_rows is None:
+        raise RuntimeError(f"Could not find job rows (selector: '{documents.TABLE_BODY_SELECTOR}'), skipping page.")
+    jobs = [documents.cryptojobslist_job(row, collected_at) for row in job_rows]
+    return len(job_rows), [job for job in jobs if job is not None] # Ads come back as None
+
+
+async def collect_cryptojobslist(run):
+    for unit in run.units:
+        await cryptojobslist_page(run, urljoin(CRYPTOJOBSLIST_URL, unit['query']))
+
+
+async def cryptojobslist_page(run, url):
+    status, body = await run.fetch('GET', url, headers=CRYPTOJOBSLIST_HEADERS)
+    html = body.decode('utf-8', errors='replace')
+    run.archive.append(html, kind='html', meta={'url': url, 'status': status})
+    row_count, jobs = await run.parse(parse_cryptojobslist_page, html, datetime.utcnow())
+    run.metrics.incr('fetched', row_count)
+    for job in jobs:
+        if job['title'] != 'N/A' and job['job_url'] != 'N/A':
+            await run.writer.add(job)
+        else:
+            run.writer.skipped += 1
+
+
+async def reddit_token(run):
+    """App-only OAuth token (the same read-only access PRAW uses)."""
+    import aiohttp
+    client_id = os.environ.get('REDDIT_CLIENT_ID')
+    client_secret = os.environ.get('REDDIT_CLIENT_SECRET')
+    user_agent = os.environ.get('REDDIT_USER_AGENT')
+    if not all([client_id, client_secret, user_agent]):
+        raise RuntimeError("Missing Reddit credentials in Replit Secrets.")
+    _, body = await run.fetch('POST', REDDIT_TOKEN_URL, data={'grant_type': 'client_credentials'},
+                              auth=aiohttp.BasicAuth(client_id, client_secret), headers={'User-Agent': user_agent})
+    return {'Authorization': f"bearer {json.loads(body)['access_token']}", 'User-Agent': user_agent}
+
+
+async def reddit_listing(run, headers, path, params, method, query):
+    unit = f"{method}:{query}" # Same units as collect_reddit.py, so either engine can resume the other
+    if run.checkpoint.is_done(unit):
+        return
+    failures_at_start = run.writer.failed_batches
+    _, body = await run.fetch('GET', f"{REDDIT_API}{path}", headers=headers, params={**params, 'raw_json': 1})
+    children = [child['data'] for child in json.loads(body)['data']['children']]
+    # Dedupe within the listing (search results can repeat) - the unique index handles the rest
+    unique = list({data['id']: data for data in children}.values())
+    run.archive.append(unique, meta={'method': method, 'query': query})
+    run.metrics.incr('fetched', len(children))
+    collected_at = datetime.utcnow()
+    await run.writer.add([documents.create_reddit_doc(documents.archived_submission(data), method, query, collected_at)
+                          for data in unique])
+    await run.writer.finish_unit(unit, failures_at_start)
+
+
+def reddit_listing_args(unit):
+    """(path, params, method, query) of one registry unit - the same request collect_reddit.py makes through PRAW."""
+    if unit['method'] == 'subreddit_new':
+        return f"/r/{unit['query']}/new", {'limit': unit['limit']}, unit['method'], unit['query']
+    search_scope = '+'.join(unit['scope'])
+    params = {'q': unit['query'], 'sort': 'new', 'restrict_sr': 'on', 'limit': unit['limit']}
+    return f"/r/{search_scope}/search", params, unit['method'], unit['query']
+
+
+async def collect_reddit(run):
+    headers = await reddit_token(run)
+    await gather_units(run, [reddit_listing(run, headers, *reddit_listing_args(unit)) for unit in run.units])
+
+
+async def twitter_search(run, headers, query, limit):
+    import tweepy # Only for its Tweet model, so documents match collect_twitter.py exactly
+    unit = f"search_recent:{query}"
+    if run.checkpoint.is_done(unit):
+        return
+    failures_at_start = run.writer.failed_batches
+    params = {'query': query, 'max_results': limit, 'tweet.fields': ','.join(documents.TWEET_FIELDS)}
+    _, body = await run.fetch('GET', TWITTER_SEARCH_URL, headers=headers, params=params)
+    response = json.loads(body)
+    if not response.get('data'):
+        if response.get('errors'):
+            print(f"  > [twitter] API returned errors for '{query}': {response['errors']}")
+        else:
+            await run.writer.finish_unit(unit, failures_at_start)
+        return
+    run.archive.append({'data': response['data'], 'meta': response.get('meta')},
+                       meta={'query': query, 'tweet_fields': documents.TWEET_FIELDS})
+    run.metrics.incr('fetched', len(response['data']))
+    collected_at = datetime.utcnow()
+    await run.writer.add([documents.create_tweet_doc(tweepy.Tweet(data), query, collected_at)
+                          for data in response['data']])
+    await run.writer.finish_unit(unit, failures_at_start)
+
+
+def twitter_headers():
+    bearer_token = os.environ.get('TWITTER_BEARER_TOKEN')
+    if not bearer_token:
+        raise RuntimeError("TWITTER_BEARER_TOKEN secret not found.")
+    return {'Authorization': f"Bearer {bearer_token}"}
+
+
+async def collect_twitter(run):
+    headers = twitter_headers()
+    await gather_units(run, [twitter_search(run, headers, unit['query'], unit['limit']) for unit in run.units])
+
+
+async def gather_units(run, units):
+    """Run a source's requests concurrently; one failed listing/query doesn't stop the others."""
+    for result in await asyncio.gather(*units, return_exceptions=True):
+        if isinstance(result, Exception):
+            print(f"  > [{run.name}] Error: {result}")
+            run.metrics.incr('errors')
+            run.unit_errors += 1
+
+
+COLLECTORS = {
+    'web3career': collect_web3career,
+    'cryptojobslist': collect_cryptojobslist,
+    'reddit': collect_reddit,
+    'twitter': collect_twitter,
+}
+
+
+async def run_source(run, collector):
+    start = time.time()
+    print(f"[{run.name}] Starting...")
+    ended = completed = False
+    try:
+        await collector(run)
+        ended = True
+        completed = run.unit_errors == 0
+    except Exception as source_err:
+        print(f">>> [{run.name}] Collection failed: {source_err}")
+        run.metrics.incr('errors')
+    finally:
+        await run.writer.close()
+        run.archive.close()
+    if ended:
+        # Every unit had its turn, failed or not - the next run starts from scratch.
+        # Only a run that was killed or aborted leaves its checkpoint to resume from.
+        run.checkpoint.finish()
+    run.metrics.incr('inserted', run.writer.inserted)
+    run.metrics.incr('updated', run.writer.updated)
+    run.metrics.incr('skipped', run.writer.skipped)
+    run.metrics.incr('spooled', run.writer.spooled)
+    await asyncio.to_thread(run.metrics.write) # Also records the run in the ledger - keep it off the event loop
+    resilience.CircuitBreaker(run.name).record(not resilience.source_run_failed(run.metrics.to_dict()),
+                                               None if completed else 'collection errors')
+    print(f"[{run.name}] Finished in {time.time() - start:.2f}s: "
+          f"inserted={run.writer.inserted}, updated={run.writer.updated}, skipped={run.writer.skipped}, spooled={run.writer.spooled}")
+
+
+# --- Setup ---
+async def open_postgres():
+    import asyncpg
+    pool = await asyncpg.create_pool(os.environ['POSTGRES_URI'], min_size=1, max_size=4)
+    try:
+        async with pool.acquire() as conn:
+            # Tables and indexes come from migrations.py - just make sure they are there
+            version = 0
+            if await conn.fetchval(migrations.HAS_MIGRATIONS_TABLE_SQL):
+                version = await conn.fetchval(migrations.MAX_VERSION_SQL)
+            migrations.check_version('PostgreSQL', version, migrations.POSTGRES_VERSION)
+    except Exception:
+        await pool.close()
+        raise
+    return pool
+
+
+async def open_mongo():
+    from pymongo import AsyncMongoClient
+    mongo_client = AsyncMongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=5000)
+    await mongo_client.admin.command('ping')
+    db = mongo_client['web3_data']
+    # The writers rely on the unique (source, source_specific_id) index from migrations.py for dedupe
+    latest = await db[migrations.MIGRATIONS_TABLE].find_one(sort=[('_id', -1)])
+    try:
+        migrations.check_version('MongoDB', latest['_id'] if latest else 0, migrations.MONGO_VERSION)
+    except RuntimeError:
+        await mongo_client.close()
+        raise
+    return mongo_client, db['social_media_posts']
+
+
+async def open_stores(sources, stores):
+    """Fill `stores` with the databases the sources need. A database that is configured
+    but unreachable stays None - its writers spool to disk instead (see spool.py).
+    Raises RuntimeError if a connection string is missing."""
+    if any(s in JOB_SOURCES for s in sources):
+        if not os.environ.get('POSTGRES_URI'):
+            raise RuntimeError("POSTGRES_URI secret not found or is empty!")
+        try:
+            stores['pg_pool'] = await asyncio.wait_for(open_postgres(), spool.CONNECT_TIMEOUT)
+            print("PostgreSQL pool ready.")
+        except Exception as pg_err:
+            if not spool.is_connection_error(pg_err):
+                raise
+            print(f">>> PostgreSQL unreachable ({pg_err!r}) - job rows will be spooled locally.")
+    if any(s in SOCIAL_SOURCES for s in sources):
+        if not os.environ.get('MONGO_URI'):
+            raise RuntimeError("MONGO_URI secret not found!")
+        try:
+            stores['mongo_client'], stores['posts_collection'] = await open_mongo()
+            print("MongoDB connection successful!")
+        except Exception as mongo_err:
+            if not spool.is_connection_error(mongo_err):
+                raise
+            print(f">>> MongoDB unreachable ({mongo_err!r}) - posts will be spooled locally.")
+
+
+async def close_stores(stores):
+    if stores.get('pg_pool'): await stores['pg_pool'].close()
+    if stores.get('mongo_client'): await stores['mongo_client'].close()
+    for spool_writer in stores.get('spools', {}).values():
+        spool_writer.close()
+    for seen in stores.get('seen', {}).values():
+        seen.save()
+
+
+def new_writer(source, stores, metrics, checkpoint=None):
+    """The batch writer for a source, spooling to disk whenever its database is unreachable."""
+    spools = stores.setdefault('spools', {})
+    seen_filters = stores.setdefault('seen', {}) # One per source, shared by all its writers
+    if source not in seen_filters:
+        seen_filters[source] = seen_filter.SeenFilter(source)
+    if source in JOB_SOURCES:
+        columns = documents.WEB3CAREER_COLUMNS if source == 'web3career' else documents.CRYPTOJOBSLIST_COLUMNS
+        spool_writer = spools.setdefault(spool.JOB_TARGET, spool.SpoolWriter(spool.JOB_TARGET))
+        return PostgresJobWriter(stores.get('pg_pool'), source, columns, metrics,
+                                 checkpoint=checkpoint, spool_writer=spool_writer, seen=seen_filters[source])
+    spool_writer = spools.setdefault(spool.POST_TARGET, spool.SpoolWriter(spool.POST_TARGET))
+    return MongoBatchWriter(stores.get('posts_collection'), source, metrics,
+                            checkpoint=checkpoint, spool_writer=spool_writer, seen=seen_filters[source])
+
+
+async def collect_all(sources, shard=None):
+    import aiohttp
+    units = {name: source_registry.units_for(name, shard) for name in sources}
+    for name in sources:
+        if not units[name]:
+            print(f"[{name}] Skipped: no units in {source_registry.describe(shard)}")
+    sources = [name for name in sources if units[name]]
+    stores = {}
+    try:
+        try:
+            await open_stores(sources, stores)
+        except RuntimeError as config_err:
+            print(f">>> Error: {config_err}")
+            return 1
+
+        connector = aiohttp.TCPConnector(limit_per_host=CONNECTIONS_PER_HOST)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            runs = []
+            for name in sources:
+                breaker = resilience.CircuitBreaker(name)
+                if not breaker.allow():
+                    print(f"[{name}] Skipped: circuit breaker {breaker.describe()}")
+                    continue
+                writer = new_writer(name, stores, RunMetrics(name), checkpoint=resilience.Checkpoint(name))
+                runs.append(run_source(SourceRun(name, session, writer, units=units[name]), COLLECTORS[name]))
+            await asyncio.gather(*runs)
+        return 0
+    finally:
+        await close_stores(stores)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collect every source on one asyncio event loop.")
+    parser.add_argument('--only', choices=list(COLLECTORS), action='append',
+                        help='Collect just this source (can be repeated)')
+    parser.add_argument('--shard', type=source_registry.parse_shard,
+                        default=source_registry.shard_option([]), # COLLECTOR_SHARD, if set
+                        help='Collect only runner i of N\'s share of the registry units (i/N)')
+    parser.add_argument('--profile', action='store_true', default=profiling.profile_option([]), # COLLECTOR_PROFILE, if set
+                        help='Sample the run and write flame graph files to profiles/ (see profiling.py)')
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiling.start('async_collector')
+    sources = args.only or list(COLLECTORS)
+
+    print(f"--- Starting Async Collection ({', '.join(sources)}, {source_registry.describe(args.shard)}) "
+          f"at {datetime.utcnow().isoformat()} ---")
+    start = time.time()
+    try:
+        exit_code = asyncio.run(collect_all(sources, args.shard))
+    except Exception as setup_err:
+        print(f">>> Async collection setup failed: {setup_err}")
+        exit_code = 1
+    print(f"--- Async Collection Finished in {time.time() - start:.2f}s ---")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,10 +5,29 @@ import json          # To print output nicely
 import time          # For delays
 from datetime import datetime # Timestamps
 from pymongo import MongoClient # MongoDB Driver
-from pymongo.errors import ConnectionFailure, DuplicateKeyError # Error types
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, BulkWriteError # Error types
 import sys
+from run_metrics import RunMetrics # Shared stage timers/counters
+import raw_archive # Raw response archive + replay
+import ingest_version # Cache-invalidation stamp for readers
+import rate_limits # Shared per-API token buckets
+import resilience # Retry with backoff + checkpoints
+import spool # Local write-ahead spool for database outages
+import migrations # Schema version check
+import source_registry # Subreddits / searches to fetch (sources.json) and --shard
+import seen_filter # Local Bloom filter of post IDs already stored
+import pipeline # Overlapped fetch / parse / write stages
+import profiling # --profile
+from documents import create_reddit_doc, submission_payload, archived_submission # Shared post schema
 
+profiling.start_if_requested('collect_reddit') # Samples the rest of the run, report at exit
 print("--- Starting Reddit Collection Script ---")
+metrics = RunMetrics('reddit')
+replay = raw_archive.replay_options()
+archive = raw_archive.RawArchiveWriter('reddit', enabled=not replay.replay)
+checkpoint = resilience.Checkpoint('reddit', enabled=not replay.replay) # Listings already stored by a crashed run
+post_spool = spool.SpoolWriter(spool.POST_TARGET) # Used only while the database is unreachable
+seen = seen_filter.SeenFilter('reddit') # Post IDs the database already has
 
 # --- Database Connection Setup ---
 mongo_client = None
@@ -22,169 +41,239 @@ try:
         sys.exit(1)
 
     print("Connecting to MongoDB Atlas...")
-    mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+    mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=spool.CONNECT_TIMEOUT * 1000)
     mongo_client.admin.command('ismaster') # Force connection check
     db = mongo_client['web3_data'] # Use same DB name as Twitter script
     posts_collection = db['social_media_posts'] # Use same collection
     print("MongoDB connection successful!")
-    # Ensure index exists for duplicate checking
-    # Using a compound index on source and source_specific_id for uniqueness across platforms
-    posts_collection.create_index([("source", 1), ("source_specific_id", 1)], unique=True)
-    print("Compound unique index on ('source', 'source_specific_id') ensured.")
+    # Duplicate checking relies on the unique (source, source_specific_id) index from migrations.py
+    migrations.require_mongo(db)
 
 except ConnectionFailure as conn_err:
      print(f">>> MongoDB Atlas Connection Failure: {conn_err}")
      if mongo_client: mongo_client.close()
-     sys.exit(1)
+     # Still collect - spool.py writes the posts once Atlas is back
+     mongo_client = db = posts_collection = None
+     print(">>> Posts will be spooled locally (see spool.py).")
 except Exception as db_err:
     print(f">>> MongoDB connection/setup error: {db_err}")
     if mongo_client: mongo_client.close()
     sys.exit(1)
 
-# --- Reddit API Setup ---
+# --- Reddit API Setup (not needed when replaying the archive) ---
 reddit = None
-try:
-    print("\nReading Reddit credentials from Replit Secrets...")
-    client_id = os.environ.get('REDDIT_CLIENT_ID')
-    client_secret = os.environ.get('REDDIT_CLIENT_SECRET')
-    user_agent = os.environ.get('REDDIT_USER_AGENT')
-    if not all([client_id, client_secret, user_agent]):
-        print(">>> Error: Missing Reddit credentials in Replit Secrets.")
+if not replay.replay:
+    try:
+        print("\nReading Reddit credentials from Replit Secrets...")
+        client_id = os.environ.get('REDDIT_CLIENT_ID')
+        client_secret = os.environ.get('REDDIT_CLIENT_SECRET')
+        user_agent = os.environ.get('REDDIT_USER_AGENT')
+        if not all([client_id, client_secret, user_agent]):
+            print(">>> Error: Missing Reddit credentials in Replit Secrets.")
+            sys.exit(1)
+        print("Reddit credentials loaded.")
+        print(f"User Agent: {user_agent}")
+
+        print("\nAttempting to authenticate with Reddit (read-only)...")
+        reddit = praw.Reddit(
+            client_id=client_id,
+            client_secret=client_secret,
+            user_agent=user_agent,
+            read_only=True
+        )
+        print(f"Authenticated successfully via PRAW. Read Only Mode: {reddit.read_only}")
+    except Exception as praw_err:
+        print(f">>> Error initializing PRAW or authenticating: {praw_err}")
+        if mongo_client: mongo_client.close() # Close DB if PRAW fails
         sys.exit(1)
-    print("Reddit credentials loaded.")
-    print(f"User Agent: {user_agent}")
-
-    print("\nAttempting to authenticate with Reddit (read-only)...")
-    reddit = praw.Reddit(
-        client_id=client_id,
-        client_secret=client_secret,
-        user_agent=user_agent,
-        read_only=True
-    )
-    print(f"Authenticated successfully via PRAW. Read Only Mode: {reddit.read_only}")
-except Exception as praw_err:
-    print(f">>> Error initializing PRAW or authenticating: {praw_err}")
-    if mongo_client: mongo_client.close() # Close DB if PRAW fails
-    sys.exit(1)
 
-# --- Collection Configuration ---
-target_subreddits = ['ethereum', 'CryptoCurrency', 'web3'] # Removed non-existent ones
-search_keywords = ['web3 developer salary', 'Coinbase hiring', 'blockchain skill demand', 'remote web3 role']
-collection_limit_per_source = 15 # Increase slightly if desired
+# --- Collection Configuration (units from sources.json, this runner's shard only) ---
+shard = source_registry.shard_option()
+subreddit_units = source_registry.units_for('reddit', shard, method='subreddit_new')
+search_units = source_registry.units_for('reddit', shard, method='search')
+print(f"Collecting {len(subreddit_units)} subreddits and {len(search_units)} searches ({source_registry.describe(shard)}).")
 
 # --- Collect and Insert ---
+WRITE_BATCH_SIZE = 500 # Posts per insert_many - several listings share one write
+WRITE_BATCH_SECONDS = 5 # ... but none waits longer than this for the next listing
 inserted_count = 0
 skipped_count = 0
 total_processed = 0
 
-# Function to create document structure consistently
-def create_reddit_doc(submission, source_method, source_query):
-    return {
-        'source': 'reddit',
-        'source_method': source_method,
-        'source_query': source_query,
-        'source_specific_id': submission.id, # Use Reddit's submission ID
-        'title': submission.title,
-        'text': submission.selftext,
-        'author': submission.author.name if submission.author else '[deleted]',
-        'subreddit': submission.subreddit.display_name,
-        'url': f"https://www.reddit.com{submission.permalink}",
-        'score': submission.score,
-        'upvote_ratio': submission.upvote_ratio,
-        'num_comments': submission.num_comments,
-        'created_utc': datetime.utcfromtimestamp(submission.created_utc), # Store as datetime
-        'collected_at': datetime.utcnow(), # Store as datetime
-        # Optional: Store original PRAW object data if needed later
-        # 'raw_data': vars(submission) # Be careful, can be large/complex
-    }
-
-# --- Collect from Subreddits (New Posts) ---
-print(f"\nFetching {collection_limit_per_source} new posts from subreddits: {target_subreddits}...")
+# PRAW already parses Reddit's x-ratelimit-* headers - hand them on to the shared bucket
+def observe_reddit_limits():
+    limiter = getattr(getattr(reddit, '_core', None), '_rate_limiter', None)
+    if limiter is not None and limiter.remaining is not None and limiter.reset_timestamp:
+        rate_limits.observe_limits('reddit', limiter.remaining, limiter.reset_timestamp - time.time())
+
+# One listing request, retried on transient errors (PRAW listings are lazy - materialise them
+# so the network time is measured on its own)
+def fetch_listing(label, make_listing):
+    def attempt():
+        with metrics.stage('http_fetch'):
+            return list(make_listing())
+    submissions = resilience.retry_call(attempt, label=label)
+    observe_reddit_limits()
+    return submissions
+
+# Insert one batch, ignoring duplicates. Returns (inserted, skipped, stored) - stored is False if the write failed.
+def store_batch(posts_to_insert, processed_in_batch, label):
+    global posts_collection
+    # Posts we certainly stored already never reach MongoDB
+    fresh_posts = seen.drop_seen(posts_to_insert, lambda doc: doc['source_specific_id'])
+    batch_filtered = len(posts_to_insert) - len(fresh_posts)
+    posts_to_insert = fresh_posts
+    if not posts_to_insert:
+        print(f"  Processed: {processed_in_batch}, No unique items found to insert.")
+        return 0, batch_filtered, True
+    if posts_collection is None:
+        post_spool.add_posts('reddit', posts_to_insert)
+        print(f"  Processed: {processed_in_batch}, Spooled: {len(posts_to_insert)} (database unreachable)")
+        return 0, batch_filtered, True # Durable on disk - safe to checkpoint
+    failed_indexes = set()
+    try:
+        # Use insert_many with ordered=False to continue on duplicate errors
+        with metrics.stage('db_write'):
+            insert_result = posts_collection.insert_many(posts_to_insert, ordered=False)
+        batch_inserted = len(insert_result.inserted_ids)
+    except BulkWriteError as bwe:
+        # ordered=False reports duplicates here after inserting everything else
+        batch_inserted = bwe.details.get('nInserted', 0)
+        failed_indexes = {err['index'] for err in bwe.details.get('writeErrors', []) if err.get('code') != 11000}
+    except DuplicateKeyError:
+        batch_inserted = 0
+    except Exception as batch_err:
+        if spool.is_connection_error(batch_err):
+            print(f"  > Lost MongoDB during bulk insert for {label} ({batch_err}) - spooling the rest of this run.")
+            posts_collection = None
+            batch_inserted, batch_skipped, stored = store_batch(posts_to_insert, processed_in_batch, label)
+            return batch_inserted, batch_skipped + batch_filtered, stored
+        print(f"  > Error during bulk insert for {label}: {batch_err}")
+        metrics.incr('errors')
+        return 0, len(posts_to_insert), False
+    batch_skipped = len(posts_to_insert) - batch_inserted - len(failed_indexes)
+    print(f"  Processed: {processed_in_batch}, Inserted: {batch_inserted}, Skipped (duplicates): {batch_skipped}")
+    # Inserted or rejected as a duplicate key - either way the database has them
+    seen.mark(doc['source_specific_id'] for index, doc in enumerate(posts_to_insert) if index not in failed_indexes)
+    if failed_indexes:
+        # Rejected for another reason: count them and leave the unit unfinished so it is retried
+        print(f"  > {len(failed_indexes)} posts for {label} were rejected by MongoDB.")
+        metrics.incr('errors', len(failed_indexes))
+        return batch_inserted, batch_skipped + batch_filtered, False
+    return batch_inserted, batch_skipped + batch_filtered, True
+
 try:
-    for sub_name in target_subreddits:
-        print(f" Accessing r/{sub_name}...")
-        subreddit = reddit.subreddit(sub_name)
-        posts_to_insert = []
-        processed_in_batch = 0
-        try:
-            for submission in subreddit.new(limit=collection_limit_per_source):
-                processed_in_batch += 1
-                reddit_doc = create_reddit_doc(submission, 'subreddit_new', sub_name)
-                posts_to_insert.append(reddit_doc)
+    if replay.replay:
+        # --- Replay archived listings instead of calling Reddit ---
+        print(f"\nReplaying archived Reddit listings (since={replay.since}, until={replay.until})...")
+        for record in raw_archive.iter_records('reddit', replay.since, replay.until):
+            meta = record['meta']
+            label = f"{meta['method']} '{meta['query']}'"
+            print(f" Replaying {label} fetched at {record['fetched_at']}...")
+            collected_at = datetime.fromisoformat(record['fetched_at'])
+            with metrics.stage('parse'):
+                posts_to_insert = [
+                    create_reddit_doc(archived_submission(payload), meta['method'], meta['query'], collected_at)
+                    for payload in record['payload']
+                ]
+            total_processed += len(posts_to_insert)
+            batch_inserted, batch_skipped, _ = store_batch(posts_to_insert, len(posts_to_insert), label)
+            inserted_count += batch_inserted
+            skipped_count += batch_skipped
+    else:
+        # --- Subreddits (new posts), then keyword searches, through one pipeline ---
+        # The next listing is fetched while the previous one is parsed and earlier ones are
+        # written (see pipeline.py). PRAW isn't thread-safe, so there is a single fetch worker.
+        print(f"\nFetching new posts from subreddits: {[unit['query'] for unit in subreddit_units]}, "
+              f"then searching (sorted by 'new') for {len(search_units)} keywords...")
+        listing_work = [('subreddit_new', unit) for unit in subreddit_units] + [('search', unit) for unit in search_units]
+        rate_limited = False
+
+        # Fetch stage: one listing -> (unit, label, submissions), or nothing if skipped or failed
+        def fetch_unit(work):
+            global rate_limited
+            method, source_unit = work
+            query = source_unit['query']
+            unit = f"{method}:{query}"
+            label = f"r/{query}" if method == 'subreddit_new' else f"keyword '{query}'"
+            if checkpoint.is_done(unit):
+                print(f" {label} already stored by the interrupted run - skipping.")
+                return None
+            if rate_limited:
+                return None
+            if not rate_limits.acquire('reddit'):
+                print(f"  > Reddit rate limit exhausted for another {rate_limits.blocked_for('reddit'):.0f}s - skipping remaining listings.")
+                rate_limited = True
+                return None
+            try:
+                if method == 'subreddit_new':
+                    print(f" Accessing r/{query}...")
+                    submissions = fetch_listing(label, lambda: reddit.subreddit(query).new(limit=source_unit['limit']))
+                else:
+                    search_scope = '+'.join(source_unit['scope'])
+                    print(f" Searching for '{query}' in r/{search_scope}...")
+                    submissions = fetch_listing(f"search '{query}'", lambda: reddit.subreddit(search_scope).search(
+                        query, limit=source_unit['limit'], sort='new'
+                    ))
+            except Exception as fetch_err:
+                print(f"  > Error fetching {label}: {fetch_err}")
+                metrics.incr('errors')
+                return None
+            return [(method, query, unit, label, submissions)]
+
+        # Parse stage: archive the listing and build its documents -> (unit, label, processed, docs)
+        def parse_unit(fetched):
+            method, query, unit, label, submissions = fetched
+            try:
+                if method == 'search':
+                    with metrics.stage('dedupe'):
+                        # Search results can repeat a submission - keep the first (full check happens on insert)
+                        unique_ids = set()
+                        unique_submissions = []
+                        for submission in submissions:
+                            if submission.id not in unique_ids:
+                                unique_submissions.append(submission)
+                                unique_ids.add(submission.id)
+                else:
+                    unique_submissions = submissions
+                archive.append([submission_payload(s) for s in unique_submissions], meta={'method': method, 'query': query})
+                with metrics.stage('parse'):
+                    posts = [create_reddit_doc(submission, method, query) for submission in unique_submissions]
+            except Exception as parse_err:
+                print(f"  > Error processing {label}: {parse_err}")
+                metrics.incr('errors')
+                return None
+            return [(unit, label, len(submissions), posts)]
+
+        # Sink (main thread): one insert_many for every listing that arrived since the last flush
+        def write_listings(listings):
+            global inserted_count, skipped_count, total_processed
+            posts_to_insert = [post for _, _, _, posts in listings for post in posts]
+            processed_in_batch = sum(processed for _, _, processed, _ in listings)
             total_processed += processed_in_batch
+            batch_inserted, batch_skipped, stored = store_batch(
+                posts_to_insert, processed_in_batch, ', '.join(label for _, label, _, _ in listings))
+            inserted_count += batch_inserted
+            skipped_count += batch_skipped
+            if stored:
+                for unit, _, _, _ in listings:
+                    checkpoint.mark(unit)
 
-            # Attempt to insert batch, ignoring duplicates
-            if posts_to_insert:
-                 try:
-                      # Use insert_many with ordered=False to continue on duplicate errors
-                      insert_result = posts_collection.insert_many(posts_to_insert, ordered=False)
-                      inserted_count += len(insert_result.inserted_ids)
-                      skipped_in_batch = processed_in_batch - len(insert_result.inserted_ids)
-                      skipped_count += skipped_in_batch
-                      print(f"  Processed: {processed_in_batch}, Inserted: {len(insert_result.inserted_ids)}, Skipped (duplicates): {skipped_in_batch}")
-                 except DuplicateKeyError:
-                     # This might still catch if the *whole batch* only contains duplicates (less likely)
-                     skipped_count += len(posts_to_insert)
-                     print(f"  Processed: {processed_in_batch}, Inserted: 0, Skipped (all duplicates).")
-                 except Exception as batch_err:
-                      print(f"  > Error during bulk insert for r/{sub_name}: {batch_err}")
-                      # Consider incrementing skipped_count for all attempted in failed batch
-                      skipped_count += len(posts_to_insert)
-
-        except Exception as sub_err:
-            print(f"  > Error processing subreddit r/{sub_name}: {sub_err}")
-        time.sleep(1)
-
-except Exception as e:
-    print(f">>> Error during subreddit collection phase: {e}")
-
-# --- Collect using Search Keywords ---
-print(f"\nSearching top {collection_limit_per_source} posts (sorted by 'new') using keywords...")
-search_scope = '+'.join(target_subreddits)
-print(f"Search Scope: r/{search_scope}")
-try:
-    for keyword in search_keywords:
-        print(f" Searching for '{keyword}'...")
-        posts_to_insert = []
-        processed_in_batch = 0
+        reddit_pipeline = pipeline.Pipeline('reddit').stage('fetch', fetch_unit).stage('parse', parse_unit)
+        pipeline_failed = False
         try:
-            search_results = reddit.subreddit(search_scope).search(
-                keyword, limit=collection_limit_per_source, sort='new'
-            )
-            unique_ids_in_batch = set() # Track IDs within this search batch
-
-            for submission in search_results:
-                processed_in_batch += 1
-                # Basic check within batch - full check happens on insert
-                if submission.id not in unique_ids_in_batch:
-                    reddit_doc = create_reddit_doc(submission, 'search', keyword)
-                    posts_to_insert.append(reddit_doc)
-                    unique_ids_in_batch.add(submission.id)
-                # Else: likely duplicate within search results, don't even add to batch
-            total_processed += processed_in_batch
+            reddit_pipeline.run(listing_work, pipeline.BatchSink(
+                write_listings, max_items=WRITE_BATCH_SIZE, max_seconds=WRITE_BATCH_SECONDS,
+                weight=lambda listing: len(listing[3])))
+        except Exception as e:
+            print(f">>> Error during Reddit collection: {e}")
+            pipeline_failed = True
+        print(f"  {reddit_pipeline.describe()}")
 
-            if posts_to_insert:
-                try:
-                     insert_result = posts_collection.insert_many(posts_to_insert, ordered=False)
-                     inserted_count += len(insert_result.inserted_ids)
-                     skipped_in_batch = len(posts_to_insert) - len(insert_result.inserted_ids)
-                     skipped_count += skipped_in_batch
-                     print(f"  Processed: {processed_in_batch}, Inserted: {len(insert_result.inserted_ids)}, Skipped (duplicates): {skipped_in_batch}")
-                except DuplicateKeyError:
-                    skipped_count += len(posts_to_insert)
-                    print(f"  Processed: {processed_in_batch}, Inserted: 0, Skipped (all duplicates).")
-                except Exception as batch_err:
-                     print(f"  > Error during bulk insert for keyword '{keyword}': {batch_err}")
-                     skipped_count += len(posts_to_insert)
-            else:
-                print(f"  Processed: {processed_in_batch}, No unique items found to insert.")
-
-        except Exception as search_err:
-            print(f"  > Error processing search for '{keyword}': {search_err}")
-        time.sleep(2)
-
-except Exception as e:
-    print(f">>> Error during search collection phase: {e}")
+        # Every listing got its turn (or the rate limit ended the run) - the next run starts from scratch.
+        # Only a run that was killed or aborted mid-way leaves its checkpoint to resume from.
+        if not pipeline_failed:
+            checkpoint.finish()
 
 
 # --- Cleanup ---
@@ -193,6 +282,23 @@ finally:
     print(f"Total Reddit Items Processed (approx): {total_processed}")
     print(f"New Items Inserted: {inserted_count}")
     print(f"Items Skipped (Duplicate/Error): {skipped_count}")
+    if post_spool.records_written:
+        print(f"Items Spooled (database unreachable): {post_spool.records_written}")
+    metrics.incr('fetched', total_processed)
+    metrics.incr('inserted', inserted_count)
+    metrics.incr('skipped', skipped_count)
+    metrics.incr('spooled', post_spool.records_written)
+    metrics.incr('filtered', seen.dropped)
+    if inserted_count:
+        try:
+            ingest_version.bump_mongo(db, 'reddit')
+        except Exception as version_err:
+            print(f">>> Warning: Could not bump ingest version: {version_err}")
+            metrics.incr('errors')
+    metrics.write()
+    archive.close()
+    post_spool.close()
+    seen.save()
 
     print("Closing MongoDB connection...")
     if mongo_client:
@@ -200,4 +306,4 @@ finally:
         print("MongoDB connection closed.")
     else:
         print("No MongoDB connection was active.")
-    print("\n--- Reddit Collection Script Finished ---")
\ No newline at end of file
+    print("\n--- Reddit Collection Script Finished ---")
@@ -1,13 +1,32 @@
 import tweepy
+import requests
 import os
 import json
-import time
 from datetime import datetime
 from pymongo import MongoClient # Import MongoDB Driver
-from pymongo.errors import ConnectionFailure # Import specific error type
+from pymongo.errors import ConnectionFailure, BulkWriteError # Import specific error types
 import sys
+from run_metrics import RunMetrics # Shared stage timers/counters
+import raw_archive # Raw response archive + replay
+import ingest_version # Cache-invalidation stamp for readers
+import rate_limits # Shared per-API token buckets
+import resilience # Retry with backoff + checkpoints
+import spool # Local write-ahead spool for database outages
+import migrations # Schema version check
+import source_registry # Search queries to run (sources.json) and --shard
+import seen_filter # Local Bloom filter of tweet IDs already stored
+import pipeline # Overlapped fetch / parse / write stages
+import profiling # --profile
+from documents import create_tweet_doc, TWEET_FIELDS # Shared post schema
 
+profiling.start_if_requested('collect_twitter') # Samples the rest of the run, report at exit
 print("--- Starting Twitter Collection Script ---")
+metrics = RunMetrics('twitter')
+replay = raw_archive.replay_options()
+archive = raw_archive.RawArchiveWriter('twitter', enabled=not replay.replay)
+checkpoint = resilience.Checkpoint('twitter', enabled=not replay.replay) # Queries already stored by a crashed run
+post_spool = spool.SpoolWriter(spool.POST_TARGET) # Used only while the database is unreachable
+seen = seen_filter.SeenFilter('twitter') # Tweet IDs the database already has
 
 # --- Database Connection Setup ---
 mongo_client = None
@@ -23,7 +42,7 @@ try:
 
     print("Connecting to MongoDB Atlas...")
     # Set serverSelectionTimeoutMS to handle connection issues better
-    mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+    mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=spool.CONNECT_TIMEOUT * 1000)
     # The ismaster command is cheap and does not require auth.
     mongo_client.admin.command('ismaster') # Force connection check
     # Choose/create your database (e.g., 'web3_data')
@@ -31,129 +50,240 @@ try:
     # Choose/create your collection (e.g., 'social_media_posts')
     posts_collection = db['social_media_posts']
     print("MongoDB connection successful!")
-    # Optional: Create an index on tweet_id for faster duplicate checks if needed
-    # posts_collection.create_index("source_specific_id", unique=True) # If making ID unique
-    posts_collection.create_index("source_specific_id") # Index for faster searching
-    posts_collection.create_index("source")
-    print("Index on 'source_specific_id' ensured.")
+    # Duplicate checks use the unique (source, source_specific_id) index from migrations.py
+    migrations.require_mongo(db)
 
 except ConnectionFailure as conn_err:
      print(f">>> MongoDB Atlas Connection Failure: {conn_err}")
      print(">>> Check your MONGO_URI string, network access rules in Atlas, and if the cluster is active.")
      if mongo_client: mongo_client.close()
-     sys.exit(1)
+     # Still collect - spool.py writes the tweets once Atlas is back
+     mongo_client = db = posts_collection = None
+     print(">>> Tweets will be spooled locally (see spool.py).")
 except Exception as db_err:
     print(f">>> MongoDB connection/setup error: {db_err}")
     if mongo_client: mongo_client.close()
     sys.exit(1)
 
 
-# --- Twitter API Setup ---
+# --- Twitter API Setup (not needed when replaying the archive) ---
 bearer_token = None
 client = None
-try:
-    print("\nReading Twitter credentials (Bearer Token) from Replit Secrets...")
-    bearer_token = os.environ.get('TWITTER_BEARER_TOKEN')
-    if not bearer_token:
-        print(">>> Error: TWITTER_BEARER_TOKEN secret not found.")
+if not replay.replay:
+    try:
+        print("\nReading Twitter credentials (Bearer Token) from Replit Secrets...")
+        bearer_token = os.environ.get('TWITTER_BEARER_TOKEN')
+        if not bearer_token:
+            print(">>> Error: TWITTER_BEARER_TOKEN secret not found.")
+            sys.exit(1)
+        print("Bearer Token loaded successfully.")
+
+        print("\nInitializing Tweepy v2 Client...")
+        # Raw responses, so the rate-limit headers reach rate_limits.py (tweepy's own wait can stall for 15 minutes)
+        client = tweepy.Client(bearer_token=bearer_token, return_type=requests.Response)
+        print("Tweepy v2 Client initialized successfully.")
+    except Exception as api_err:
+        print(f">>> Twitter API setup error: {api_err}")
+        if mongo_client: mongo_client.close() # Close DB connection on early exit
         sys.exit(1)
-    print("Bearer Token loaded successfully.")
-
-    print("\nInitializing Tweepy v2 Client...")
-    client = tweepy.Client(bearer_token=bearer_token, wait_on_rate_limit=True)
-    print("Tweepy v2 Client initialized successfully.")
-except Exception as api_err:
-    print(f">>> Twitter API setup error: {api_err}")
-    if mongo_client: mongo_client.close() # Close DB connection on early exit
-    sys.exit(1)
 
 
-# --- Search Configuration ---
-search_queries = [
-    '(#Web3Jobs OR #CryptoHiring OR #BlockchainCareers) -is:retweet lang:en',
-    '("web3 developer salary" OR "blockchain developer pay") -is:retweet lang:en',
-    '(from:Coinbase OR from:binance OR from:ethereum) (hiring OR jobs OR career)',
-    '#DeFiJobs -is:retweet lang:en'
-]
-collection_limit_per_query = 10
+# --- Search Configuration (queries from sources.json, this runner's shard only) ---
+shard = source_registry.shard_option()
+search_units = source_registry.units_for('twitter', shard)
+print(f"Running {len(search_units)} search queries ({source_registry.describe(shard)}).")
+tweet_fields = TWEET_FIELDS
+
+
+WRITE_BATCH_SIZE = 500 # Tweets per insert_many - several queries share one write
+WRITE_BATCH_SECONDS = 5 # ... but none waits longer than this for the next query
+
+
+# Dedupe and insert one batch of tweets. Returns (inserted, skipped, stored) - stored is False if the write failed.
+def store_tweets(tweets, query, collected_at=None):
+    with metrics.stage('parse'):
+        tweet_docs = [create_tweet_doc(tweet, query, collected_at) for tweet in tweets]
+    return store_tweet_docs(tweet_docs)
+
+
+# Same, for documents already built by create_tweet_doc
+def store_tweet_docs(tweet_docs):
+    global posts_collection
+    with metrics.stage('dedupe'):
+        # Tweets we certainly stored already never reach MongoDB
+        fresh_docs = seen.drop_seen(tweet_docs, lambda doc: doc['source_specific_id'])
+        # Overlapping queries (#Web3Jobs, #DeFiJobs) can return the same tweet within one batch
+        fresh_docs = list({doc['source_specific_id']: doc for doc in fresh_docs}.values())
+    batch_filtered = len(tweet_docs) - len(fresh_docs)
+    tweet_docs = fresh_docs
+    if not tweet_docs:
+        print(f"  All {batch_filtered} tweets were already stored (seen-filter).")
+        return 0, batch_filtered, True
+    if posts_collection is None:
+        inserted, skipped, stored = spool_tweets(tweet_docs)
+        return inserted, skipped + batch_filtered, stored
+    batch_skipped = batch_filtered
+    try:
+        failed_ids = set()
+        try:
+            # Everything past the seen-filter is probably new; the unique (source, source_specific_id)
+            # index rejects the rest as duplicate keys, so no per-tweet lookup first
+            with metrics.stage('db_write'):
+                insert_result = posts_collection.insert_many(tweet_docs, ordered=False) # ordered=False continues on error
+            batch_inserted = len(insert_result.inserted_ids)
+        except BulkWriteError as bwe:
+            # ordered=False reports duplicates (stored meanwhile, e.g. by another runner) after inserting everything else
+            batch_inserted = bwe.details.get('nInserted', 0)
+            failed_ids = {tweet_docs[err['index']]['source_specific_id']
+                          for err in bwe.details.get('writeErrors', []) if err.get('code') != 11000}
+        batch_skipped += len(tweet_docs) - batch_inserted - len(failed_ids)
+        print(f"  Inserted {batch_inserted} new tweets into MongoDB.")
+        # Inserted now or rejected as a duplicate key - both stored
+        seen.mark(doc['source_specific_id'] for doc in tweet_docs if doc['source_specific_id'] not in failed_ids)
+        if failed_ids:
+            # Rejected for another reason: count them and leave the unit unfinished so it is retried
+            print(f"  > {len(failed_ids)} tweets were rejected by MongoDB.")
+            metrics.incr('errors', len(failed_ids))
+            return batch_inserted, batch_skipped, False
+        return batch_inserted, batch_skipped, True
+    except Exception as bulk_err:
+         if spool.is_connection_error(bulk_err):
+             print(f"  > Lost MongoDB ({bulk_err}) - spooling the rest of this run.")
+             posts_collection = None
+             inserted, skipped, stored = spool_tweets(tweet_docs)
+             return inserted, skipped + batch_filtered, stored
+         print(f"  > Error during bulk insert: {bulk_err}")
+         metrics.incr('errors')
+         # Handle potential individual errors if needed, though ordered=False helps
+         return 0, batch_skipped, False
+
+
+# Database unreachable: keep the tweets on disk for spool.py (it dedupes on insert)
+def spool_tweets(tweet_docs):
+    post_spool.add_posts('twitter', tweet_docs)
+    print(f"  Spooled {len(tweet_docs)} tweets (database unreachable).")
+    return 0, 0, True # Durable on disk - safe to checkpoint
 
 
 # --- Execute Searches and Insert into DB ---
-print("\nExecuting search queries for recent tweets (last 7 days)...")
 inserted_count = 0
 skipped_count = 0
 total_processed = 0
 
 try:
-    for query in search_queries:
-        print(f" Searching for: {query}")
-        try:
-            response = client.search_recent_tweets(
-                query,
-                max_results=collection_limit_per_query,
-                tweet_fields=["created_at", "public_metrics", "author_id", "lang", "geo"]
-            )
-
-            if response.data:
-                print(f"  > Received {len(response.data)} tweets.")
-                documents_to_insert = [] # Batch insert for efficiency
-                for tweet in response.data:
-                    total_processed += 1
-                    # Create document structure for MongoDB
-                    tweet_doc = {
-                        'source': 'twitter',
-                        'source_query': query,
-                        'source_method': 'search_recent',
-                        'source_specific_id': str(tweet.id), # Use a consistent ID field name
-                        'text': tweet.text,
-                        'author_id': str(tweet.author_id) if tweet.author_id else None,
-                        'language': tweet.lang,
-                        'created_at': tweet.created_at, # Store as ISODate
-                        'public_metrics': tweet.public_metrics,
-                        'geo': tweet.geo,
-                        'collected_at': datetime.utcnow() # Store as ISODate
-                        # Consider adding original full JSON object if needed: 'raw_response': tweet.data
-                    }
-                    # Basic check for duplicates before adding to batch
-                    # Only add if no doc with this source_specific_id and source='twitter' exists
-                    # More efficient might be insert_many with ordered=False or using ON CONFLICT later
-                    existing_doc = posts_collection.find_one({
-                         "source": "twitter",
-                         "source_specific_id": tweet_doc['source_specific_id']
-                    })
-                    if not existing_doc:
-                        documents_to_insert.append(tweet_doc)
-                    else:
-                         skipped_count += 1
-
-                # Insert the batch of new documents
-                if documents_to_insert:
-                    try:
-                         insert_result = posts_collection.insert_many(documents_to_insert, ordered=False) # ordered=False continues on error
-                         inserted_count += len(insert_result.inserted_ids)
-                         print(f"  Inserted {len(insert_result.inserted_ids)} new tweets into MongoDB.")
-                    except Exception as bulk_err:
-                         print(f"  > Error during bulk insert: {bulk_err}")
-                         # Handle potential individual errors if needed, though ordered=False helps
+    if replay.replay:
+        # --- Replay archived search responses instead of calling Twitter ---
+        print(f"\nReplaying archived search responses (since={replay.since}, until={replay.until})...")
+        for record in raw_archive.iter_records('twitter', replay.since, replay.until):
+            query = record['meta']['query']
+            print(f" Replaying: {query} (fetched at {record['fetched_at']})")
+            tweets = [tweepy.Tweet(tweet_data) for tweet_data in record['payload'].get('data', [])]
+            total_processed += len(tweets)
+            batch_inserted, batch_skipped, _ = store_tweets(tweets, query, datetime.fromisoformat(record['fetched_at']))
+            inserted_count += batch_inserted
+            skipped_count += batch_skipped
+    else:
+        print("\nExecuting search queries for recent tweets (last 7 days)...")
+        # One search request, retried on transient errors; headers feed the shared bucket even on failure
+        def search(query, limit):
+            try:
+                with metrics.stage('http_fetch'):
+                    http_response = client.search_recent_tweets(
+                        query,
+                        max_results=limit,
+                        tweet_fields=tweet_fields
+                    )
+            except tweepy.errors.HTTPException as http_err:
+                rate_limits.observe('twitter', http_err.response.headers, http_err.response.status_code)
+                raise
+            rate_limits.observe('twitter', http_response.headers)
+            return http_response
+
+        # The next search is on the wire while the previous response is parsed and earlier
+        # ones are written (see pipeline.py); one fetch worker keeps the requests in order.
+        rate_limited = False
+
+        # Fetch stage: one query -> (unit, query, tweets), or nothing if skipped or failed
+        def fetch_unit(source_unit):
+            global rate_limited
+            query = source_unit['query']
+            unit = f"search_recent:{query}"
+            if checkpoint.is_done(unit):
+                print(f" Already stored by the interrupted run - skipping: {query}")
+                return None
+            if rate_limited:
+                return None
+            # Shared token bucket instead of fixed sleeps; gives up rather than idling through a 15-minute window
+            if not rate_limits.acquire('twitter'):
+                print(f"  > Twitter rate limit exhausted for another {rate_limits.blocked_for('twitter'):.0f}s - skipping remaining queries.")
+                rate_limited = True
+                return None
+            print(f" Searching for: {query}")
+            try:
+                http_response = resilience.retry_call(search, query, source_unit['limit'], label=f"search '{query}'")
+                metrics.incr('bytes_fetched', len(http_response.content))
+                response = http_response.json()
+                tweets = [tweepy.Tweet(tweet_data) for tweet_data in response.get('data', [])]
+
+                if tweets:
+                    print(f"  > Received {len(tweets)} tweets.")
+                    # response['data'] is the untouched API JSON for each tweet
+                    archive.append({'data': response['data'], 'meta': response.get('meta')},
+                                   meta={'query': query, 'tweet_fields': tweet_fields})
+                elif response.get('errors'):
+                     print(f"  > API returned errors for this query: {response['errors']}")
+                     return None
                 else:
-                    if len(response.data) > skipped_count: # Check if we skipped docs or simply had none to insert
-                        print(f"  No new unique tweets to insert from this batch (Skipped {skipped_count} duplicates).")
+                    print("  No tweets found matching this query in the recent period.")
+                return [(unit, query, tweets)] # Empty queries still reach the sink, which checkpoints them
 
+            except tweepy.errors.TweepyException as e:
+                print(f"  > Tweepy Error processing query '{query}': {e}")
+                metrics.incr('errors')
+                if isinstance(e, tweepy.errors.TooManyRequests):
+                     print(f"  >> Rate limit hit, window resets in {rate_limits.blocked_for('twitter'):.0f}s.")
+                # Other Tweepy error handling here if needed
+            except Exception as e_inner:
+                print(f"  > Unexpected error during query '{query}': {e_inner}")
+                metrics.incr('errors')
+            return None
 
-            elif response.errors:
-                 print(f"  > API returned errors for this query: {response.errors}")
-            else:
-                print("  No tweets found matching this query in the recent period.")
+        # Parse stage: build the documents -> (unit, processed, docs)
+        def parse_unit(fetched):
+            unit, query, tweets = fetched
+            with metrics.stage('parse'):
+                tweet_docs = [create_tweet_doc(tweet, query) for tweet in tweets]
+            return [(unit, len(tweets), tweet_docs)]
 
-        except tweepy.errors.TweepyException as e:
-            print(f"  > Tweepy Error processing query '{query}': {e}")
-            if isinstance(e, tweepy.errors.TooManyRequests):
-                 print("  >> Rate limit hit, Tweepy is pausing automatically...")
-            # Other Tweepy error handling here if needed
-        except Exception as e_inner:
-            print(f"  > Unexpected error during query '{query}': {e_inner}")
+        # Sink (main thread): one insert_many for every query that arrived since the last flush
+        def write_searches(searches):
+            global inserted_count, skipped_count, total_processed
+            tweet_docs = [doc for _, _, docs in searches for doc in docs]
+            total_processed += sum(processed for _, processed, _ in searches)
+            stored = True
+            if tweet_docs:
+                batch_inserted, batch_skipped, stored = store_tweet_docs(tweet_docs)
+                inserted_count += batch_inserted
+                skipped_count += batch_skipped
+            if stored:
+                for unit, _, _ in searches:
+                    checkpoint.mark(unit)
 
-        time.sleep(1) # Small polite pause between distinct queries
+        twitter_pipeline = pipeline.Pipeline('twitter').stage('fetch', fetch_unit).stage('parse', parse_unit)
+        pipeline_failed = False
+        try:
+            twitter_pipeline.run(search_units, pipeline.BatchSink(
+                write_searches, max_items=WRITE_BATCH_SIZE, max_seconds=WRITE_BATCH_SECONDS,
+                weight=lambda search: len(search[2])))
+        except Exception as e:
+            print(f">>> Error during Twitter search: {e}")
+            pipeline_failed = True
+        print(f"  {twitter_pipeline.describe()}")
+
+        # Every query got its turn (or the rate limit ended the run) - the next run starts from scratch.
+        # Only a run that was killed or aborted mid-way leaves its checkpoint to resume from.
+        if not pipeline_failed:
+            checkpoint.finish()
 
 except Exception as e_outer:
     print(f"\n>>> Major error occurred during Twitter search loop: {e_outer}")
@@ -166,6 +296,23 @@ finally:
     print(f"Total Tweets Processed: {total_processed}")
     print(f"New Tweets Inserted: {inserted_count}")
     print(f"Tweets Skipped (Duplicate/Error): {skipped_count}")
+    if post_spool.records_written:
+        print(f"Tweets Spooled (database unreachable): {post_spool.records_written}")
+    metrics.incr('fetched', total_processed)
+    metrics.incr('inserted', inserted_count)
+    metrics.incr('skipped', skipped_count)
+    metrics.incr('spooled', post_spool.records_written)
+    metrics.incr('filtered', seen.dropped)
+    if inserted_count:
+        try:
+            ingest_version.bump_mongo(db, 'twitter')
+        except Exception as version_err:
+            print(f">>> Warning: Could not bump ingest version: {version_err}")
+            metrics.incr('errors')
+    metrics.write()
+    archive.close()
+    post_spool.close()
+    seen.save()
 
     print("Closing MongoDB connection...")
     if mongo_client:
@@ -174,4 +321,4 @@ finally:
     else:
          print("No MongoDB connection was active.")
 
-    print("\n--- Twitter Collection Script Finished ---")
\ No newline at end of file
+    print("\n--- Twitter Collection Script Finished ---")
@@ -2,12 +2,37 @@
 import requests
 import os
 import json
-import time
 from datetime import datetime
 import psycopg2 # Import PostgreSQL driver
 import sys      # To cleanly exit on major errors
-
+from run_metrics import RunMetrics # Shared stage timers/counters
+import raw_archive # Raw response archive + replay
+import job_raw_store # Compressed side table for the original job payloads
+import rollups # Daily tag/company aggregates
+import ingest_version # Cache-invalidation stamp for readers
+import documents # Shared job row mapping
+import job_history # Content-hash upsert (edits are recorded, unchanged rows untouched)
+import retention # last_seen_on stamp for postings still listed
+import rate_limits # Shared per-API token buckets
+import resilience # Retry with backoff
+import spool # Local write-ahead spool for database outages
+import migrations # Schema version check
+import source_registry # Request to make (sources.json) and --shard
+import seen_filter # Local Bloom filter of job URLs already stored
+import profiling # --profile
+
+profiling.start_if_requested('collect_web3career') # Samples the rest of the run, report at exit
 print("--- Starting Web3.Career Collection Script ---")
+metrics = RunMetrics('web3career')
+replay = raw_archive.replay_options()
+shard = source_registry.shard_option()
+source_units = source_registry.units_for('web3career', shard)
+if not replay.replay and not source_units:
+    print(f"Web3.Career is not part of {source_registry.describe(shard)} - nothing to collect.")
+    sys.exit(0)
+archive = raw_archive.RawArchiveWriter('web3career', enabled=not replay.replay)
+job_spool = spool.SpoolWriter(spool.JOB_TARGET) # Used only while the database is unreachable
+seen = seen_filter.SeenFilter('web3career') # Job URLs + content hashes the database already has
 
 # --- Database Connection Setup ---
 db_conn = None
@@ -21,333 +46,200 @@ try:
         sys.exit(1) # Exit if DB URI is missing
 
     print("Connecting to external PostgreSQL database (Neon)...")
-    db_conn = psycopg2.connect(db_uri)
+    db_conn = psycopg2.connect(db_uri, connect_timeout=spool.CONNECT_TIMEOUT)
     db_cursor = db_conn.cursor()
     print("Database connection successful!")
 
-    # Verify table exists (optional check)
-    db_cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'job_postings');")
-    table_exists = db_cursor.fetchone()[0]
-    if not table_exists:
-         print(">>> Error: 'job_postings' table does not exist in the database!")
-         print(">>> Please run the CREATE TABLE script in your Neon SQL Editor first.")
-         sys.exit(1)
-    else:
-        print("'job_postings' table found.")
-
-except Exception as db_err:
-    print(f">>> Database connection error: {db_err}")
-    # Ensure connection/cursor are closed if partially opened
-    if db_cursor: db_cursor.close()
-    if db_conn: db_conn.close()
-    sys.exit(1) # Exit if DB connection fails
-
-# --- API Connection Setup ---
-api_key = None
-try:
-    print("\nReading WEB3_CAREER_API_KEY from Replit Secrets...")
-    api_key = os.environ.get('WEB3_CAREER_API_KEY')
-    if not api_key:
-        print(">>> Error: WEB3_CAREER_API_KEY secret not found.")
-        sys.exit(1)
-    else:
-         print(f"API Key loaded successfully (starts with: {api_key[:4]}...).")
-except Exception as key_err:
-    print(f">>> Error reading API key: {key_err}")
-    sys.exit(1)
-
-
-# --- API Request Configuration ---
-api_endpoint = "https://web3.career/api/v1"
-params = {
-    'token': api_key,
-    'limit': 100,
-    'show_description': 'true'
-    # Add other filters here if needed, e.g.: 'remote': 'true',
-}
-printable_params = {k: v for k, v in params.items() if k != 'token'}
-print(f"\nRequesting data from: {api_endpoint}")
-print(f"With parameters: {printable_params}")
-
-
-# --- Fetch and Process ---
-inserted_count = 0
-skipped_count = 0
-api_error = False
-
-try:
-    print("\nSending GET request to the API...")
-    response = requests.get(api_endpoint, params=params, timeout=25)
-    print(f"API request status: {response.status_code}")
-    response.raise_for_status() # Check for HTTP errors
-
-    print("Attempting to parse JSON response...")
-    raw_data = response.json()
-    print("JSON parsing successful.")
-
-    jobs_list = []
-    if isinstance(raw_data, list) and len(raw_data) > 2 and isinstance(raw_data[2], list):
-        jobs_list = raw_data[2]
-    else:
-        print(">>> Warning: API response structure not as expected (list[2] not found or not a list). Check API documentation or raw response.")
-        # Optional: print raw_data for deep debugging
-        # print(json.dumps(raw_data, indent=2))
-
-    print(f"\nProcessing {len(jobs_list)} potential job entries from API...")
-
-    for job_entry in jobs_list:
-        if not isinstance(job_entry, dict):
-            print(f"Warning: Skipping item, not a dictionary: {job_entry}")
-            skipped_count += 1
-            continue
-
-        # Extract data (use .get with default=None for safety)
-        external_id = str(job_entry.get('id')) if job_entry.get('id') is not None else None
-        title = job_entry.get('title')
-        company = job_entry.get('company')
-        location = job_entry.get('location') # Contains city/country often
-        country = job_entry.get('country')
-        city = job_entry.get('city')
-        apply_url = job_entry.get('apply_url')
-        tags_list = job_entry.get('tags', []) # Ensure it's a list
-        description = job_entry.get('description')
-        date_epoch = job_entry.get('date_epoch')
-        # Infer remote status based on tags or location info if possible
-        is_remote = 'remote' in [tag.lower() for tag in tags_list if isinstance(tag, str)] if tags_list else None
-        # Add a placeholder for salary if the API provides it later
-        salary = job_entry.get('salary_range') # Check actual key name
-
-        # Prepare data for insertion
-        # Only insert if we have a title and a unique URL
-        if title and apply_url:
-            sql_insert_query = """
-                INSERT INTO job_postings (
-                    title, company_name, location, salary_range, tags, source,
-                    job_url, description, external_id, is_remote, date_posted_epoch,
-                    raw_api_response
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                ON CONFLICT (job_url) DO NOTHING;
-            """
-            # Use json.dumps for the raw response if storing it
-            raw_json_str = json.dumps(job_entry) if job_entry else None
-            data_to_insert = (
-                title, company, location, salary, tags_list, 'Web3.Career',
-                apply_url, description, external_id, is_remote, date_epoch,
-                raw_json_str # Insert raw JSON here
-            )
-
-            try:
-                db_cursor.execute(sql_insert_query, data_to_insert)
-                # Check if a row was actually inserted (0 means conflict/duplicate)
-                if db_cursor.rowcount > 0:
-                    inserted_count += 1
-                else:
-                    skipped_count += 1
-            except Exception as insert_err:
-                print(f"  > DB insert error for job ID {external_id} ({title}): {insert_err}")
-                db_conn.rollback() # Rollback failed transaction for this job
-                skipped_count += 1
-        else:
-             print(f"Skipping job entry due to missing title or apply_url: {external_id}")
-             skipped_count += 1
-
-    # Commit all successful insertions after the loop
+    # Tables and indexes are created by migrations.py, not by every run
+    migrations.require_postgres(db_cursor)
     db_conn.commit()
-    print(f"\nDatabase commit successful.")
-
-
-# --- Error Handling for API Request/Parsing ---
-except requests.exceptions.HTTPError as http_err:
-    print(f"\n>>> HTTP error occurred: {http_err}")
-    if response is not None:
-         print(f"Status Code: {response.status_code}, Response: {response.text[:500]}")
-    api_error = True
-except requests.exceptions.RequestException as req_err:
-    print(f"\n>>> Request error occurred: {req_err}")
-    api_error = True
-except json.JSONDecodeError:
-    print("\n>>> Error: Failed to decode JSON response from API.")
-    if response is not None: print(f"Response text snippet: {response.text[:500]}")
-    api_error = True
-except Exception as proc_err:
-    print(f"\n>>> An unexpected error occurred during processing: {proc_err}")
-    api_error = True # Treat as API/Processing error
-    import traceback
-    traceback.print_exc()
-
-
-# --- Cleanup ---
-finally:
-    print("\n--- Final Summary ---")
-    print(f"Jobs Inserted: {inserted_count}")
-    print(f"Jobs Skipped (Duplicate/Error/Incomplete): {skipped_count}")
-    if api_error:
-         print(">>> There was an error fetching or processing data from the API.")
-
-    print("Closing database connection...")
-    if db_cursor: db_cursor.close()
-    if db_conn: db_conn.close()
-    print("Database connection closed.")
-    print("\n--- Web3.Career Collection Script Finished ---")# ----- collect_web3career.py (Updated Version - With PostgreSQL Insertion) -----
-import requests
-import os
-import json
-import time
-from datetime import datetime
-import psycopg2 # Import PostgreSQL driver
-import sys      # To cleanly exit on major errors
-
-print("--- Starting Web3.Career Collection Script ---")
-
-# --- Database Connection Setup ---
-db_conn = None
-db_cursor = None
-try:
-    print("Reading POSTGRES_URI from Replit Secrets...")
-    db_uri = os.environ.get('POSTGRES_URI')
-    if not db_uri:
-        print(">>> Error: POSTGRES_URI secret not found or is empty!")
-        print(">>> Please add the connection string from Neon (or your provider) to Replit Secrets.")
-        sys.exit(1) # Exit if DB URI is missing
-
-    print("Connecting to external PostgreSQL database (Neon)...")
-    db_conn = psycopg2.connect(db_uri)
-    db_cursor = db_conn.cursor()
-    print("Database connection successful!")
-
-    # Verify table exists (optional check)
-    db_cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'job_postings');")
-    table_exists = db_cursor.fetchone()[0]
-    if not table_exists:
-         print(">>> Error: 'job_postings' table does not exist in the database!")
-         print(">>> Please run the CREATE TABLE script in your Neon SQL Editor first.")
-         sys.exit(1)
-    else:
-        print("'job_postings' table found.")
+    print("Database schema is up to date.")
 
 except Exception as db_err:
     print(f">>> Database connection error: {db_err}")
     # Ensure connection/cursor are closed if partially opened
     if db_cursor: db_cursor.close()
     if db_conn: db_conn.close()
-    sys.exit(1) # Exit if DB connection fails
+    if not spool.is_connection_error(db_err):
+        sys.exit(1) # Exit on setup errors that waiting won't fix
+    # Database down or too slow - still collect, and let spool.py write the rows later
+    db_conn = db_cursor = None
+    print(">>> Database unreachable - job rows will be spooled locally (see spool.py).")
 
-# --- API Connection Setup ---
+# --- API Connection Setup (not needed when replaying the archive) ---
 api_key = None
-try:
-    print("\nReading WEB3_CAREER_API_KEY from Replit Secrets...")
-    api_key = os.environ.get('WEB3_CAREER_API_KEY')
-    if not api_key:
-        print(">>> Error: WEB3_CAREER_API_KEY secret not found.")
+if not replay.replay:
+    try:
+        print("\nReading WEB3_CAREER_API_KEY from Replit Secrets...")
+        api_key = os.environ.get('WEB3_CAREER_API_KEY')
+        if not api_key:
+            print(">>> Error: WEB3_CAREER_API_KEY secret not found.")
+            sys.exit(1)
+        else:
+             print(f"API Key loaded successfully (starts with: {api_key[:4]}...).")
+    except Exception as key_err:
+        print(f">>> Error reading API key: {key_err}")
         sys.exit(1)
-    else:
-         print(f"API Key loaded successfully (starts with: {api_key[:4]}...).")
-except Exception as key_err:
-    print(f">>> Error reading API key: {key_err}")
-    sys.exit(1)
 
 
-# --- API Request Configuration ---
-api_endpoint = "https://web3.career/api/v1"
-params = {
-    'token': api_key,
-    'limit': 100,
-    'show_description': 'true'
-    # Add other filters here if needed, e.g.: 'remote': 'true',
-}
-printable_params = {k: v for k, v in params.items() if k != 'token'}
-print(f"\nRequesting data from: {api_endpoint}")
-print(f"With parameters: {printable_params}")
+    # --- API Request Configuration ---
+    api_endpoint = "https://web3.career/api/v1"
+    params = {
+        'token': api_key,
+        'limit': source_units[0]['limit'], # The API has a single listing - one unit in sources.json
+        'show_description': 'true'
+        # Add other filters here if needed, e.g.: 'remote': 'true',
+    }
+    printable_params = {k: v for k, v in params.items() if k != 'token'}
+    print(f"\nRequesting data from: {api_endpoint}")
+    print(f"With parameters: {printable_params}")
 
 
 # --- Fetch and Process ---
 inserted_count = 0
+updated_count = 0 # Known postings whose content changed (old version kept in job_postings_history)
 skipped_count = 0
 api_error = False
+job_rollup = rollups.JobRollupAccumulator() # Counts only rows that were actually inserted
+uncommitted = [] # (job, raw entry) inserted since the last commit - spooled if the connection drops
+unchanged = [] # Seen-filter keys of stored rows whose content hash matched - marked once the transaction commits
+updated_jobs = [] # (job, raw entry) updated since the last commit - spooled (and replayed as updates) if the connection drops
+listed_urls = set() # Every posting in the live response, stored or skipped - keeps them out of cold storage
 
-try:
-    print("\nSending GET request to the API...")
-    response = requests.get(api_endpoint, params=params, timeout=25)
-    print(f"API request status: {response.status_code}")
-    response.raise_for_status() # Check for HTTP errors
 
-    print("Attempting to parse JSON response...")
-    raw_data = response.json()
-    print("JSON parsing successful.")
+def spool_jobs(jobs):
+    for pending_job, pending_entry in jobs:
+        job_spool.add_job('web3career', documents.WEB3CAREER_COLUMNS, pending_job, pending_entry)
 
-    jobs_list = []
-    if isinstance(raw_data, list) and len(raw_data) > 2 and isinstance(raw_data[2], list):
-        jobs_list = raw_data[2]
+response = None
+try:
+    if replay.replay:
+        print(f"\nReplaying archived API responses (since={replay.since}, until={replay.until})...")
+        payloads = (record['payload'] for record in raw_archive.iter_records('web3career', replay.since, replay.until))
     else:
-        print(">>> Warning: API response structure not as expected (list[2] not found or not a list). Check API documentation or raw response.")
-        # Optional: print raw_data for deep debugging
-        # print(json.dumps(raw_data, indent=2))
-
-    print(f"\nProcessing {len(jobs_list)} potential job entries from API...")
-
-    for job_entry in jobs_list:
-        if not isinstance(job_entry, dict):
-            print(f"Warning: Skipping item, not a dictionary: {job_entry}")
-            skipped_count += 1
-            continue
-
-        # Extract data (use .get with default=None for safety)
-        external_id = str(job_entry.get('id')) if job_entry.get('id') is not None else None
-        title = job_entry.get('title')
-        company = job_entry.get('company')
-        location = job_entry.get('location') # Contains city/country often
-        country = job_entry.get('country')
-        city = job_entry.get('city')
-        apply_url = job_entry.get('apply_url')
-        tags_list = job_entry.get('tags', []) # Ensure it's a list
-        description = job_entry.get('description')
-        date_epoch = job_entry.get('date_epoch')
-        # Infer remote status based on tags or location info if possible
-        is_remote = 'remote' in [tag.lower() for tag in tags_list if isinstance(tag, str)] if tags_list else None
-        # Add a placeholder for salary if the API provides it later
-        salary = job_entry.get('salary_range') # Check actual key name
-
-        # Prepare data for insertion
-        # Only insert if we have a title and a unique URL
-        if title and apply_url:
-            sql_insert_query = """
-                INSERT INTO job_postings (
-                    title, company_name, location, salary_range, tags, source,
-                    job_url, description, external_id, is_remote, date_posted_epoch,
-                    raw_api_response
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                ON CONFLICT (job_url) DO NOTHING;
-            """
-            # Use json.dumps for the raw response if storing it
-            raw_json_str = json.dumps(job_entry) if job_entry else None
-            data_to_insert = (
-                title, company, location, salary, tags_list, 'Web3.Career',
-                apply_url, description, external_id, is_remote, date_epoch,
-                raw_json_str # Insert raw JSON here
-            )
-
-            try:
-                db_cursor.execute(sql_insert_query, data_to_insert)
-                # Check if a row was actually inserted (0 means conflict/duplicate)
-                if db_cursor.rowcount > 0:
-                    inserted_count += 1
-                else:
-                    skipped_count += 1
-            except Exception as insert_err:
-                print(f"  > DB insert error for job ID {external_id} ({title}): {insert_err}")
-                db_conn.rollback() # Rollback failed transaction for this job
+        def fetch_jobs():
+            global response
+            rate_limits.acquire('web3career', max_wait=None)
+            with metrics.stage('http_fetch'):
+                response = requests.get(api_endpoint, params=params, timeout=25)
+            rate_limits.observe('web3career', response.headers, response.status_code)
+            metrics.incr('bytes_fetched', len(response.content))
+            print(f"API request status: {response.status_code}")
+            response.raise_for_status() # Check for HTTP errors
+
+        print("\nSending GET request to the API...")
+        # Timeouts, connection errors and 5xx are retried with jittered backoff
+        resilience.retry_call(fetch_jobs, label='Web3.Career API request')
+
+        print("Attempting to parse JSON response...")
+        with metrics.stage('parse'):
+            raw_data = response.json()
+        print("JSON parsing successful.")
+        archive.append(raw_data, meta={'endpoint': api_endpoint, 'params': printable_params})
+        payloads = [raw_data]
+
+    for raw_data in payloads:
+        jobs_list = documents.web3career_entries(raw_data)
+        if jobs_list is None:
+            jobs_list = []
+            print(">>> Warning: API response structure not as expected (list[2] not found or not a list). Check API documentation or raw response.")
+            # Optional: print raw_data for deep debugging
+            # print(json.dumps(raw_data, indent=2))
+
+        metrics.incr('fetched', len(jobs_list))
+        print(f"\nProcessing {len(jobs_list)} potential job entries from API...")
+
+        for job_entry in jobs_list:
+            if not isinstance(job_entry, dict):
+                print(f"Warning: Skipping item, not a dictionary: {job_entry}")
                 skipped_count += 1
-        else:
-             print(f"Skipping job entry due to missing title or apply_url: {external_id}")
-             skipped_count += 1
+                continue
+
+            # Extract data (see documents.py for the column mapping)
+            job = documents.web3career_job(job_entry)
+            external_id = job['external_id']
+            title = job['title']
+            apply_url = job['job_url']
+
+            job_key = job_history.seen_key(apply_url, job['content_hash'])
+            if not replay.replay and apply_url:
+                listed_urls.add(apply_url)
+            if seen.skip(job_key):
+                skipped_count += 1 # Stored unchanged by an earlier run - no database round trip
+                continue
+
+            # Prepare data for insertion
+            # Only insert if we have a title and a unique URL
+            if title and apply_url:
+                # Known URLs are only rewritten if their content hash changed (see job_history.py)
+                sql_insert_query = job_history.upsert_sql(documents.WEB3CAREER_COLUMNS)
+                # The raw API entry goes to job_postings_raw so job_postings stays narrow
+                data_to_insert = documents.job_values(job, documents.WEB3CAREER_COLUMNS)
+                if db_conn is None:
+                    spool_jobs([(job, job_entry)])
+                    continue
+
+                try:
+                    # ON CONFLICT does the dedupe and the write in one statement
+                    with metrics.stage('db_write'):
+                        # A bad row rolls back to here, not the whole run's transaction
+                        db_cursor.execute("SAVEPOINT job_row;")
+                        db_cursor.execute(sql_insert_query, data_to_insert)
+                        upserted = db_cursor.fetchone() # (job_url, inserted), or None if stored unchanged
+                        if upserted is not None and upserted[1]:
+                            job_raw_store.save(db_cursor, apply_url, 'Web3.Career', external_id, job_entry)
+                        db_cursor.execute("RELEASE SAVEPOINT job_row;")
+                    if upserted is None:
+                        skipped_count += 1 # Duplicate, same content
+                        unchanged.append(job_key)
+                    elif upserted[1]:
+                        inserted_count += 1
+                        uncommitted.append((job, job_entry))
+                        job_rollup.add(datetime.utcnow().date(), 'Web3.Career', job['company_name'], job['tags'], job['is_remote'])
+                    else:
+                        updated_count += 1
+                        updated_jobs.append((job, job_entry))
+                except Exception as insert_err:
+                    if spool.is_connection_error(insert_err):
+                        # Lost the database mid-run: spool this transaction's rows and everything after
+                        print(f"  > Database connection lost ({insert_err}) - spooling the rest of this run.")
+                        spool_jobs(uncommitted + updated_jobs + [(job, job_entry)])
+                        inserted_count -= len(uncommitted)
+                        updated_count -= len(updated_jobs)
+                        uncommitted = []
+                        updated_jobs = []
+                        unchanged = []
+                        job_rollup.reset()
+                        db_conn.close()
+                        db_conn = db_cursor = None
+                        continue
+                    print(f"  > DB insert error for job ID {external_id} ({title}): {insert_err}")
+                    db_cursor.execute("ROLLBACK TO SAVEPOINT job_row;") # Only this job is lost
+                    skipped_count += 1
+                    metrics.incr('errors')
+            else:
+                 print(f"Skipping job entry due to missing title or apply_url: {external_id}")
+                 skipped_count += 1
 
     # Commit all successful insertions after the loop
-    db_conn.commit()
-    print(f"\nDatabase commit successful.")
+    if db_conn is not None:
+        try:
+            with metrics.stage('db_write'):
+                job_rollup.flush(db_cursor) # Same transaction as the inserts
+                if inserted_count or updated_count:
+                    ingest_version.bump_postgres(db_cursor, 'web3career')
+                retention.mark_listed(db_cursor, listed_urls)
+                db_conn.commit()
+            print(f"\nDatabase commit successful.")
+            seen.mark([job_history.seen_key(pending_job['job_url'], pending_job['content_hash'])
+                       for pending_job, _ in uncommitted + updated_jobs] + unchanged)
+        except Exception as commit_err:
+            if not spool.is_connection_error(commit_err):
+                raise
+            print(f"\n>>> Database connection lost before commit ({commit_err}) - spooling {len(uncommitted) + len(updated_jobs)} rows.")
+            spool_jobs(uncommitted + updated_jobs)
+            inserted_count -= len(uncommitted)
+            updated_count -= len(updated_jobs)
 
 
 # --- Error Handling for API Request/Parsing ---
@@ -374,12 +266,25 @@ except Exception as proc_err:
 finally:
     print("\n--- Final Summary ---")
     print(f"Jobs Inserted: {inserted_count}")
+    print(f"Jobs Updated (content changed): {updated_count}")
     print(f"Jobs Skipped (Duplicate/Error/Incomplete): {skipped_count}")
+    if job_spool.records_written:
+        print(f"Jobs Spooled (database unreachable): {job_spool.records_written}")
     if api_error:
          print(">>> There was an error fetching or processing data from the API.")
-
+         metrics.incr('errors')
+    metrics.incr('inserted', inserted_count)
+    metrics.incr('updated', updated_count)
+    metrics.incr('skipped', skipped_count)
+    metrics.incr('spooled', job_spool.records_written)
+    metrics.incr('filtered', seen.dropped)
+    metrics.write()
+
+    archive.close()
+    job_spool.close()
+    seen.save()
     print("Closing database connection...")
     if db_cursor: db_cursor.close()
     if db_conn: db_conn.close()
     print("Database connection closed.")
-    print("\n--- Web3.Career Collection Script Finished ---")
\ No newline at end of file
+    print("\n--- Web3.Career Collection Script Finished ---")
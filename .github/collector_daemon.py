@@ -0,0 +1,274 @@
+# ----- collector_daemon.py -----
+# Long-running alternative to the 6-hour cron: every polling unit (a job board,
+# a subreddit listing, a Reddit search, a Twitter query) runs on its own timer
+# inside one asyncio loop, reusing async_collector.py's fetchers and writers.
+#
+# After each poll the unit's interval adapts to its yield (new items / fetched):
+#   yield >= HOT_YIELD   -> interval * SPEEDUP   (most items were new - we're missing some)
+#   yield <  COLD_YIELD  -> interval * BACKOFF   (mostly duplicates - poll less)
+#   poll failed          -> interval * 2         (resilience.py already retried it)
+# clamped to the source's [min, max]. Learned intervals are saved to
+# collector_state/daemon_schedule.json so a restart keeps them.
+# Every API is still paced by rate_limits.py, whatever the intervals say.
+# While a database is down, polls spool to disk and the daemon drains the spool
+# every SPOOL_FLUSH_SECONDS (see spool.py).
+# Sentiment processing is not part of the daemon - run process_sentiment.py on its own schedule.
+#
+# Usage:
+#   python collector_daemon.py                          # all sources, forever
+#   python collector_daemon.py --only twitter --only reddit
+#   python collector_daemon.py --shard 1/2              # half of the units in sources.json
+#   python collector_daemon.py --status                 # current intervals and yields
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+import async_collector
+import raw_archive
+import resilience
+import source_registry
+import spool
+from run_metrics import RunMetrics
+
+SCHEDULE_PATH = os.path.join(resilience.STATE_DIR, 'daemon_schedule.json')
+
+# source: (initial, min, max) polling interval in seconds
+SOURCE_INTERVALS = {
+    'web3career': (60 * 60, 15 * 60, 6 * 60 * 60),
+    'cryptojobslist': (2 * 60 * 60, 30 * 60, 12 * 60 * 60),
+    'reddit': (30 * 60, 5 * 60, 6 * 60 * 60),
+    'twitter': (15 * 60, 2 * 60, 6 * 60 * 60),
+}
+HOT_YIELD = 0.5
+COLD_YIELD = 0.1
+SPEEDUP = 0.5
+BACKOFF = 1.5
+JITTER = 0.1 # +/- fraction of the interval, so units that share an API don't fire together
+REDDIT_TOKEN_TTL = 50 * 60 # App-only tokens last an hour
+SPOOL_FLUSH_SECONDS = 10 * 60
+
+
+class PollUnit:
+    """One independently scheduled thing to fetch, with its learned interval."""
+
+    def __init__(self, spec, poll, state=None):
+        self.spec = spec # The unit from sources.json
+        self.source = spec['source']
+        self.key = spec['key'] # e.g. "twitter:search_recent:#DeFiJobs ..."
+        self.poll = poll # async (run) -> None
+        initial, self.min_interval, self.max_interval = SOURCE_INTERVALS[self.source]
+        state = state or {}
+        self.interval = min(self.max_interval, max(self.min_interval, state.get('interval', initial)))
+        self.last_yield = state.get('last_yield')
+        self.polls = state.get('polls', 0)
+        self.next_poll = time.time() # Always poll once on startup
+
+    def adapt(self, fetched, inserted, failed):
+        if failed:
+            factor = 2.0
+        elif not fetched:
+            factor = BACKOFF
+        else:
+            self.last_yield = inserted / fetched
+            factor = SPEEDUP if self.last_yield >= HOT_YIELD else BACKOFF if self.last_yield < COLD_YIELD else 1.0
+        self.interval = min(self.max_interval, max(self.min_interval, self.interval * factor))
+        self.hold()
+
+    def hold(self):
+        """Schedule the next poll without changing the interval."""
+        self.polls += 1
+        self.next_poll = time.time() + self.interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def to_dict(self):
+        return {'interval': round(self.interval, 1), 'last_yield': self.last_yield, 'polls': self.polls}
+
+
+def load_schedule():
+    try:
+        with open(SCHEDULE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_schedule(units):
+    # Never let bookkeeping stop the daemon
+    try:
+        schedule = load_schedule()
+        schedule.update({unit.key: unit.to_dict() for unit in units})
+        os.makedirs(os.path.dirname(SCHEDULE_PATH) or '.', exist_ok=True)
+        with open(SCHEDULE_PATH + '.tmp', 'w') as f:
+            json.dump(schedule, f, indent=2)
+        os.replace(SCHEDULE_PATH + '.tmp', SCHEDULE_PATH)
+    except Exception as state_err:
+        print(f">>> Warning: Could not save daemon schedule: {state_err}")
+
+
+class RedditAuth:
+    """Caches the app-only OAuth headers and refreshes them before they expire."""
+
+    def __init__(self):
+        self.headers = None
+        self.fetched_at = 0.0
+
+    async def get(self, run):
+        if self.headers is None or time.time() - self.fetched_at > REDDIT_TOKEN_TTL:
+            self.headers = await async_collector.reddit_token(run)
+            self.fetched_at = time.time()
+        return self.headers
+
+
+def make_poll(spec, reddit_auth):
+    """async (run) -> None that fetches one registry unit. Also used by task_queue.py workers."""
+    source = spec['source']
+    if source == 'reddit':
+        listing = async_collector.reddit_listing_args(spec)
+        async def poll(run):
+            await async_collector.reddit_listing(run, await reddit_auth.get(run), *listing)
+        return poll
+    if source == 'twitter':
+        async def poll(run):
+            await async_collector.twitter_search(run, async_collector.twitter_headers(), spec['query'], spec['limit'])
+        return poll
+    return async_collector.COLLECTORS[source] # Job boards fetch run.units - just this one
+
+
+def build_units(sources, schedule, shard=None):
+    if 'twitter' in sources:
+        async_collector.twitter_headers() # Fail at startup, not on the first poll, if the token is missing
+    reddit_auth = RedditAuth()
+    return [PollUnit(spec, make_poll(spec, reddit_auth), schedule.get(spec['key']))
+            for source in sources for spec in source_registry.units_for(source, shard)]
+
+
+class Daemon:
+    def __init__(self, units, session, stores):
+        self.units = units
+        self.session = session
+        self.stores = stores
+        # One archive per source for the daemon's lifetime - it rolls over to a new partition every hour
+        self.archives = {unit.source: raw_archive.RawArchiveWriter(unit.source) for unit in units}
+        # No checkpoints: each poll is a single unit, and the schedule already says when it is due
+        self.no_checkpoint = resilience.Checkpoint('daemon', enabled=False)
+
+    async def poll_once(self, unit):
+        """Poll one unit and adapt its interval. Returns True if the poll failed."""
+        metrics = RunMetrics(unit.source)
+        writer = async_collector.new_writer(unit.source, self.stores, metrics, checkpoint=self.no_checkpoint)
+        run = async_collector.SourceRun(unit.source, self.session, writer, archive=self.archives[unit.source],
+                                        units=[unit.spec])
+        failed = False
+        try:
+            await unit.poll(run)
+        except Exception as poll_err:
+            print(f"  > [{unit.key}] Poll failed: {poll_err}")
+            failed = True
+        finally:
+            await writer.close()
+        failed = failed or writer.failed_batches > 0
+        metrics.incr('inserted', writer.inserted)
+        metrics.incr('updated', writer.updated)
+        metrics.incr('skipped', writer.skipped)
+        metrics.incr('spooled', writer.spooled)
+        # Each poll is one run in the ledger (task_queue.py workers poll through here too)
+        await asyncio.to_thread(metrics.record, not failed)
+        fetched = metrics.to_dict()['counters'].get('fetched', 0)
+        if writer.spooled:
+            unit.hold() # Database down - the yield is unknown until spool.py writes them
+        else:
+            unit.adapt(fetched, writer.inserted, failed)
+        print(f"[{datetime.utcnow().isoformat(timespec='seconds')}] {unit.key}: fetched={fetched}, "
+              f"new={writer.inserted}, spooled={writer.spooled} -> next poll in {unit.interval / 60:.1f} min")
+        return failed
+
+    async def run_unit(self, unit):
+        while True:
+            await asyncio.sleep(max(0.0, unit.next_poll - time.time()))
+            breaker = resilience.CircuitBreaker(unit.source)
+            if not breaker.allow():
+                # The cron runner opened it - wait out the cooldown rather than hammering a broken source
+                unit.next_poll = breaker.open_until
+                continue
+            await self.poll_once(unit)
+            save_schedule([unit])
+
+    async def flush_spool(self):
+        """Seal what this daemon has spooled and drain it once the databases are back."""
+        while True:
+            await asyncio.sleep(SPOOL_FLUSH_SECONDS)
+            for spool_writer in self.stores.get('spools', {}).values():
+                spool_writer.seal()
+            if any(spool.pending_segments(target) for target in spool.TARGETS):
+                await asyncio.to_thread(spool.flush_all)
+
+    async def run(self):
+        try:
+            await asyncio.gather(self.flush_spool(), *(self.run_unit(unit) for unit in self.units))
+        finally:
+            for archive in self.archives.values():
+                archive.close()
+
+
+async def run_daemon(sources, shard=None):
+    import aiohttp
+    stores = {}
+    try:
+        try:
+            await async_collector.open_stores(sources, stores)
+        except RuntimeError as config_err:
+            print(f">>> Error: {config_err}")
+            return 1
+        units = build_units(sources, load_schedule(), shard)
+        print(f"Scheduling {len(units)} polling units ({source_registry.describe(shard)}).")
+
+        connector = aiohttp.TCPConnector(limit_per_host=async_collector.CONNECTIONS_PER_HOST)
+        timeout = aiohttp.ClientTimeout(total=async_collector.REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await Daemon(units, session, stores).run()
+        return 0
+    finally:
+        await async_collector.close_stores(stores)
+
+
+def print_status():
+    schedule = load_schedule()
+    if not schedule:
+        print("No daemon schedule recorded yet.")
+        return
+    for key, state in sorted(schedule.items()):
+        last_yield = f"{state['last_yield']:.0%}" if state.get('last_yield') is not None else '-'
+        print(f"{key[:70]:<70} every {state['interval'] / 60:6.1f} min | yield {last_yield:>4} | {state.get('polls', 0)} polls")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Poll every source continuously with adaptive intervals.")
+    parser.add_argument('--only', choices=list(SOURCE_INTERVALS), action='append',
+                        help='Poll just this source (can be repeated)')
+    parser.add_argument('--shard', type=source_registry.parse_shard,
+                        default=source_registry.shard_option([]), # COLLECTOR_SHARD, if set
+                        help='Poll only daemon i of N\'s share of the registry units (i/N)')
+    parser.add_argument('--status', action='store_true', help='Show the learned intervals and exit')
+    args = parser.parse_args(argv)
+    if args.status:
+        print_status()
+        return 0
+    sources = args.only or list(SOURCE_INTERVALS)
+
+    print(f"--- Starting Collector Daemon ({', '.join(sources)}) at {datetime.utcnow().isoformat()} ---")
+    try:
+        return asyncio.run(run_daemon(sources, args.shard))
+    except KeyboardInterrupt:
+        print("--- Collector Daemon stopped ---")
+        return 0
+    except Exception as daemon_err:
+        print(f">>> Collector daemon failed: {daemon_err}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
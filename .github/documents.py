@@ -0,0 +1,186 @@
+# ----- documents.py -----
+# The one place that decides what a stored job row / social post looks like.
+# The synchronous collectors and async_collector.py both build their rows and
+# documents here, so every writer produces exactly the same schema.
+import re
+from datetime import datetime
+from types import SimpleNamespace
+from urllib.parse import urljoin
+
+import job_history # Content hash for change detection (job_history.py)
+import skills # Skill extraction at ingest (skills.py)
+
+# --- Web3.Career (PostgreSQL job_postings) ---
+WEB3CAREER_SOURCE = 'Web3.Career'
+WEB3CAREER_COLUMNS = ['title', 'company_name', 'location', 'salary_range', 'tags', 'source',
+                      'job_url', 'description', 'external_id', 'is_remote', 'date_posted_epoch', 'skills',
+                      'content_hash']
+
+
+def web3career_entries(raw_data):
+    """The job list inside an API response ([meta, meta, [jobs...]]), or None if the shape is unexpected."""
+    if isinstance(raw_data, list) and len(raw_data) > 2 and isinstance(raw_data[2], list):
+        return raw_data[2]
+    return None
+
+
+def web3career_job(job_entry):
+    """Map one API entry to a job_postings row (dict keyed by WEB3CAREER_COLUMNS)."""
+    tags_list = job_entry.get('tags', []) # Ensure it's a list
+    job = {
+        'title': job_entry.get('title'),
+        'company_name': job_entry.get('company'),
+        'location': job_entry.get('location'), # Contains city/country often
+        'salary_range': job_entry.get('salary_range'), # Check actual key name
+        'tags': tags_list,
+        'source': WEB3CAREER_SOURCE,
+        'job_url': job_entry.get('apply_url'),
+        'description': job_entry.get('description'),
+        'external_id': str(job_entry.get('id')) if job_entry.get('id') is not None else None,
+        # Infer remote status based on tags or location info if possible
+        'is_remote': 'remote' in [tag.lower() for tag in tags_list if isinstance(tag, str)] if tags_list else None,
+        'date_posted_epoch': job_entry.get('date_epoch'),
+        'skills': skills.extract(job_entry.get('title'), job_entry.get('description'), *tags_list),
+    }
+    job['content_hash'] = job_history.content_hash(job)
+    return job
+
+
+# --- CryptoJobsList (PostgreSQL job_postings) ---
+CRYPTOJOBSLIST_SOURCE = 'CryptoJobsList'
+CRYPTOJOBSLIST_BASE_URL = 'https://cryptojobslist.com'
+CRYPTOJOBSLIST_COLUMNS = ['title', 'company_name', 'location', 'salary_range', 'tags', 'source',
+                          'job_url', 'is_remote', 'collected_at', 'skills', 'content_hash']
+TABLE_BODY_SELECTOR = 'table.job-preview-inline-table tbody'
+JOB_ROW_SELECTOR = 'tr[role="button"]'
+
+
+def cryptojobslist_rows(soup):
+    """The job <tr> elements of a parsed listing page, or None if no job rows can be found."""
+    table_body = soup.select_one(TABLE_BODY_SELECTOR)
+    if table_body:
+        return table_body.select(JOB_ROW_SELECTOR)
+    # Table class renamed? The rows themselves are still the job links
+    job_rows = soup.select(JOB_ROW_SELECTOR)
+    return job_rows or None
+
+
+def cryptojobslist_job(row, collected_at):
+    """Map one listing row to a job_postings row, or None for ad rows.
+    Missing fields come back as 'N/A' (salary as None), like the scraper has always stored them."""
+    if row.has_attr('class') and 'notAJobAd' in row['class']:
+        return None # Skip ads
+
+    title_element = row.select_one('a.job-title-text')
+    company_element = row.select_one('a.job-company-name-text')
+    link_element = title_element
+    tag_elements = row.select('td.job-tags span.category')
+
+    title = title_element.get_text(strip=True) if title_element else 'N/A'
+    company = company_element.get_text(strip=True) if company_element else 'N/A'
+    tags_list = [tag.get_text(strip=True) for tag in tag_elements] if tag_elements else []
+    relative_link = link_element['href'] if link_element and link_element.has_attr('href') else None
+    job_url = urljoin(CRYPTOJOBSLIST_BASE_URL, relative_link) if relative_link else 'N/A'
+
+    salary = 'N/A'
+    salary_span = row.select_one('td span.align-middle')
+    if salary_span:
+         parent_div = salary_span.find_parent('div')
+         if parent_div and parent_div.select_one('svg[stroke="currentColor"]'):
+              salary = salary_span.get_text(strip=True)
+
+    location = 'N/A'
+    potential_loc_td = None
+    tags_td = row.select_one('td.job-tags')
+    location_tds = row.select('td')
+    if tags_td:
+        potential_loc_td = tags_td.find_previous_sibling('td')
+    elif len(location_tds) >= 5:
+        potential_loc_td = location_tds[4]
+    if potential_loc_td:
+         location_span = potential_loc_td.select_one('span.text-sm')
+         if location_span:
+              raw_location_text = location_span.get_text(strip=True)
+              if salary == 'N/A' or salary != raw_location_text:
+                   location = re.sub(r'^\s*📍\s*', '', raw_location_text).strip()
+    if location == 'N/A' and 'Remote' in tags_list:
+         location = 'Remote'
+
+    job = {
+        'title': title,
+        'company_name': company,
+        'location': location,
+        'salary_range': salary if salary != 'N/A' else None,
+        'tags': tags_list,
+        'source': CRYPTOJOBSLIST_SOURCE,
+        'job_url': job_url,
+        'is_remote': location == 'Remote' or 'Remote' in tags_list,
+        'collected_at': collected_at, # Timestamp of the fetch (the original one when replaying)
+        'skills': skills.extract(title, *tags_list), # The listing has no description
+    }
+    job['content_hash'] = job_history.content_hash(job)
+    return job
+
+
+def job_values(job, columns):
+    return tuple(job[column] for column in columns)
+
+
+# --- Reddit (MongoDB social_media_posts) ---
+def create_reddit_doc(submission, source_method, source_query, collected_at=None):
+    return {
+        'source': 'reddit',
+        'source_method': source_method,
+        'source_query': source_query,
+        'source_specific_id': submission.id, # Use Reddit's submission ID
+        'title': submission.title,
+        'text': submission.selftext,
+        'author': submission.author.name if submission.author else '[deleted]',
+        'subreddit': submission.subreddit.display_name,
+        'url': f"https://www.reddit.com{submission.permalink}",
+        'score': submission.score,
+        'upvote_ratio': submission.upvote_ratio,
+        'num_comments': submission.num_comments,
+        'created_utc': datetime.utcfromtimestamp(submission.created_utc), # Store as datetime
+        'collected_at': collected_at or datetime.utcnow(), # Store as datetime
+        'sentiment_pending': True, # In the unscored_posts partial index until process_sentiment.py scores it
+        'skills': skills.extract(submission.title, submission.selftext),
+        # The full submission data goes to the raw archive instead (see raw_archive.py)
+    }
+
+
+# Everything PRAW loaded for a submission, minus its internals - this is what gets archived
+def submission_payload(submission):
+    return {k: v for k, v in vars(submission).items() if not k.startswith('_')}
+
+
+# Rebuild just enough of a PRAW Submission for create_reddit_doc from its JSON -
+# an archived payload or a `data` object straight from the Reddit API listing
+def archived_submission(payload):
+    data = dict(payload)
+    data['author'] = SimpleNamespace(name=data['author']) if data.get('author') else None
+    data['subreddit'] = SimpleNamespace(display_name=data.get('subreddit'))
+    return SimpleNamespace(**data)
+
+
+# --- Twitter (MongoDB social_media_posts) ---
+TWEET_FIELDS = ["created_at", "public_metrics", "author_id", "lang", "geo"]
+
+
+def create_tweet_doc(tweet, query, collected_at=None):
+    return {
+        'source': 'twitter',
+        'source_query': query,
+        'source_method': 'search_recent',
+        'source_specific_id': str(tweet.id), # Use a consistent ID field name
+        'text': tweet.text,
+        'author_id': str(tweet.author_id) if tweet.author_id else None,
+        'language': tweet.lang,
+        'created_at': tweet.created_at, # Store as ISODate
+        'public_metrics': tweet.public_metrics,
+        'geo': tweet.geo,
+        'collected_at': collected_at or datetime.utcnow(), # Store as ISODate
+        'sentiment_pending': True, # In the unscored_posts partial index until process_sentiment.py scores it
+        'skills': skills.extract(tweet.text),
+        # The full tweet JSON goes to the raw archive instead (see raw_archive.py)
+    }
@@ -0,0 +1,289 @@
+# ----- export_data.py -----
+# Constant-memory bulk export of job_postings (PostgreSQL) and
+# social_media_posts (MongoDB) to Parquet or CSV.
+# Rows are streamed - a server-side named cursor for Postgres, a batched
+# cursor for Mongo - and written one row group / chunk at a time, so memory
+# use is bounded by --batch-size no matter how large the tables get.
+#
+# Usage:
+#   python export_data.py                               # both sources, Parquet, full export
+#   python export_data.py --format csv --incremental    # only rows collected since the last export
+#   python export_data.py --only job_postings --out exports
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+DEFAULT_OUT_DIR = 'exports'
+DEFAULT_BATCH_SIZE = 10000 # Rows per Parquet row group / CSV chunk
+STATE_FILE_NAME = '.export_state.json'
+_state_lock = threading.Lock() # Both export threads update the same state file
+
+# Fixed schema for social_media_posts - Reddit and Twitter documents share one file
+SOCIAL_FIELDS = [
+    ('_id', 'string'), ('source', 'string'), ('source_method', 'string'), ('source_query', 'string'),
+    ('source_specific_id', 'string'), ('title', 'string'), ('text', 'string'), ('author', 'string'),
+    ('author_id', 'string'), ('subreddit', 'string'), ('url', 'string'), ('language', 'string'),
+    ('score', 'int64'), ('upvote_ratio', 'float64'), ('num_comments', 'int64'),
+    ('public_metrics', 'json'), ('geo', 'json'), ('sentiment', 'json'),
+    ('created_at', 'timestamp'), ('created_utc', 'timestamp'), ('collected_at', 'timestamp'),
+    ('sentiment_analyzed_at', 'timestamp'), ('skills', 'json'),
+]
+
+
+# --- Incremental export state ---
+def load_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(out_dir, source, last_collected_at):
+    with _state_lock:
+        state = load_state(out_dir)
+        state[source] = last_collected_at.isoformat()
+        path = os.path.join(out_dir, STATE_FILE_NAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+
+# --- Writers ---
+class CsvChunkWriter:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', newline='')
+        self._writer = None
+
+    def write_batch(self, columns, rows):
+        if self._writer is None:
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(columns)
+        self._writer.writerows(
+            [json.dumps(v, default=str) if isinstance(v, (dict, list)) else v for v in row] for row in rows
+        )
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetChunkWriter:
+    """Writes each batch as one row group. The schema comes from the first batch unless given."""
+
+    def __init__(self, path, schema=None):
+        import pyarrow # Only needed for Parquet output
+        import pyarrow.parquet
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.schema = schema
+        self._writer = None
+        self._stringified = set()
+
+    def _infer_schema(self, columns, rows):
+        table = self._pa.Table.from_pylist([dict(zip(columns, row)) for row in rows])
+        fields = []
+        for field in table.schema:
+            # All-null or dict-valued columns in the first batch have no stable type - store them as text
+            if self._pa.types.is_null(field.type) or self._pa.types.is_struct(field.type) or self._pa.types.is_map(field.type):
+                self._stringified.add(field.name)
+                fields.append(self._pa.field(field.name, self._pa.string()))
+            else:
+                fields.append(field)
+        return self._pa.schema(fields)
+
+    def write_batch(self, columns, rows):
+        if self.schema is None:
+            self.schema = self._infer_schema(columns, rows)
+        records = []
+        for row in rows:
+            record = dict(zip(columns, row))
+            for name in self._stringified:
+                if record.get(name) is not None and not isinstance(record[name], str):
+                    value = record[name]
+                    record[name] = json.dumps(value, default=str) if isinstance(value, (dict, list)) else str(value)
+            records.append(record)
+        table = self._pa.Table.from_pylist(records, schema=self.schema)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, self.schema, compression='zstd')
+        self._writer.write_table(table, row_group_size=len(rows))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def parquet_schema(fields):
+    """Arrow schema for a [(name, kind)] field list like SOCIAL_FIELDS ('json' is stored as text)."""
+    import pyarrow as pa
+    types = {'string': pa.string(), 'json': pa.string(), 'int64': pa.int64(), 'float64': pa.float64(),
+             'bool': pa.bool_(), 'date': pa.date32(), 'timestamp': pa.timestamp('us')}
+    return pa.schema([pa.field(name, types[kind]) for name, kind in fields])
+
+
+def social_parquet_schema():
+    return parquet_schema(SOCIAL_FIELDS)
+
+
+def open_writer(out_dir, source, file_format, schema=None):
+    source_dir = os.path.join(out_dir, source)
+    os.makedirs(source_dir, exist_ok=True)
+    path = os.path.join(source_dir, f"{source}-{datetime.utcnow():%Y%m%dT%H%M%S}.{file_format}")
+    if file_format == 'csv':
+        return CsvChunkWriter(path)
+    return ParquetChunkWriter(path, schema=schema)
+
+
+# --- Sources ---
+def export_job_postings(out_dir, file_format, batch_size, since=None):
+    """Stream job_postings through a server-side cursor. Returns (rows, max collected_at, path)."""
+    import psycopg2
+    db_conn = psycopg2.connect(os.environ['POSTGRES_URI'])
+    writer = None
+    rows_written = 0
+    last_collected_at = since
+    try:
+        # A named cursor keeps the result set on the server; we pull batch_size rows at a time
+        with db_conn.cursor(name='export_job_postings') as cur:
+            cur.itersize = batch_size
+            if since:
+                cur.execute("SELECT * FROM job_postings WHERE collected_at > %s ORDER BY collected_at;", (since,))
+            else:
+                cur.execute("SELECT * FROM job_postings ORDER BY collected_at;")
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                columns = [c[0] for c in cur.description]
+                if writer is None:
+                    writer = open_writer(out_dir, 'job_postings', file_format)
+                writer.write_batch(columns, rows)
+                rows_written += len(rows)
+                collected_idx = columns.index('collected_at')
+                batch_max = max((r[collected_idx] for r in rows if r[collected_idx]), default=None)
+                if batch_max and (last_collected_at is None or batch_max > last_collected_at):
+                    last_collected_at = batch_max
+                print(f"  job_postings: {rows_written} rows written...")
+        db_conn.rollback() # Read-only; just end the transaction holding the cursor
+    finally:
+        if writer: writer.close()
+        db_conn.close()
+    return rows_written, last_collected_at, writer.path if writer else None
+
+
+def _social_row(doc):
+    row = []
+    for name, kind in SOCIAL_FIELDS:
+        value = doc.get(name)
+        if name == '_id':
+            value = str(value)
+        elif kind == 'json' and value is not None:
+            value = json.dumps(value, default=str)
+        row.append(value)
+    return row
+
+
+def export_social_posts(out_dir, file_format, batch_size, since=None):
+    """Stream social_media_posts in batches. Returns (rows, max collected_at, path)."""
+    from pymongo import MongoClient
+    mongo_client = MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=5000)
+    writer = None
+    rows_written = 0
+    last_collected_at = since
+    columns = [name for name, _ in SOCIAL_FIELDS]
+    try:
+        posts_collection = mongo_client['web3_data']['social_media_posts']
+        query = {'collected_at': {'$gt': since}} if since else {}
+        cursor = posts_collection.find(query).sort('collected_at', 1).batch_size(batch_size)
+        batch = []
+
+        def flush():
+            nonlocal writer, rows_written
+            if writer is None:
+                schema = social_parquet_schema() if file_format == 'parquet' else None
+                writer = open_writer(out_dir, 'social_media_posts', file_format, schema=schema)
+            writer.write_batch(columns, batch)
+            rows_written += len(batch)
+            print(f"  social_media_posts: {rows_written} rows written...")
+
+        for doc in cursor:
+            batch.append(_social_row(doc))
+            collected_at = doc.get('collected_at')
+            if collected_at and (last_collected_at is None or collected_at > last_collected_at):
+                last_collected_at = collected_at
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+        if batch:
+            flush()
+    finally:
+        if writer: writer.close()
+        mongo_client.close()
+    return rows_written, last_collected_at, writer.path if writer else None
+
+
+EXPORTERS = {
+    'job_postings': (export_job_postings, 'POSTGRES_URI'),
+    'social_media_posts': (export_social_posts, 'MONGO_URI'),
+}
+
+
+def run_export(source, out_dir, file_format, batch_size, incremental):
+    exporter, env_var = EXPORTERS[source]
+    if not os.environ.get(env_var):
+        print(f">>> Error: {env_var} secret not found - skipping {source}.")
+        return source, False
+    since = None
+    if incremental and load_state(out_dir).get(source):
+        since = datetime.fromisoformat(load_state(out_dir)[source])
+    print(f"Exporting {source} ({file_format}, since={since})...")
+    start = time.time()
+    try:
+        rows, last_collected_at, path = exporter(out_dir, file_format, batch_size, since)
+    except Exception as export_err:
+        print(f">>> Error exporting {source}: {export_err}")
+        return source, False
+    if last_collected_at:
+        save_state(out_dir, source, last_collected_at)
+    print(f"Finished {source}: {rows} rows in {time.time() - start:.2f}s -> {path or '[no new rows]'}")
+    return source, True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream job_postings and social_media_posts to Parquet/CSV.")
+    parser.add_argument('--format', choices=['parquet', 'csv'], default='parquet')
+    parser.add_argument('--out', default=DEFAULT_OUT_DIR)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only export rows collected after the previous export of each source')
+    parser.add_argument('--only', choices=list(EXPORTERS), action='append',
+                        help='Export just this source (can be repeated)')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out, exist_ok=True)
+    sources = args.only or list(EXPORTERS)
+    print(f"--- Starting Export at {datetime.utcnow().isoformat()} ---")
+    # The two sources live in different databases, so export them side by side
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        results = list(pool.map(
+            lambda source: run_export(source, args.out, args.format, args.batch_size, args.incremental),
+            sources
+        ))
+    failed = [source for source, ok in results if not ok]
+    print(f"--- Export Finished at {datetime.utcnow().isoformat()} ---")
+    if failed:
+        print(f">>> Export failed for: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+# ----- ingest_version.py -----
+# Per-source version stamps bumped by each collector run that changed data.
+# Readers (api_service.py) poll these instead of the data itself and drop
+# cached responses whenever any stamp moves.
+# Mongo-backed collectors stamp MongoDB, Postgres-backed ones stamp PostgreSQL,
+# so every collector can bump in the same store (and transaction) it writes to.
+from datetime import datetime
+
+MONGO_COLLECTION = 'ingest_versions'
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS ingest_versions (
+        source     TEXT PRIMARY KEY,
+        version    BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP NOT NULL
+    );
+"""
+
+BUMP_SQL = """
+    INSERT INTO ingest_versions AS v (source, version, updated_at)
+    VALUES (%s, 1, %s)
+    ON CONFLICT (source) DO UPDATE SET version = v.version + 1, updated_at = EXCLUDED.updated_at;
+"""
+
+
+def bump_postgres(db_cursor, source):
+    """Bump the stamp inside the caller's transaction, so it commits with the data."""
+    db_cursor.execute(BUMP_SQL, (source, datetime.utcnow()))
+
+
+def _mongo_bump(source):
+    return {'_id': source}, {'$inc': {'version': 1}, '$set': {'updated_at': datetime.utcnow()}}
+
+
+def bump_mongo(db, source):
+    db[MONGO_COLLECTION].update_one(*_mongo_bump(source), upsert=True)
+
+
+async def bump_mongo_async(db, source):
+    """Same as bump_mongo, for an AsyncMongoClient database (async_collector.py)."""
+    await db[MONGO_COLLECTION].update_one(*_mongo_bump(source), upsert=True)
+
+
+def read_postgres(db_cursor):
+    db_cursor.execute("SELECT to_regclass('ingest_versions') IS NOT NULL;")
+    if not db_cursor.fetchone()[0]:
+        return {}
+    db_cursor.execute("SELECT source, version FROM ingest_versions;")
+    return {source: version for source, version in db_cursor.fetchall()}
+
+
+def read_mongo(db):
+    return {doc['_id']: doc['version'] for doc in db[MONGO_COLLECTION].find({}, {'version': 1})}
@@ -0,0 +1,212 @@
+# ----- job_history.py -----
+# Change detection for job_postings. Inserts used to be ON CONFLICT (job_url)
+# DO NOTHING, so a posting whose salary, description or tags were edited
+# kept its first version forever; a plain DO UPDATE would instead rewrite
+# every row on every run (WAL, dead tuples, vacuum) to change nothing.
+#
+# Every job row now carries content_hash, a digest of its content columns
+# (documents.py sets it when the row is built). The shared upsert only updates
+# a conflicting row when the stored hash differs, so unchanged postings cost
+# no write at all. An AFTER UPDATE trigger - which fires only when the hash
+# changed - appends the previous values of just the columns that changed to
+# job_postings_history, so the history stays proportional to real edits. The
+# trigger also covers the spool and async writers without each of them
+# reading the old row first.
+#
+# Rows stored before the hash existed have content_hash NULL: the first time
+# one is seen again it adopts the hash without a history entry (there is no
+# trustworthy "before"). `backfill` hashes them all up front instead.
+#
+# The seen-filter keys job rows by URL + hash, so an edited posting is no
+# longer dropped locally as "already stored".
+#
+# Usage:
+#   python job_history.py show <job_url>            # current row hash + every recorded change
+#   python job_history.py recent [--days 7] [--limit 50]
+#   python job_history.py backfill                  # hash rows stored before content_hash existed
+import argparse
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+BACKFILL_BATCH = 1000
+
+# What a posting "says": a change in any of these is an edit worth recording.
+# Missing keys hash as None, so a CryptoJobsList row (no description) hashes the
+# same whether it comes from the scraper or back out of the database.
+HASHED_COLUMNS = ['title', 'company_name', 'location', 'salary_range', 'tags', 'description',
+                  'external_id', 'is_remote', 'date_posted_epoch']
+# Identity and first-seen time are never overwritten by an update
+KEEP_ON_UPDATE = {'job_url', 'source', 'collected_at'}
+
+ENSURE_SQL = """
+    ALTER TABLE job_postings ADD COLUMN IF NOT EXISTS content_hash TEXT;
+    ALTER TABLE job_postings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+
+    CREATE TABLE IF NOT EXISTS job_postings_history (
+        id           BIGSERIAL PRIMARY KEY,
+        job_url      TEXT NOT NULL,
+        content_hash TEXT,                 -- hash of the version below
+        changed_at   TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        previous     JSONB NOT NULL        -- old values of only the columns that changed
+    );
+    CREATE INDEX IF NOT EXISTS idx_job_postings_history_url ON job_postings_history (job_url, changed_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_job_postings_history_changed ON job_postings_history (changed_at);
+
+    CREATE OR REPLACE FUNCTION job_postings_record_change() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO job_postings_history (job_url, content_hash, previous)
+        SELECT OLD.job_url, OLD.content_hash, coalesce(jsonb_object_agg(old_col.key, old_col.value), '{}'::jsonb)
+        FROM jsonb_each(to_jsonb(OLD)) AS old_col
+        JOIN jsonb_each(to_jsonb(NEW)) AS new_col USING (key)
+        WHERE old_col.value IS DISTINCT FROM new_col.value
+          AND old_col.key NOT IN ('content_hash', 'updated_at', 'search_tsv');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS job_postings_history_trigger ON job_postings;
+    CREATE TRIGGER job_postings_history_trigger
+        AFTER UPDATE ON job_postings
+        FOR EACH ROW
+        WHEN (OLD.content_hash IS NOT NULL AND OLD.content_hash IS DISTINCT FROM NEW.content_hash)
+        EXECUTE FUNCTION job_postings_record_change();
+"""
+
+
+def content_hash(job):
+    """Hex digest of the row's HASHED_COLUMNS (a dict from documents.py or a database row)."""
+    content = json.dumps([job.get(column) for column in HASHED_COLUMNS], separators=(',', ':'),
+                         ensure_ascii=False, default=str)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def seen_key(job_url, job_hash):
+    """seen_filter key for a job row: the same URL with new content is a different key."""
+    return f"{job_url}#{job_hash}" if job_hash else job_url
+
+
+def upsert_sql(columns, rows_sql=None):
+    """INSERT for job rows that inserts new URLs and updates known ones only when their hash changed.
+
+    rows_sql replaces the single-row VALUES (%s, ...) - e.g. 'VALUES %s' for execute_values.
+    Returns (job_url, inserted) for every row written - inserted is False for an update;
+    unchanged rows return nothing. A statement must not carry the same job_url twice
+    (see unique_by_url).
+    """
+    rows_sql = rows_sql or f"VALUES ({', '.join(['%s'] * len(columns))})"
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column not in KEEP_ON_UPDATE)
+    # xmax is 0 only on a tuple this statement inserted; an updated one carries our transaction ID
+    return f"""
+        INSERT INTO job_postings AS j ({', '.join(columns)})
+        {rows_sql}
+        ON CONFLICT (job_url) DO UPDATE SET {updates}, updated_at = (now() AT TIME ZONE 'utc')
+        WHERE j.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+        RETURNING j.job_url, (j.xmax = 0) AS inserted;
+    """
+
+
+def unique_by_url(items, job=lambda item: item):
+    """The last item per job_url: ON CONFLICT DO UPDATE can't touch one row twice in a statement."""
+    return list({job(item)['job_url']: item for item in items}.values())
+
+
+# --- Backfill ---
+def backfill(db_conn, batch_size=BACKFILL_BATCH):
+    """Set content_hash on rows stored before it existed. Returns rows updated."""
+    from psycopg2.extras import execute_values
+    updated = 0
+    last_id = 0
+    while True:
+        with db_conn.cursor() as db_cursor:
+            # Keyset over id, like skills.backfill_jobs; the trigger ignores rows whose old hash is NULL
+            db_cursor.execute(f"""
+                SELECT id, {', '.join(HASHED_COLUMNS)} FROM job_postings
+                WHERE id > %s AND content_hash IS NULL
+                ORDER BY id LIMIT %s;
+            """, (last_id, batch_size))
+            rows = db_cursor.fetchall()
+            if not rows:
+                return updated
+            values = [(row[0], content_hash(dict(zip(HASHED_COLUMNS, row[1:])))) for row in rows]
+            execute_values(db_cursor, """
+                UPDATE job_postings AS j SET content_hash = v.content_hash
+                FROM (VALUES %s) AS v (id, content_hash) WHERE j.id = v.id;
+            """, values)
+        db_conn.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+        print(f"  job_postings: {updated} rows hashed...")
+
+
+# --- Queries ---
+def history(db_cursor, job_url):
+    """[(changed_at, content_hash, previous)] for one posting, newest first."""
+    db_cursor.execute("""
+        SELECT changed_at, content_hash, previous FROM job_postings_history
+        WHERE job_url = %s ORDER BY changed_at DESC;
+    """, (job_url,))
+    return db_cursor.fetchall()
+
+
+def recent_changes(db_cursor, days=7, limit=50):
+    """[(changed_at, job_url, changed columns)] across all postings, newest first."""
+    db_cursor.execute("""
+        SELECT changed_at, job_url, ARRAY(SELECT jsonb_object_keys(previous) ORDER BY 1)
+        FROM job_postings_history
+        WHERE changed_at >= %s
+        ORDER BY changed_at DESC LIMIT %s;
+    """, (datetime.utcnow() - timedelta(days=days), limit))
+    return db_cursor.fetchall()
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Edits recorded for job_postings.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    show = sub.add_parser('show', help='Print the recorded changes of one posting')
+    show.add_argument('job_url')
+    recent = sub.add_parser('recent', help='Most recently edited postings')
+    recent.add_argument('--days', type=int, default=7)
+    recent.add_argument('--limit', type=int, default=50)
+    sub.add_parser('backfill', help='Hash rows stored before content_hash existed')
+    args = parser.parse_args(argv)
+
+    import psycopg2 # Only needed for the CLI
+    db_uri = os.environ.get('POSTGRES_URI')
+    if not db_uri:
+        print(">>> Error: POSTGRES_URI secret not found or is empty!")
+        return 1
+    db_conn = psycopg2.connect(db_uri)
+    try:
+        if args.command == 'backfill':
+            print(f"Hashed {backfill(db_conn)} job postings.")
+            return 0
+        with db_conn.cursor() as cur:
+            if args.command == 'show':
+                cur.execute("SELECT content_hash, collected_at, updated_at FROM job_postings WHERE job_url = %s;",
+                            (args.job_url,))
+                current = cur.fetchone()
+                if current is None:
+                    print(f"No job posting with URL {args.job_url}")
+                    return 1
+                print(f"Current version {current[0] or '(not hashed yet)'}: first seen {current[1]}, "
+                      f"last changed {current[2] or 'never'}")
+                for changed_at, old_hash, previous in history(cur, args.job_url):
+                    print(f"\n--- Replaced at {changed_at} (was {old_hash}) ---")
+                    print(json.dumps(previous, indent=2, ensure_ascii=False, default=str))
+            else:
+                changes = recent_changes(cur, args.days, args.limit)
+                for changed_at, job_url, columns in changes:
+                    print(f"{changed_at:%Y-%m-%d %H:%M}  {job_url}  ({', '.join(columns)})")
+                if not changes:
+                    print(f"No edits recorded in the last {args.days} days.")
+    finally:
+        db_conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# ----- job_raw_store.py -----
+# Side storage for the original API payload of each job posting.
+# job_postings used to carry the full JSON (description included) in
+# raw_api_response on every row, roughly doubling row size for every scan.
+# The payload now lives zstd-compressed in job_postings_raw, keyed by the same
+# job_url that job_postings uses as its conflict target, and is only read when
+# someone actually asks for the original.
+#
+# Usage:
+#   python job_raw_store.py show <job_url>               # print the original payload
+#   python job_raw_store.py migrate [--batch 500]        # move existing raw_api_response values out
+#   python job_raw_store.py migrate --drop-column        # ...and then drop the column
+import argparse
+import json
+import os
+import sys
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS job_postings_raw (
+        job_url      TEXT PRIMARY KEY,
+        source       TEXT NOT NULL,
+        external_id  TEXT,
+        payload_zstd BYTEA NOT NULL,
+        stored_at    TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+    );
+    -- Already compressed, so skip TOAST's own pglz pass
+    ALTER TABLE job_postings_raw ALTER COLUMN payload_zstd SET STORAGE EXTERNAL;
+"""
+
+INSERT_SQL = """
+    INSERT INTO job_postings_raw (job_url, source, external_id, payload_zstd)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (job_url) DO NOTHING;
+"""
+
+COMPRESSION_LEVEL = 10
+
+
+def _zstd():
+    import zstandard
+    return zstandard
+
+
+def compress_payload(payload):
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return _zstd().ZstdCompressor(level=COMPRESSION_LEVEL).compress(data)
+
+
+def decompress_payload(blob):
+    return json.loads(_zstd().ZstdDecompressor().decompress(bytes(blob)).decode('utf-8'))
+
+
+def ensure_table(db_cursor):
+    db_cursor.execute(CREATE_TABLE_SQL)
+
+
+def save(db_cursor, job_url, source, external_id, payload):
+    """Store the raw payload for a posting (no-op if one is already stored). Runs in the caller's transaction."""
+    db_cursor.execute(INSERT_SQL, (job_url, source, external_id, compress_payload(payload)))
+    return db_cursor.rowcount > 0
+
+
+def load(db_cursor, job_url):
+    """Lazy lookup of the original payload; falls back to the legacy column for unmigrated rows."""
+    db_cursor.execute("SELECT payload_zstd FROM job_postings_raw WHERE job_url = %s;", (job_url,))
+    row = db_cursor.fetchone()
+    if row:
+        return decompress_payload(row[0])
+    if has_legacy_column(db_cursor):
+        db_cursor.execute("SELECT raw_api_response FROM job_postings WHERE job_url = %s;", (job_url,))
+        row = db_cursor.fetchone()
+        if row and row[0]:
+            return json.loads(row[0]) if isinstance(row[0], str) else row[0]
+    return None
+
+
+def has_legacy_column(db_cursor):
+    db_cursor.execute("""
+        SELECT EXISTS (SELECT FROM information_schema.columns
+                       WHERE table_name = 'job_postings' AND column_name = 'raw_api_response');
+    """)
+    return db_cursor.fetchone()[0]
+
+
+def migrate_legacy_column(db_conn, batch_size=500, drop_column=False):
+    """Move raw_api_response values into job_postings_raw in batches, nulling them as we go."""
+    moved = 0
+    with db_conn.cursor() as cur:
+        ensure_table(cur)
+        db_conn.commit()
+        if not has_legacy_column(cur):
+            print("job_postings.raw_api_response does not exist - nothing to migrate.")
+            return 0
+        while True:
+            cur.execute("""
+                SELECT job_url, source, external_id, raw_api_response
+                FROM job_postings
+                WHERE raw_api_response IS NOT NULL
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED;
+            """, (batch_size,))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            for job_url, source, external_id, raw in rows:
+                payload = json.loads(raw) if isinstance(raw, str) else raw
+                save(cur, job_url, source, external_id, payload)
+            cur.execute(
+                "UPDATE job_postings SET raw_api_response = NULL WHERE job_url = ANY(%s);",
+                ([row[0] for row in rows],)
+            )
+            db_conn.commit()
+            moved += len(rows)
+            print(f"  Moved {moved} raw payloads so far...")
+        if drop_column:
+            cur.execute("ALTER TABLE job_postings DROP COLUMN raw_api_response;")
+            db_conn.commit()
+            print("Dropped job_postings.raw_api_response.")
+    print(f"Migration finished: {moved} raw payloads moved to job_postings_raw.")
+    print("Run VACUUM (ANALYZE) job_postings; to reclaim the freed TOAST space.")
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Raw payload side storage for job_postings.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    show = sub.add_parser('show', help='Print the original payload for a posting')
+    show.add_argument('job_url')
+    migrate = sub.add_parser('migrate', help='Move raw_api_response out of job_postings')
+    migrate.add_argument('--batch', type=int, default=500)
+    migrate.add_argument('--drop-column', action='store_true')
+    args = parser.parse_args(argv)
+
+    import psycopg2 # Only needed for the CLI
+    db_uri = os.environ.get('POSTGRES_URI')
+    if not db_uri:
+        print(">>> Error: POSTGRES_URI secret not found or is empty!")
+        return 1
+    db_conn = psycopg2.connect(db_uri)
+    try:
+        if args.command == 'show':
+            with db_conn.cursor() as cur:
+                payload = load(cur, args.job_url)
+            if payload is None:
+                print(f"No raw payload stored for {args.job_url}")
+                return 1
+            print(json.dumps(payload, indent=2))
+            return 0
+        migrate_legacy_column(db_conn, args.batch, args.drop_column)
+        return 0
+    finally:
+        db_conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
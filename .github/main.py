@@ -0,0 +1,214 @@
+# ----- main.py -----
+# One entry point for every collector and maintenance command.
+#
+# Nothing heavy is imported here: each subcommand names the module (or
+# standalone script) that implements it, and that module - with tweepy, praw,
+# bs4, vaderSentiment, pymongo, psycopg2 behind it - is only loaded when the
+# subcommand actually runs. Operational commands (status, breakers, spool,
+# migrate status) therefore start in a few milliseconds.
+#
+# Arguments after the subcommand are handed to the underlying script unchanged,
+# so `main.py export --help` shows export_data.py's own options.
+# --timings (before the subcommand) reports CLI startup, the import cost of
+# each of the subcommand's heavy dependencies, and the run time, on stderr.
+#
+# Usage:
+#   python main.py collect reddit                 # one source, synchronous script
+#   python main.py collect all                    # every source on one event loop (async_collector.py)
+#   python main.py collect twitter reddit --async
+#   python main.py collect all --shard 2/4        # runner 2 of 4 (see source_registry.py)
+#   python main.py score                          # VADER sentiment for unscored posts
+#   python main.py export --format csv --incremental
+#   python main.py run-all                        # the full scheduled pipeline (run_all_tasks.py)
+#   python main.py status                         # breakers, spool and daemon schedule, no databases
+#   python main.py --timings score
+import time
+
+_cli_started = time.perf_counter() # Before anything else is imported
+
+import argparse
+import importlib
+import os
+import runpy
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Synchronous collector script per source
+COLLECT_SCRIPTS = {
+    'web3career': 'collect_web3career.py',
+    'cryptojobslist': 'scrape_cryptojobslist.py',
+    'reddit': 'collect_reddit.py',
+    'twitter': 'collect_twitter.py',
+}
+# Heavy third-party imports behind each target - only imported up front with --timings, to time them
+TARGET_DEPS = {
+    'collect_web3career.py': ('requests', 'psycopg2'),
+    'scrape_cryptojobslist.py': ('requests', 'bs4', 'psycopg2'),
+    'collect_reddit.py': ('praw', 'pymongo'),
+    'collect_twitter.py': ('tweepy', 'pymongo'),
+    'async_collector': ('aiohttp', 'bs4', 'psycopg2', 'pymongo'),
+    'process_sentiment.py': ('pymongo', 'vaderSentiment.vaderSentiment'),
+    'refresh_engagement': ('pymongo', 'tweepy', 'praw'),
+    'export_data': ('pyarrow', 'psycopg2', 'pymongo'),
+    'collector_daemon': ('aiohttp', 'bs4', 'psycopg2', 'pymongo'),
+    'api_service': ('psycopg2', 'pymongo'),
+    'task_queue': ('psycopg2', 'aiohttp', 'bs4', 'pymongo'),
+    'seen_filter': ('psycopg2', 'pymongo'),
+    'skills': ('psycopg2', 'pymongo'),
+    'job_history': ('psycopg2',),
+    'retention': ('pyarrow', 'psycopg2', 'pymongo'),
+}
+
+# subcommand: (target, help). A target ending in .py is a standalone script run as __main__;
+# anything else is a module whose main(argv) gets the remaining arguments.
+PASSTHROUGH_COMMANDS = {
+    'score': ('process_sentiment.py', 'Score unscored posts with VADER (process_sentiment.py)'),
+    'refresh': ('refresh_engagement', 'Refresh tweet / Reddit engagement (refresh_engagement.py)'),
+    'export': ('export_data', 'Bulk export to Parquet or CSV (export_data.py)'),
+    'run-all': ('run_all_tasks.py', 'Run the full scheduled pipeline (run_all_tasks.py)'),
+    'daemon': ('collector_daemon', 'Poll every source continuously (collector_daemon.py)'),
+    'queue': ('task_queue', 'Shared collection_tasks queue: sync, work, status (task_queue.py)'),
+    'serve': ('api_service', 'Read-only HTTP API (api_service.py)'),
+    'migrate': ('migrations', 'Apply or inspect schema migrations (migrations.py)'),
+    'spool': ('spool', 'Inspect or drain the write spool (spool.py)'),
+    'breakers': ('resilience', 'Inspect or reset circuit breakers and checkpoints (resilience.py)'),
+    'ledger': ('run_ledger', 'Run history and anomaly checks (run_ledger.py)'),
+    'rollups': ('rollups', 'Rebuild daily aggregates (rollups.py)'),
+    'history': ('job_history', 'Recorded job posting edits, hash backfill (job_history.py)'),
+    'retention': ('retention', 'Archive old rows to Parquet cold storage, query hot + cold (retention.py)'),
+    'skills': ('skills', 'Extract skills, backfill them, and query skill demand (skills.py)'),
+    'search': ('search_index', 'Full-text search (search_index.py)'),
+    'seen': ('seen_filter', 'Inspect or rebuild the seen-ID Bloom filters (seen_filter.py)'),
+    'profile': ('profiling', 'Summarize a profile written by --profile (profiling.py)'),
+    'sources': ('source_registry', 'List registry work units and shard assignment (source_registry.py)'),
+}
+
+
+class Timings:
+    """Collects (label, seconds) pairs for --timings; does nothing when disabled."""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.rows = []
+
+    def add(self, label, seconds):
+        if self.enabled:
+            self.rows.append((label, seconds))
+
+    def import_deps(self, target):
+        """Import the target's heavy dependencies one by one so each gets its own line."""
+        if not self.enabled:
+            return
+        for dep in TARGET_DEPS.get(target, ()):
+            if dep in sys.modules:
+                continue
+            start = time.perf_counter()
+            try:
+                importlib.import_module(dep)
+                self.add(f"import {dep}", time.perf_counter() - start)
+            except ImportError:
+                self.add(f"import {dep} (not installed)", time.perf_counter() - start)
+
+    def report(self):
+        if not self.enabled:
+            return
+        print("\n--- Timings ---", file=sys.stderr)
+        for label, seconds in self.rows:
+            print(f"  {label:<45} {seconds * 1000:9.1f} ms", file=sys.stderr)
+        print(f"  {'total':<45} {(time.perf_counter() - _cli_started) * 1000:9.1f} ms "
+              f"({len(sys.modules)} modules loaded)", file=sys.stderr)
+
+
+def run_target(target, argv, timings):
+    """Run a script or module main() with argv. Returns its exit code."""
+    timings.import_deps(target)
+    if target.endswith('.py'):
+        # The collectors do their work at import time - run them exactly as `python <script>` would
+        saved_argv = sys.argv
+        sys.argv = [target] + list(argv)
+        start = time.perf_counter()
+        try:
+            runpy.run_path(os.path.join(HERE, target), run_name='__main__')
+            exit_code = 0
+        except SystemExit as exit_err:
+            exit_code = exit_err.code if isinstance(exit_err.code, int) else (0 if exit_err.code is None else 1)
+        finally:
+            sys.argv = saved_argv
+            timings.add(f"run {target}", time.perf_counter() - start)
+        return exit_code
+
+    start = time.perf_counter()
+    module = importlib.import_module(target)
+    timings.add(f"load {target}", time.perf_counter() - start)
+    start = time.perf_counter()
+    try:
+        return module.main(list(argv)) or 0
+    finally:
+        timings.add(f"run {target}.main", time.perf_counter() - start)
+
+
+def collect(args, extra, timings):
+    sources = list(COLLECT_SCRIPTS) if 'all' in args.sources else list(dict.fromkeys(args.sources))
+    if 'all' in args.sources or args.use_async:
+        only = [] if 'all' in args.sources else [arg for source in sources for arg in ('--only', source)]
+        return run_target('async_collector', only + extra, timings)
+    exit_code = 0
+    for source in sources:
+        exit_code = run_target(COLLECT_SCRIPTS[source], extra, timings) or exit_code
+    return exit_code
+
+
+def status(args, extra, timings):
+    """Local state only - breakers, checkpoints, spool, daemon schedule. Never touches a database."""
+    exit_code = 0
+    for title, target, argv in (('Circuit breakers / checkpoints', 'resilience', ['status']),
+                                ('Write spool', 'spool', ['status'])):
+        print(f"--- {title} ---")
+        exit_code = run_target(target, argv, timings) or exit_code
+    print("--- Daemon schedule ---")
+    start = time.perf_counter()
+    import collector_daemon
+    timings.add("load collector_daemon", time.perf_counter() - start)
+    collector_daemon.print_status()
+    return exit_code
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='main.py', description="Web3 data collector command line.")
+    parser.add_argument('--timings', action='store_true',
+                        help='Report startup, import and run times on stderr (give it before the subcommand)')
+    sub = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    collect_parser = sub.add_parser('collect', help='Collect one or more sources')
+    collect_parser.add_argument('sources', nargs='+', choices=list(COLLECT_SCRIPTS) + ['all'],
+                                help="Sources to collect; 'all' runs every source on one event loop")
+    collect_parser.add_argument('--async', dest='use_async', action='store_true',
+                                help='Use async_collector.py instead of the synchronous scripts')
+    collect_parser.set_defaults(handler=collect)
+
+    status_parser = sub.add_parser('status', help='Breakers, spool and daemon schedule (no databases)')
+    status_parser.set_defaults(handler=status)
+
+    for name, (target, help_text) in PASSTHROUGH_COMMANDS.items():
+        # add_help=False: -h/--help reaches the underlying script's own parser
+        command_parser = sub.add_parser(name, help=help_text, add_help=False)
+        command_parser.set_defaults(handler=lambda args, extra, timings, target=target: run_target(target, extra, timings))
+    return parser
+
+
+def main(argv=None):
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE) # The subcommand modules live next to this file
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    timings = Timings(args.timings)
+    timings.add("cli startup", time.perf_counter() - _cli_started)
+    try:
+        return args.handler(args, extra, timings)
+    finally:
+        timings.report()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
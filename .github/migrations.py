@@ -0,0 +1,376 @@
+# ----- migrations.py -----
+# Owns the schema: every table, column and index the collectors rely on, in
+# PostgreSQL (Neon) and MongoDB (Atlas), as numbered migrations.
+# Applied versions are recorded (schema_migrations table / collection), so
+# `apply` only runs what is new - run_all_tasks.py calls it first, and after a
+# deployment's first run it is a single version check. Collectors no longer
+# create tables or indexes themselves; they only check the schema version.
+#
+# Migrations are append-only: never edit one that has shipped, add a new one.
+#
+# Usage:
+#   python migrations.py apply [--only postgres|mongo]
+#   python migrations.py status
+#   python migrations.py check-indexes      # EXPLAIN the hot queries, exit 1 on a full scan
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import ingest_version
+import job_history
+import job_raw_store
+import retention
+import rollups
+import run_ledger
+import search_index
+import skills
+import task_queue
+
+MIGRATIONS_TABLE = 'schema_migrations'
+MIGRATION_LOCK_ID = 390039 # pg_advisory_xact_lock key, so two deployments can't migrate at once
+
+# --- PostgreSQL ---
+JOB_POSTINGS_SQL = """
+    CREATE TABLE IF NOT EXISTS job_postings (
+        id                SERIAL PRIMARY KEY,
+        title             TEXT NOT NULL,
+        company_name      TEXT,
+        location          TEXT,
+        salary_range      TEXT,
+        tags              TEXT[],
+        source            TEXT NOT NULL,
+        job_url           TEXT NOT NULL UNIQUE, -- ON CONFLICT target for every insert
+        description       TEXT,
+        external_id       TEXT,
+        is_remote         BOOLEAN,
+        date_posted_epoch BIGINT,
+        collected_at      TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+JOB_POSTINGS_INDEXES_SQL = """
+    -- api_service latest_jobs (?source=...), per-source exports
+    CREATE INDEX IF NOT EXISTS idx_job_postings_source_collected ON job_postings (source, collected_at DESC);
+    -- latest_jobs across sources, incremental exports (collected_at > last export)
+    CREATE INDEX IF NOT EXISTS idx_job_postings_collected ON job_postings (collected_at);
+    -- tag filters: tags @> ARRAY['solidity']
+    CREATE INDEX IF NOT EXISTS idx_job_postings_tags ON job_postings USING GIN (tags);
+"""
+
+# (version, description, SQL). The earlier modules' CREATE ... IF NOT EXISTS
+# statements are the baseline, so existing databases migrate without changes.
+POSTGRES_MIGRATIONS = [
+    (1, 'job_postings table', JOB_POSTINGS_SQL),
+    (2, 'job_postings_raw payload store', job_raw_store.CREATE_TABLE_SQL),
+    (3, 'daily tag/company rollups', rollups.CREATE_JOB_ROLLUPS_SQL),
+    (4, 'ingest_versions stamps', ingest_version.CREATE_TABLE_SQL),
+    (5, 'collector_runs ledger', run_ledger.CREATE_TABLE_SQL),
+    (6, 'full-text search column', search_index.ENSURE_JOBS_SQL),
+    (7, 'job_postings (source, collected_at), collected_at and GIN(tags) indexes', JOB_POSTINGS_INDEXES_SQL),
+    (8, 'collection_tasks queue', task_queue.CREATE_TABLE_SQL),
+    (9, 'job_postings skills column + GIN index', skills.ENSURE_JOBS_SQL),
+    (10, 'job_postings content_hash + job_postings_history change trigger', job_history.ENSURE_SQL),
+    (11, 'job_postings last_seen_on + cold_partitions catalog', retention.ENSURE_JOBS_SQL),
+]
+POSTGRES_VERSION = POSTGRES_MIGRATIONS[-1][0]
+
+CREATE_MIGRATIONS_TABLE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+        version     INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at  TIMESTAMP NOT NULL
+    );
+"""
+
+# Two statements: the second can't even be planned before the table exists
+HAS_MIGRATIONS_TABLE_SQL = f"SELECT to_regclass('{MIGRATIONS_TABLE}') IS NOT NULL;"
+MAX_VERSION_SQL = f"SELECT coalesce(max(version), 0) FROM {MIGRATIONS_TABLE};"
+
+
+def postgres_version(db_cursor):
+    db_cursor.execute(HAS_MIGRATIONS_TABLE_SQL)
+    if not db_cursor.fetchone()[0]:
+        return 0
+    db_cursor.execute(MAX_VERSION_SQL)
+    return db_cursor.fetchone()[0]
+
+
+def apply_postgres(db_conn):
+    """Apply pending migrations, each in its own transaction. Returns the versions applied."""
+    applied = []
+    with db_conn.cursor() as db_cursor:
+        # Current schema (every run after a deployment's first): one version read, no lock, no DDL
+        current = postgres_version(db_cursor) >= POSTGRES_VERSION
+        db_conn.rollback()
+        if current:
+            return applied
+        db_cursor.execute(CREATE_MIGRATIONS_TABLE_SQL)
+        db_conn.commit()
+        for version, description, sql in POSTGRES_MIGRATIONS:
+            db_cursor.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_ID,))
+            db_cursor.execute(f"SELECT 1 FROM {MIGRATIONS_TABLE} WHERE version = %s;", (version,))
+            if db_cursor.fetchone():
+                db_conn.commit()
+                continue
+            print(f"  Applying PostgreSQL migration {version}: {description}...")
+            db_cursor.execute(sql)
+            db_cursor.execute(f"INSERT INTO {MIGRATIONS_TABLE} (version, description, applied_at) VALUES (%s, %s, %s);",
+                              (version, description, datetime.utcnow()))
+            db_conn.commit()
+            applied.append(version)
+    return applied
+
+
+# --- MongoDB ---
+def _unique_post_key(db):
+    db['social_media_posts'].create_index([('source', 1), ('source_specific_id', 1)], unique=True)
+
+
+def _drop_redundant_post_indexes(db):
+    # collect_twitter.py used to add these; the unique (source, source_specific_id) index covers both lookups
+    existing = db['social_media_posts'].index_information()
+    for name in ('source_specific_id_1', 'source_1'):
+        if name in existing:
+            db['social_media_posts'].drop_index(name)
+
+
+def _unscored_posts_index(db):
+    # Partial indexes can't select "field missing", so new posts carry sentiment_pending: true
+    # until process_sentiment.py scores them - the index holds only the backlog
+    posts = db['social_media_posts']
+    posts.update_many({'sentiment': {'$exists': False}, 'sentiment_pending': {'$exists': False}},
+                      {'$set': {'sentiment_pending': True}})
+    posts.create_index([('collected_at', 1)], name='unscored_posts',
+                       partialFilterExpression={'sentiment_pending': True})
+
+
+def _post_time_indexes(db):
+    posts = db['social_media_posts']
+    posts.create_index([('source', 1), ('collected_at', -1)]) # Per-source recent posts
+    posts.create_index([('collected_at', 1)]) # Incremental exports
+
+
+def _sentiment_rollup_index(db):
+    rollups.ensure_sentiment_indexes(db)
+
+
+def _posts_text_index(db):
+    search_index.ensure_posts_index(db)
+
+
+def _tweet_engagement_series(db):
+    # Time-series collection: MongoDB groups each tweet's snapshots into hourly buckets
+    if 'tweet_engagement' not in db.list_collection_names():
+        db.create_collection('tweet_engagement',
+                             timeseries={'timeField': 'ts', 'metaField': 'tweet_id', 'granularity': 'hours'})
+    db['tweet_engagement'].create_index([('tweet_id', 1), ('ts', 1)])
+    # refresh_engagement.py picks tweets by creation time
+    db['social_media_posts'].create_index([('source', 1), ('created_at', -1)])
+
+
+def _reddit_refresh_index(db):
+    # refresh_engagement.py picks Reddit posts by when they are next due
+    db['social_media_posts'].create_index([('source', 1), ('next_refresh_at', 1), ('created_utc', 1)])
+
+
+def _post_skills_index(db):
+    skills.ensure_posts_index(db)
+
+
+def _cold_partitions_index(db):
+    retention.ensure_posts_catalog(db)
+
+
+MONGO_MIGRATIONS = [
+    (1, 'unique (source, source_specific_id) on social_media_posts', _unique_post_key),
+    (2, 'drop redundant single-field post indexes', _drop_redundant_post_indexes),
+    (3, 'partial index on unscored posts (sentiment_pending)', _unscored_posts_index),
+    (4, 'social_media_posts (source, collected_at) and collected_at indexes', _post_time_indexes),
+    (5, 'sentiment rollup (dimension, day) index', _sentiment_rollup_index),
+    (6, 'social_media_posts text search index', _posts_text_index),
+    (7, 'tweet_engagement time series + (source, created_at) index', _tweet_engagement_series),
+    (8, 'social_media_posts (source, next_refresh_at, created_utc) index', _reddit_refresh_index),
+    (9, 'social_media_posts (skills, collected_at) index', _post_skills_index),
+    (10, 'cold_partitions catalog (table_name, first/last collected_at) index', _cold_partitions_index),
+    # Version 6 built the text index without language_override on existing deployments
+    (11, 'rebuild social_media_posts text index with language_override', _posts_text_index),
+]
+MONGO_VERSION = MONGO_MIGRATIONS[-1][0]
+
+
+def mongo_version(db):
+    latest = db[MIGRATIONS_TABLE].find_one(sort=[('_id', -1)])
+    return latest['_id'] if latest else 0
+
+
+def apply_mongo(db):
+    """Apply pending migrations in order. Index builds are idempotent, so a crash mid-way is safe to rerun."""
+    applied = []
+    if mongo_version(db) >= MONGO_VERSION:
+        return applied # Current schema: a single find_one
+    done = {doc['_id'] for doc in db[MIGRATIONS_TABLE].find({}, {'_id': 1})}
+    for version, description, migrate in MONGO_MIGRATIONS:
+        if version in done:
+            continue
+        print(f"  Applying MongoDB migration {version}: {description}...")
+        migrate(db)
+        db[MIGRATIONS_TABLE].insert_one({'_id': version, 'description': description, 'applied_at': datetime.utcnow()})
+        applied.append(version)
+    return applied
+
+
+# --- Checks used by the collectors ---
+def check_version(store, found, expected):
+    """Raise if the database is behind this code. Collectors call this instead of creating tables."""
+    if found < expected:
+        raise RuntimeError(f"{store} schema is at version {found}, this code needs {expected} - "
+                           f"run `python migrations.py apply` first.")
+
+
+def require_postgres(db_cursor):
+    check_version('PostgreSQL', postgres_version(db_cursor), POSTGRES_VERSION)
+
+
+def require_mongo(db):
+    check_version('MongoDB', mongo_version(db), MONGO_VERSION)
+
+
+# --- Index usage check ---
+# (name, SQL, params) - the queries the collectors and api_service.py run most
+POSTGRES_HOT_QUERIES = [
+    ('conflict check on job_url', "SELECT 1 FROM job_postings WHERE job_url = %s;", ('https://example.com/job',)),
+    ('latest jobs for a source',
+     "SELECT * FROM job_postings WHERE source = %s ORDER BY collected_at DESC LIMIT 50;", ('Web3.Career',)),
+    ('latest jobs', "SELECT * FROM job_postings ORDER BY collected_at DESC LIMIT 50;", ()),
+    ('incremental export', "SELECT * FROM job_postings WHERE collected_at > %s ORDER BY collected_at;",
+     (datetime.utcnow() - timedelta(days=1),)),
+    ('jobs with a tag', "SELECT job_url FROM job_postings WHERE tags @> ARRAY[%s]::text[];", ('Solidity',)),
+    ('jobs requiring a skill', "SELECT job_url FROM job_postings WHERE skills @> ARRAY[%s]::text[];", ('Solidity',)),
+    ('full-text search', search_index.SEARCH_JOBS_SQL,
+     {'query': 'solidity engineer', 'after_rank': None, 'after_key': None, 'limit': 20}),
+]
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+def check_postgres_indexes(db_conn):
+    """EXPLAIN each hot query with sequential scans discouraged: a Seq Scan on job_postings
+    that survives means no index can serve the query. Returns the failing query names."""
+    failing = []
+    with db_conn.cursor() as db_cursor:
+        for name, sql, params in POSTGRES_HOT_QUERIES:
+            db_cursor.execute("SET LOCAL enable_seqscan = off;") # Small tables would seq-scan anyway
+            db_cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = db_cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            nodes = list(_plan_nodes(plan[0]['Plan']))
+            scans = [n for n in nodes if n.get('Node Type') == 'Seq Scan' and n.get('Relation Name') == 'job_postings']
+            indexes = sorted({n['Index Name'] for n in nodes if n.get('Index Name')})
+            print(f"  {'SEQ SCAN' if scans else 'ok':<8} postgres: {name} ({', '.join(indexes) or 'no index'})")
+            if scans:
+                failing.append(name)
+        db_conn.rollback()
+    return failing
+
+
+def _mongo_hot_queries(db):
+    posts = db['social_media_posts']
+    return [
+        ('unscored posts (process_sentiment.py)', posts.find({'sentiment_pending': True}).sort('collected_at', 1).limit(50)),
+        ('post dedupe lookup', posts.find({'source': 'twitter', 'source_specific_id': '0'})),
+        ('latest posts for a source', posts.find({'source': 'reddit'}).sort('collected_at', -1).limit(50)),
+        ('incremental export', posts.find({'collected_at': {'$gt': datetime.utcnow() - timedelta(days=1)}}).sort('collected_at', 1)),
+        ('text search', posts.find({'$text': {'$search': 'solidity'}})),
+        ('posts mentioning a skill', posts.find({'skills': 'Solidity'}).sort('collected_at', -1).limit(50)),
+        ('tweets due for an engagement refresh', posts.find(
+            {'source': 'twitter', 'created_at': {'$gte': datetime.utcnow() - timedelta(days=7)}})),
+        ('Reddit posts due for a score refresh', posts.find(
+            {'source': 'reddit', 'next_refresh_at': {'$lte': datetime.utcnow()}}).sort('next_refresh_at', 1)),
+        ('sentiment series', db[rollups.SENTIMENT_COLLECTION].find(
+            {'dimension': 'all', 'day': {'$gte': datetime.utcnow() - timedelta(days=30)}}).sort('day', 1)),
+    ]
+
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+def check_mongo_indexes(db):
+    """explain() each hot query; a COLLSCAN in the winning plan means no index serves it."""
+    failing = []
+    for name, cursor in _mongo_hot_queries(db):
+        winning = cursor.explain()['queryPlanner']['winningPlan']
+        stages = list(_plan_stages(winning))
+        collscan = any(s['stage'] == 'COLLSCAN' for s in stages)
+        indexes = sorted({s['indexName'] for s in stages if s.get('indexName')})
+        print(f"  {'COLLSCAN' if collscan else 'ok':<8} mongo: {name} ({', '.join(indexes) or 'no index'})")
+        if collscan:
+            failing.append(name)
+    return failing
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply and inspect schema migrations.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    apply = sub.add_parser('apply', help='Apply pending migrations')
+    apply.add_argument('--only', choices=['postgres', 'mongo'], help='Just one database')
+    sub.add_parser('status', help='Show applied vs. expected schema versions')
+    sub.add_parser('check-indexes', help='Check that the hot queries use an index')
+    args = parser.parse_args(argv)
+
+    stores = [args.only] if getattr(args, 'only', None) else ['postgres', 'mongo']
+    exit_code = 0
+    if 'postgres' in stores:
+        if not os.environ.get('POSTGRES_URI'):
+            print(">>> Error: POSTGRES_URI secret not found or is empty!")
+            return 1
+        import psycopg2
+        db_conn = psycopg2.connect(os.environ['POSTGRES_URI'])
+        try:
+            if args.command == 'apply':
+                applied = apply_postgres(db_conn)
+                print(f"PostgreSQL: applied {applied}" if applied else f"PostgreSQL: up to date (version {POSTGRES_VERSION}).")
+            elif args.command == 'status':
+                with db_conn.cursor() as db_cursor:
+                    print(f"PostgreSQL: version {postgres_version(db_cursor)} of {POSTGRES_VERSION}")
+                db_conn.rollback()
+            elif check_postgres_indexes(db_conn):
+                exit_code = 1
+        finally:
+            db_conn.close()
+    if 'mongo' in stores:
+        if not os.environ.get('MONGO_URI'):
+            print(">>> Error: MONGO_URI secret not found!")
+            return 1
+        from pymongo import MongoClient
+        mongo_client = MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=5000)
+        try:
+            db = mongo_client['web3_data']
+            if args.command == 'apply':
+                applied = apply_mongo(db)
+                print(f"MongoDB: applied {applied}" if applied else f"MongoDB: up to date (version {MONGO_VERSION}).")
+            elif args.command == 'status':
+                print(f"MongoDB: version {mongo_version(db)} of {MONGO_VERSION}")
+            elif check_mongo_indexes(db):
+                exit_code = 1
+        finally:
+            mongo_client.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# ----- pipeline.py -----
+# Bounded-queue producer/consumer pipeline for the synchronous collectors:
+#
+#   source -> fetch workers -> parse workers -> ... -> BatchSink (calling thread)
+#
+# Every stage runs on its own thread(s) and hands items to the next through a
+# queue of at most `queue_size` items, so the next request is already on the
+# wire while the previous listing is parsed and the one before is written.
+# A full queue blocks its producer: a slow database slows fetching down
+# instead of letting fetched pages pile up in memory.
+#
+# The sink runs in the thread that called run(), so database handles and the
+# collector's own counters are only ever touched from the main thread. It
+# flushes when `max_items` (by weight) are buffered or `max_seconds` after the
+# first buffered item, whichever comes first, and once more at the end.
+#
+# A stage function takes one item and returns an iterable of items for the
+# next stage (a list, a generator, or None for nothing). An exception in any
+# stage or in the sink stops the whole pipeline and is re-raised by run();
+# collectors catch per-unit errors inside their stage functions, as before.
+#
+# Usage (see collect_reddit.py / collect_twitter.py):
+#   sink = pipeline.BatchSink(write_groups, max_items=500, max_seconds=5, weight=lambda group: len(group.docs))
+#   pipeline.Pipeline('reddit').stage('fetch', fetch_unit).stage('parse', parse_unit).run(units, sink)
+import queue
+import threading
+import time
+
+DEFAULT_QUEUE_SIZE = 4 # Items in flight between two stages
+POLL_SECONDS = 0.2 # How often blocked threads check whether the pipeline was stopped
+
+_DONE = object() # End-of-stream marker, one per consumer
+
+
+class PipelineStopped(Exception):
+    """Raised inside worker threads once another stage has failed."""
+
+
+class BatchSink:
+    """Buffers items and hands them to write(batch) by size or age."""
+
+    def __init__(self, write, max_items=500, max_seconds=5.0, weight=None):
+        self.write = write
+        self.max_items = max_items
+        self.max_seconds = max_seconds
+        self.weight = weight or (lambda item: 1)
+        self.batch = []
+        self.batch_weight = 0
+        self.batch_started = None
+        self.flushes = 0
+
+    def add(self, item):
+        if not self.batch:
+            self.batch_started = time.monotonic()
+        self.batch.append(item)
+        self.batch_weight += self.weight(item)
+        if self.batch_weight >= self.max_items:
+            self.flush()
+
+    def seconds_left(self):
+        """Until the buffered batch is due, or None if nothing is buffered."""
+        if not self.batch:
+            return None
+        return max(0.0, self.batch_started + self.max_seconds - time.monotonic())
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch, self.batch_weight = self.batch, [], 0
+        self.flushes += 1
+        self.write(batch)
+
+
+class Pipeline:
+    def __init__(self, name, queue_size=DEFAULT_QUEUE_SIZE):
+        self.name = name
+        self.queue_size = queue_size
+        self.stages = [] # (name, func, workers)
+        self.counts = {} # stage name -> items it produced
+        self.blocked_seconds = {} # stage name -> time spent waiting on a full queue (backpressure)
+        self._stop = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+
+    def stage(self, name, func, workers=1):
+        self.stages.append((name, func, workers))
+        self.counts[name] = 0
+        self.blocked_seconds[name] = 0.0
+        return self
+
+    # --- Queue helpers that give up once the pipeline is stopped ---
+    def _put(self, q, item, stage_name=None):
+        start = time.monotonic()
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                q.put(item, timeout=POLL_SECONDS)
+                break
+            except queue.Full:
+                continue
+        if stage_name is not None:
+            waited = time.monotonic() - start
+            if waited > 0.001:
+                with self._lock:
+                    self.blocked_seconds[stage_name] += waited
+
+    def _get(self, q, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            wait = POLL_SECONDS if deadline is None else min(POLL_SECONDS, deadline - time.monotonic())
+            if wait <= 0:
+                raise queue.Empty()
+            try:
+                return q.get(timeout=wait)
+            except queue.Empty:
+                continue
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    # --- Threads ---
+    def _feed(self, source, out_q, consumers):
+        try:
+            for item in source:
+                self._put(out_q, item) # Always ahead of the first stage - its waits say nothing
+            for _ in range(consumers):
+                self._put(out_q, _DONE)
+        except PipelineStopped:
+            pass
+        except BaseException as feed_err:
+            self._fail(feed_err)
+
+    def _work(self, stage_name, func, in_q, out_q, remaining, consumers):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _DONE:
+                    break
+                for result in func(item) or ():
+                    self._put(out_q, result, stage_name)
+                    with self._lock:
+                        self.counts[stage_name] += 1
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                # The stage's last worker passes end-of-stream on to every consumer downstream
+                for _ in range(consumers):
+                    self._put(out_q, _DONE)
+        except PipelineStopped:
+            pass
+        except BaseException as stage_err:
+            self._fail(stage_err)
+
+    def run(self, source, sink):
+        """Push every item of source through the stages into sink; returns when all is written."""
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        consumers = [workers for _, _, workers in self.stages] + [1] # The sink is the last consumer
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0], consumers[0]),
+                                    name=f"{self.name}-source", daemon=True)]
+        for index, (stage_name, func, workers) in enumerate(self.stages):
+            remaining = [workers]
+            for worker in range(workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage_name, func, queues[index], queues[index + 1], remaining, consumers[index + 1]),
+                    name=f"{self.name}-{stage_name}-{worker + 1}", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                try:
+                    item = self._get(queues[-1], timeout=sink.seconds_left())
+                except queue.Empty:
+                    sink.flush() # The buffered batch is max_seconds old
+                    continue
+                if item is _DONE:
+                    break
+                sink.add(item)
+            sink.flush()
+        except PipelineStopped:
+            pass
+        except BaseException as sink_err:
+            self._fail(sink_err)
+        finally:
+            self._stop.set() # Unblocks any thread still waiting on a queue
+            for thread in threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
+        return sink
+
+    def describe(self):
+        """One line for the run log: items per stage and time producers waited on a full queue."""
+        parts = [f"{name}={self.counts[name]}" for name, _, _ in self.stages]
+        waits = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in self.blocked_seconds.items() if seconds >= 0.1)
+        return f"pipeline {self.name}: {', '.join(parts)}" + (f" (blocked on full queues: {waits})" if waits else '')
@@ -7,8 +7,15 @@ from pymongo.errors import ConnectionFailure
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer # Import VADER
 import sys
 import time
+from run_metrics import RunMetrics # Shared stage timers/counters
+import rollups # Daily sentiment aggregates
+import ingest_version # Cache-invalidation stamp for readers
+import migrations # Schema version check
+import profiling # --profile
 
+profiling.start_if_requested('process_sentiment') # Samples the rest of the run, report at exit
 print("--- Starting Sentiment Analysis Script ---")
+metrics = RunMetrics('sentiment')
 
 # --- Database Connection Setup ---
 mongo_client = None
@@ -32,6 +39,7 @@ try:
     db = mongo_client['web3_data']
     posts_collection = db['social_media_posts']
     print("MongoDB connection successful!")
+    migrations.require_mongo(db) # The backlog query needs the unscored_posts index
     db_connection_ok = True
 
     # Try initializing VADER
@@ -44,11 +52,14 @@ try:
     if db_connection_ok and vader_init_ok:
 
         # --- Processing Logic ---
-        query = {"sentiment": {"$exists": False}}
+        # Only unscored posts carry sentiment_pending, so this reads the small unscored_posts partial index
+        query = {"sentiment_pending": True}
         process_limit = 50
         print(f"\nQuerying MongoDB for up to {process_limit} documents needing sentiment analysis...")
 
-        documents_to_analyze = list(posts_collection.find(query).limit(process_limit))
+        with metrics.stage('db_read'):
+            documents_to_analyze = list(posts_collection.find(query).sort('collected_at', 1).limit(process_limit))
+        metrics.incr('fetched', len(documents_to_analyze))
         print(f"Found {len(documents_to_analyze)} documents to analyze.")
 
         if not documents_to_analyze:
@@ -57,28 +68,49 @@ try:
             print("Starting sentiment analysis...")
             updated_count = 0
             error_count = 0
+            scored_docs = [] # Newly scored posts, added to the daily rollups once
 
             for doc in documents_to_analyze:
                 doc_id = doc.get("_id")
                 text_to_analyze = doc.get("text", "")
 
                 if not text_to_analyze or not isinstance(text_to_analyze, str) or len(text_to_analyze.strip()) < 5:
+                    # Nothing to score - take it out of the backlog so it doesn't hold up the next batch
+                    posts_collection.update_one({"_id": doc_id}, {"$unset": {"sentiment_pending": ""}})
                     continue
 
                 try:
-                    vs = analyzer.polarity_scores(text_to_analyze)
-                    update_result = posts_collection.update_one(
-                        {"_id": doc_id},
-                        {"$set": {"sentiment": vs, "sentiment_analyzed_at": datetime.utcnow()}}
-                    )
+                    with metrics.stage('score'):
+                        vs = analyzer.polarity_scores(text_to_analyze)
+                    with metrics.stage('db_write'):
+                        update_result = posts_collection.update_one(
+                            {"_id": doc_id},
+                            {"$set": {"sentiment": vs, "sentiment_analyzed_at": datetime.utcnow()},
+                             "$unset": {"sentiment_pending": ""}}
+                        )
                     if update_result.modified_count == 1:
                         updated_count += 1
+                        metrics.incr('inserted')
+                        doc['sentiment'] = vs
+                        scored_docs.append(doc)
                     else:
                          print(f"  Warning: Document {doc_id} might not have been updated (modified_count=0).")
 
                 except Exception as analysis_err:
                     print(f"  > Error analyzing/updating document {doc_id}: {analysis_err}")
                     error_count += 1
+                    metrics.incr('errors')
+
+            # --- Rollups ---
+            try:
+                with metrics.stage('db_write'):
+                    rollup_updates = rollups.apply_sentiment_rollups(db, scored_docs)
+                print(f"Updated {rollup_updates} daily sentiment rollup rows.")
+                if updated_count:
+                    ingest_version.bump_mongo(db, 'sentiment')
+            except Exception as rollup_err:
+                print(f"  > Error updating sentiment rollups (run 'python rollups.py rebuild --only mongo'): {rollup_err}")
+                metrics.incr('errors')
 
             # --- Analysis Summary --- (MOVED INSIDE the main try block's successful path)
             print("\n--- Analysis Summary ---")
@@ -90,9 +122,11 @@ try:
 # --- Handle Initial Connection/Setup Errors ---
 except ConnectionFailure as conn_err:
      print(f">>> MongoDB Atlas Connection Failure during setup: {conn_err}")
+     metrics.incr('errors')
      # Client might be None or partially initialized, closing handled in finally
 except Exception as setup_err:
     print(f">>> Error during initial setup (DB or VADER): {setup_err}")
+    metrics.incr('errors')
     # Ensure cleanup happens in finally
 
 # --- Cleanup ---
@@ -107,4 +141,5 @@ finally: # This now correctly follows the outer try/except block
     else:
          print("No MongoDB connection was active to close.")
 
+    metrics.write()
     print("\n--- Sentiment Analysis Script Finished ---")
\ No newline at end of file
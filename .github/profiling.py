@@ -0,0 +1,265 @@
+# ----- profiling.py -----
+# --profile mode for the runner and the collectors: a wall-clock sampling
+# profiler that shows where a slow run spent its time.
+#
+# A background thread records every other thread's Python stack each
+# PROFILE_INTERVAL seconds (default 5 ms). Because the profiler samples wall
+# time, not CPU time, time spent blocked on the network is visible as stacks
+# that end in socket / ssl / selectors. The profiled code is not instrumented,
+# so it runs at normal speed, unlike under cProfile.
+#
+# When the process exits, three files are written to PROFILE_DIR (profiles/,
+# or COLLECTOR_PROFILE_DIR):
+#   <name>.collapsed          folded stacks ("a;b;c 12"), for flamegraph.pl / inferno / speedscope
+#   <name>.speedscope.json    open at https://www.speedscope.app
+#   <name>.top.txt            time per category (network, BeautifulSoup, VADER, JSON, ...)
+#                             and the top functions by self and total time
+# The top-N summary is also printed, so it shows up in run_all_tasks.py's output.
+#
+# Usage:
+#   python collect_reddit.py --profile
+#   python async_collector.py --profile
+#   python run_all_tasks.py --profile         # every script it runs (COLLECTOR_PROFILE=1)
+#   python profiling.py show profiles/collect_reddit.collapsed [--top 30]
+import argparse
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_DIR = os.environ.get('COLLECTOR_PROFILE_DIR', 'profiles')
+PROFILE_ENV = 'COLLECTOR_PROFILE'
+INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.005'))
+TOP_N = 20
+
+# Where time goes, by the innermost frame whose file matches - so JSON encoding inside
+# pymongo counts as JSON, and a socket read inside requests counts as network
+CATEGORIES = [
+    ('network wait', ('/socket.py', '/ssl.py', '/selectors.py', '/http/client.py')),
+    ('BeautifulSoup', ('/bs4/', '/soupsieve/', '/lxml/')),
+    ('VADER scoring', ('/vaderSentiment/',)),
+    ('JSON', ('/json/', '/bson/json_util.py')),
+    ('MongoDB driver', ('/pymongo/', '/bson/')),
+    ('Postgres driver', ('/psycopg2/',)),
+    ('HTTP clients', ('/requests/', '/urllib3/', '/aiohttp/', '/tweepy/', '/praw/', '/prawcore/')),
+    ('sleeping / rate limits', ('/rate_limits.py',)),
+]
+
+
+def profile_option(argv=None):
+    """The --profile flag (unknown args are left for the script), else COLLECTOR_PROFILE."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--profile', action='store_true')
+    options, _ = parser.parse_known_args(argv)
+    return options.profile or os.environ.get(PROFILE_ENV, '') not in ('', '0')
+
+
+def short_path(filename):
+    """bs4/element.py rather than the full site-packages path; just the name for our own scripts."""
+    path = filename.replace('\\', '/')
+    for marker in ('/site-packages/', '/dist-packages/', f"/python{sys.version_info[0]}.{sys.version_info[1]}/"):
+        if marker in path:
+            return path.rsplit(marker, 1)[1]
+    return os.path.basename(path) if os.path.isabs(path) else path # Already short when read back
+
+
+def frame_label(frame):
+    filename, name, line = frame
+    # ';' separates frames in the folded format
+    return f"{name} ({short_path(filename)}:{line})".replace(';', ',')
+
+
+def category_of(stack):
+    # Innermost frame first; paths may already be short (loaded from a .collapsed file)
+    for filename, _, _ in reversed(stack):
+        path = '/' + short_path(filename)
+        for category, fragments in CATEGORIES:
+            if any(fragment in path for fragment in fragments):
+                return category
+    return 'other Python'
+
+
+class Sampler:
+    """Samples the stacks of every thread but its own until stop()."""
+
+    def __init__(self, name, interval=INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.stacks = {} # stack tuple -> id (stacks repeat; the sample list stores ids)
+        self.samples = [] # (stack id, seconds)
+        self.started = self.stopped = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        last = time.perf_counter()
+        while not self._done.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now # Sleeps overrun under load - weight by the real gap
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                # Root first; other threads get their own root so they don't merge with the main one
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                if thread_name != 'MainThread':
+                    stack.append((f"thread {thread_name}", f"[{thread_name}]", 0))
+                stack = tuple(reversed(stack))
+                stack_id = self.stacks.setdefault(stack, len(self.stacks))
+                self.samples.append((stack_id, elapsed))
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+
+    def totals(self):
+        """Seconds per distinct stack."""
+        by_id = Counter()
+        for stack_id, seconds in self.samples:
+            by_id[stack_id] += seconds
+        return {stack: by_id[stack_id] for stack, stack_id in self.stacks.items() if by_id[stack_id]}
+
+    # --- Output files ---
+    def write(self, directory=None):
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.name)
+        totals = self.totals()
+        with open(f"{base}.collapsed", 'w', encoding='utf-8') as f:
+            for stack, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+                # Folded stacks carry integer counts - microseconds keep the weights exact
+                f.write(f"{';'.join(frame_label(frame) for frame in stack)} {round(seconds * 1e6)}\n")
+        with open(f"{base}.speedscope.json", 'w', encoding='utf-8') as f:
+            json.dump(self.speedscope(), f)
+        summary = summarize(totals, self.stopped - self.started, self.name)
+        with open(f"{base}.top.txt", 'w', encoding='utf-8') as f:
+            f.write(summary + '\n')
+        return base, summary
+
+    def speedscope(self):
+        frame_index = {}
+        frames = []
+        id_to_indexes = {}
+        for stack, stack_id in self.stacks.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    filename, name, line = frame
+                    frames.append({'name': name, 'file': filename, 'line': line})
+                indexes.append(frame_index[frame])
+            id_to_indexes[stack_id] = indexes
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'exporter': 'web3 collector profiling.py',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': self.name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(seconds for _, seconds in self.samples),
+                'samples': [id_to_indexes[stack_id] for stack_id, _ in self.samples],
+                'weights': [seconds for _, seconds in self.samples],
+            }],
+        }
+
+
+def summarize(totals, wall_seconds, name, top=TOP_N):
+    """Text report: seconds per category, then the top functions by self and by total time."""
+    sampled = sum(totals.values()) or 1e-9
+    by_category = Counter()
+    self_time = Counter()
+    total_time = Counter()
+    for stack, seconds in totals.items():
+        by_category[category_of(stack)] += seconds
+        self_time[stack[-1]] += seconds
+        for frame in set(stack): # Once per stack, so recursion isn't counted twice
+            total_time[frame] += seconds
+
+    lines = [f"--- Profile: {name} ({wall_seconds:.2f}s wall, {sampled:.2f}s sampled across threads) ---",
+             "Time by category (innermost matching frame):"]
+    for category, seconds in by_category.most_common():
+        lines.append(f"  {category:<24} {seconds:9.2f}s {seconds / sampled:6.1%}")
+    for title, counter in (("self", self_time), ("total", total_time)):
+        lines.append(f"Top {top} functions by {title} time:")
+        for frame, seconds in counter.most_common(top):
+            if frame[2] == 0:
+                continue # Thread root pseudo-frames
+            lines.append(f"  {seconds:9.2f}s {seconds / sampled:6.1%}  {frame_label(frame)}")
+    return '\n'.join(lines)
+
+
+def start(name, directory=None, interval=INTERVAL):
+    """Profile the rest of this process; the files are written (and the summary printed) at exit."""
+    sampler = Sampler(name, interval).start()
+
+    def finish():
+        sampler.stop()
+        try:
+            base, summary = sampler.write(directory)
+            print(f"\n{summary}\nProfile written to {base}.collapsed / .speedscope.json / .top.txt")
+        except Exception as profile_err:
+            # Never turn a finished collection run into a failure
+            print(f">>> Warning: Could not write profile for {name}: {profile_err}")
+
+    atexit.register(finish)
+    print(f"Profiling {name} (sampling every {interval * 1000:.0f} ms)...")
+    return sampler
+
+
+def start_if_requested(name, argv=None):
+    """For the collector scripts: start() if --profile was given or COLLECTOR_PROFILE is set."""
+    if profile_option(argv):
+        return start(name)
+    return None
+
+
+def load_collapsed(path):
+    totals = Counter()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            folded, _, weight = line.rstrip('\n').rpartition(' ')
+            # Labels only - rebuild (file, name, line) tuples well enough for the summary
+            stack = []
+            for label in folded.split(';'):
+                name, _, location = label.rpartition(' (')
+                filename, _, line_no = location.rstrip(')').rpartition(':')
+                stack.append((filename, name, int(line_no) if line_no.isdigit() else 0))
+            totals[tuple(stack)] += int(weight) / 1e6
+    return totals
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a profile written by --profile.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    show_parser = sub.add_parser('show', help='Print the category / top-N summary of a .collapsed file')
+    show_parser.add_argument('path')
+    show_parser.add_argument('--top', type=int, default=TOP_N)
+    args = parser.parse_args(argv)
+
+    totals = load_collapsed(args.path)
+    name = os.path.basename(args.path).rsplit('.', 1)[0]
+    print(summarize(totals, sum(totals.values()), name, top=args.top))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# ----- rate_limits.py -----
+# One token bucket per external API, shared by every collector.
+# Buckets start from the documented limits below and then follow what the API
+# says: after each response the remaining budget and reset time from the
+# rate-limit headers re-pace the bucket so the rest of the window is spread
+# evenly, and an exhausted window blocks the bucket exactly until it resets.
+# Learned state is written to RATE_LIMIT_STATE so the next script in the run
+# (or the next run) starts from what the API last reported.
+#
+# Collectors call acquire(api) before each request and observe(api, headers)
+# after it. Instead of sleeping through a 15-minute window, acquire() gives up
+# when the wait would exceed max_wait so the collector can move on.
+import asyncio
+import json
+import os
+import threading
+import time
+
+STATE_PATH = os.environ.get('RATE_LIMIT_STATE', 'rate_limit_state.json')
+MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 120))
+# Runners collecting in parallel against one API quota (sharded runs set this to N) - each paces itself to 1/N
+SHARES = max(1, int(os.environ.get('RATE_LIMIT_SHARES') or 1))
+
+# api: (requests, per seconds, burst)
+DEFAULT_LIMITS = {
+    'twitter': (450, 15 * 60, 5),    # v2 search/recent, app-only auth
+    'twitter_lookup': (300, 15 * 60, 5), # v2 tweets lookup (GET /2/tweets), app-only auth
+    'reddit': (100, 60, 10),         # OAuth clients: 100 requests per minute
+    'web3career': (1, 1, 1),         # Not documented - stay polite
+    'cryptojobslist': (1, 2, 1),     # Scraped site - one page every 2 seconds
+}
+FALLBACK_LIMIT = (1, 1, 1)
+
+_buckets = {}
+_registry_lock = threading.Lock()
+_state_lock = threading.Lock()
+
+
+class TokenBucket:
+    def __init__(self, api, rate, capacity):
+        self.api = api
+        self.default_rate = rate
+        self.rate = rate # tokens per second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.blocked_until = 0.0 # Window exhausted - nothing accrues before this
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        accrue_from = max(self.updated, self.blocked_until)
+        if now > accrue_from:
+            self.tokens = min(self.capacity, self.tokens + (now - accrue_from) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait=None):
+        """Take a token. Returns the seconds to wait before using it, or None if that exceeds max_wait."""
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            # Tokens may go negative: each caller waits for the tokens reserved ahead of it
+            deficit = max(0.0, 1 - self.tokens)
+            wait = max(self.blocked_until, now) - now + deficit / self.rate
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def observe(self, remaining, reset_seconds):
+        """Re-pace from the server's view: `remaining` requests left, window resets in `reset_seconds`."""
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            if remaining <= 0:
+                self.tokens = min(self.tokens, 0.0)
+                self.blocked_until = now + max(reset_seconds, 1.0)
+                self.rate = self.default_rate
+            else:
+                self.tokens = min(self.tokens, remaining)
+                # Spend our share of what is left evenly over the rest of the window, never slower than the default
+                self.rate = max(self.default_rate, remaining / SHARES / max(reset_seconds, 1.0))
+
+    def to_dict(self):
+        return {'rate': self.rate, 'tokens': self.tokens, 'updated': self.updated, 'blocked_until': self.blocked_until}
+
+    def restore(self, state):
+        self.rate = max(self.default_rate, state.get('rate', self.rate))
+        self.tokens = min(self.capacity, state.get('tokens', self.tokens))
+        self.updated = state.get('updated', self.updated)
+        self.blocked_until = state.get('blocked_until', 0.0)
+        self._refill(time.time())
+
+
+# --- Shared state file ---
+def _load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(bucket):
+    # Never let bookkeeping break a collection run
+    try:
+        with _state_lock:
+            state = _load_state()
+            state[bucket.api] = bucket.to_dict()
+            with open(STATE_PATH + '.tmp', 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(STATE_PATH + '.tmp', STATE_PATH)
+    except Exception as state_err:
+        print(f">>> Warning: Could not save rate limit state: {state_err}")
+
+
+def bucket(api):
+    with _registry_lock:
+        if api not in _buckets:
+            requests, per_seconds, burst = DEFAULT_LIMITS.get(api, FALLBACK_LIMIT)
+            _buckets[api] = TokenBucket(api, requests / per_seconds / SHARES, burst)
+            saved = _load_state().get(api)
+            if saved:
+                _buckets[api].restore(saved)
+        return _buckets[api]
+
+
+# --- Header parsing ---
+def _header(headers, *names):
+    for name in names:
+        value = headers.get(name)
+        if value not in (None, ''):
+            return float(value)
+    return None
+
+
+def parse_headers(headers, status=None):
+    """(remaining, reset_seconds) from a response's headers, or None if it carries no rate-limit info.
+
+    Twitter:  x-rate-limit-remaining, x-rate-limit-reset (epoch seconds)
+    Reddit:   x-ratelimit-remaining, x-ratelimit-reset (seconds from now)
+    Anything: Retry-After on a 429
+    """
+    try:
+        remaining = _header(headers, 'x-rate-limit-remaining', 'x-ratelimit-remaining')
+        reset = _header(headers, 'x-rate-limit-reset', 'x-ratelimit-reset')
+        if reset is not None and reset > 1e9: # An absolute epoch timestamp
+            reset = reset - time.time()
+        if status == 429:
+            retry_after = _header(headers, 'retry-after')
+            return 0, retry_after if retry_after is not None else (reset if reset is not None else 60)
+        if remaining is None or reset is None:
+            return None
+        return remaining, reset
+    except (TypeError, ValueError):
+        return None
+
+
+# --- Collector API ---
+def acquire(api, max_wait=MAX_WAIT_SECONDS):
+    """Block until `api` has budget. Returns False (without waiting) if that would take longer than max_wait."""
+    wait = bucket(api).reserve(max_wait)
+    if wait is None:
+        return False
+    if wait > 0:
+        time.sleep(wait)
+    return True
+
+
+async def acquire_async(api, max_wait=MAX_WAIT_SECONDS):
+    wait = bucket(api).reserve(max_wait)
+    if wait is None:
+        return False
+    if wait > 0:
+        await asyncio.sleep(wait)
+    return True
+
+
+def observe(api, headers, status=None):
+    """Feed a response's headers back into the bucket. Returns (remaining, reset_seconds) or None."""
+    limits = parse_headers(headers, status)
+    if limits is not None:
+        target = bucket(api)
+        target.observe(*limits)
+        _save_state(target)
+    return limits
+
+
+def observe_limits(api, remaining, reset_seconds):
+    """For clients that parse the headers themselves (e.g. prawcore)."""
+    target = bucket(api)
+    target.observe(remaining, reset_seconds)
+    _save_state(target)
+
+
+def blocked_for(api):
+    return max(0.0, bucket(api).blocked_until - time.time())
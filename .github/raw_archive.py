@@ -0,0 +1,179 @@
+# ----- raw_archive.py -----
+# Append-only archive of raw API responses and scraped HTML.
+# Each collector appends what it fetched before reducing it to DB rows, so
+# history can be re-parsed and re-ingested later without hitting the APIs
+# (which is often impossible anyway - Twitter search only covers 7 days).
+#
+# Layout (one zstd-compressed NDJSON file per source, hour and run):
+#   raw_archive/<source>/<YYYY-MM-DD>/<HH>/<run_stamp>-<pid>.ndjson.zst
+# Each line: {"source", "kind", "fetched_at", "meta", "payload"}
+#   kind = "json" (payload is the decoded API response) or "html" (payload is the page text)
+#
+# Replay: run a collector with `--replay [--since YYYY-MM-DD] [--until YYYY-MM-DD]`
+# and it parses/ingests the archived payloads instead of calling the API.
+import argparse
+import io
+import json
+import os
+from datetime import datetime, timedelta
+
+ARCHIVE_DIR = os.environ.get('RAW_ARCHIVE_DIR', 'raw_archive')
+COMPRESSION_LEVEL = 10
+FLUSH_EVERY = 50 # Records between zstd block flushes, so a crash loses little
+
+
+def _zstd():
+    # Imported lazily so collectors still run (without archiving) if zstandard is missing
+    import zstandard
+    return zstandard
+
+
+def _json_default(value):
+    # datetimes from tweepy and PRAW objects (Redditor, Subreddit) end up as plain strings
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class RawArchiveWriter:
+    """Appends raw payloads for one source to hourly zstd NDJSON partitions."""
+
+    def __init__(self, source, directory=None, enabled=True):
+        self.source = source
+        self.directory = directory or ARCHIVE_DIR
+        self.run_stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        self.enabled = enabled
+        self.records_written = 0
+        self._partition = None
+        self._raw_file = None
+        self._writer = None
+        self._pending = 0
+        if enabled:
+            try:
+                _zstd()
+            except ImportError:
+                print(">>> Warning: 'zstandard' is not installed - raw payload archiving disabled.")
+                self.enabled = False
+
+    def _open_partition(self, now):
+        partition = (now.strftime('%Y-%m-%d'), now.strftime('%H'))
+        if partition == self._partition:
+            return
+        self._close_partition()
+        part_dir = os.path.join(self.directory, self.source, *partition)
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, f"{self.run_stamp}-{os.getpid()}.ndjson.zst")
+        self._raw_file = open(path, 'ab')
+        self._writer = _zstd().ZstdCompressor(level=COMPRESSION_LEVEL).stream_writer(self._raw_file)
+        self._partition = partition
+
+    def _close_partition(self):
+        if self._writer is not None:
+            self._writer.flush(_zstd().FLUSH_FRAME)
+            self._writer.close() # Also closes the underlying file
+        self._writer = None
+        self._raw_file = None
+        self._partition = None
+        self._pending = 0
+
+    def append(self, payload, kind='json', meta=None):
+        """Archive one raw payload. Failures are reported but never interrupt collection."""
+        if not self.enabled:
+            return
+        try:
+            now = datetime.utcnow()
+            self._open_partition(now)
+            record = {
+                'source': self.source,
+                'kind': kind,
+                'fetched_at': now.isoformat(),
+                'meta': meta or {},
+                'payload': payload,
+            }
+            self._writer.write((json.dumps(record, default=_json_default) + '\n').encode('utf-8'))
+            self.records_written += 1
+            self._pending += 1
+            if self._pending >= FLUSH_EVERY:
+                self._writer.flush(_zstd().FLUSH_BLOCK)
+                self._pending = 0
+        except Exception as archive_err:
+            print(f"  > Warning: Could not archive raw payload for {self.source}: {archive_err}")
+
+    def close(self):
+        if not self.enabled:
+            return
+        try:
+            self._close_partition()
+            if self.records_written:
+                print(f"Archived {self.records_written} raw payloads under {os.path.join(self.directory, self.source)}")
+        except Exception as close_err:
+            print(f">>> Warning: Could not close raw archive for {self.source}: {close_err}")
+
+
+def _partition_dates(source_dir, since, until):
+    for day in sorted(os.listdir(source_dir)):
+        try:
+            day_date = datetime.strptime(day, '%Y-%m-%d')
+        except ValueError:
+            continue
+        if since and day_date < since.replace(hour=0, minute=0, second=0, microsecond=0):
+            continue
+        if until and day_date >= until:
+            continue
+        yield day
+
+
+def archive_files(source, since=None, until=None, directory=None):
+    """Archive file paths for a source in chronological order."""
+    source_dir = os.path.join(directory or ARCHIVE_DIR, source)
+    if not os.path.isdir(source_dir):
+        return []
+    paths = []
+    for day in _partition_dates(source_dir, since, until):
+        day_dir = os.path.join(source_dir, day)
+        for hour in sorted(os.listdir(day_dir)):
+            hour_dir = os.path.join(day_dir, hour)
+            for file_name in sorted(os.listdir(hour_dir)):
+                if file_name.endswith('.ndjson.zst'):
+                    paths.append(os.path.join(hour_dir, file_name))
+    return paths
+
+
+def iter_records(source, since=None, until=None, directory=None):
+    """Yield archived records for a source, oldest first, filtered by fetched_at."""
+    zstd = _zstd()
+    for path in archive_files(source, since, until, directory):
+        with open(path, 'rb') as raw_file:
+            reader = zstd.ZstdDecompressor().stream_reader(raw_file, read_across_frames=True)
+            try:
+                for line in io.TextIOWrapper(reader, encoding='utf-8'):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A run that crashed mid-write can leave a truncated last line
+                        print(f"  > Warning: Skipping truncated record in {path}")
+                        continue
+                    fetched_at = datetime.fromisoformat(record['fetched_at'])
+                    if since and fetched_at < since:
+                        continue
+                    if until and fetched_at >= until:
+                        continue
+                    yield record
+            except zstd.ZstdError as zstd_err:
+                print(f"  > Warning: Archive file {path} ends early ({zstd_err}); keeping records read so far.")
+
+
+def replay_options(argv=None):
+    """Parse the shared --replay/--since/--until flags; unknown args are left for the script."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--replay', action='store_true',
+                        help='Re-run parse and ingest from the raw archive instead of the API')
+    parser.add_argument('--since', type=datetime.fromisoformat, default=None)
+    parser.add_argument('--until', type=datetime.fromisoformat, default=None)
+    options, _ = parser.parse_known_args(argv)
+    if options.until and options.until.time() == datetime.min.time():
+        # A bare date means "up to the end of that day"
+        options.until = options.until + timedelta(days=1)
+    return options
@@ -0,0 +1,319 @@
+# ----- refresh_engagement.py -----
+# Keeps engagement numbers moving after collection. The collectors store them
+# once, at insert, when most posts are minutes old.
+#
+# Twitter: re-reads the public_metrics of tweets still inside their engagement
+# window (100 IDs per tweets-lookup call), updates the post, and appends a
+# snapshot to the `tweet_engagement` time-series collection whenever the
+# numbers changed. MongoDB buckets the snapshots per tweet and hour, so the
+# history stays compact and is cheap to read back in time order.
+#
+# Reddit: re-reads score / upvote_ratio / num_comments 100 fullnames per
+# reddit.info() call. Each post carries its own next_refresh_at: a post whose
+# numbers moved is checked again after REDDIT_MIN_REFRESH_HOURS, one that
+# didn't waits twice as long as last time (up to REDDIT_MAX_REFRESH_HOURS).
+# Settled posts drop out after a few lookups, so API calls follow the number
+# of new posts rather than the size of the collection.
+#
+# Usage:
+#   python refresh_engagement.py                         # refresh everything due
+#   python refresh_engagement.py --source reddit
+#   python refresh_engagement.py --window-days 3 --limit 500
+#   python refresh_engagement.py --history 1789012345678901234
+#   python refresh_engagement.py --profile
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import migrations
+import profiling
+import rate_limits
+import resilience
+from run_metrics import RunMetrics
+
+ENGAGEMENT_COLLECTION = 'tweet_engagement'
+ENGAGEMENT_WINDOW_DAYS = 7 # Tweets get nearly all their engagement in the first week
+REFRESH_EVERY_HOURS = 6 # Don't look a tweet up again sooner than this
+LOOKUP_BATCH_SIZE = 100 # Max IDs per GET /2/tweets
+DEFAULT_LIMIT = 5000 # Posts per source per run: 50 lookup calls
+REDDIT_MIN_REFRESH_HOURS = 1 # Score still moving - look again soon
+REDDIT_MAX_REFRESH_HOURS = 48
+REDDIT_FIELDS = ('score', 'upvote_ratio', 'num_comments')
+SOURCES = ('twitter', 'reddit')
+
+
+def due_tweets(posts_collection, now, window_days=ENGAGEMENT_WINDOW_DAYS, limit=DEFAULT_LIMIT):
+    """Tweets created inside the window whose metrics weren't refreshed in the last REFRESH_EVERY_HOURS, stalest first."""
+    return list(posts_collection.find(
+        {
+            'source': 'twitter',
+            'created_at': {'$gte': now - timedelta(days=window_days)},
+            'metrics_unavailable': {'$ne': True},
+            '$or': [{'metrics_refreshed_at': {'$exists': False}},
+                    {'metrics_refreshed_at': {'$lt': now - timedelta(hours=REFRESH_EVERY_HOURS)}}],
+        },
+        {'source_specific_id': 1, 'public_metrics': 1, 'collected_at': 1, 'metrics_refreshed_at': 1},
+    ).sort('metrics_refreshed_at', 1).limit(limit))
+
+
+def snapshot(tweet_id, ts, public_metrics):
+    return {'ts': ts, 'tweet_id': tweet_id, **(public_metrics or {})}
+
+
+def lookup_metrics(client, ids, metrics):
+    """public_metrics for up to 100 tweet IDs -> ({id: public_metrics}, {ids the API reports missing})."""
+    import tweepy
+
+    def lookup():
+        try:
+            with metrics.stage('http_fetch'):
+                http_response = client.get_tweets(ids, tweet_fields=['public_metrics'])
+        except tweepy.errors.HTTPException as http_err:
+            rate_limits.observe('twitter_lookup', http_err.response.headers, http_err.response.status_code)
+            raise
+        rate_limits.observe('twitter_lookup', http_response.headers)
+        return http_response
+
+    http_response = resilience.retry_call(lookup, label=f"tweet lookup ({len(ids)} ids)")
+    metrics.incr('bytes_fetched', len(http_response.content))
+    response = http_response.json()
+    found = {tweet['id']: tweet.get('public_metrics') for tweet in response.get('data', [])}
+    # Deleted, suspended or protected tweets come back as per-ID errors
+    missing = {err.get('resource_id') or err.get('value') for err in response.get('errors', [])} - set(found)
+    return found, missing
+
+
+def refresh_tweets(db, client, metrics, window_days=ENGAGEMENT_WINDOW_DAYS, limit=DEFAULT_LIMIT):
+    """Refresh every due tweet. Returns (looked up, snapshots appended)."""
+    from pymongo import UpdateOne
+    posts_collection = db['social_media_posts']
+    engagement = db[ENGAGEMENT_COLLECTION]
+    now = datetime.now(timezone.utc).replace(tzinfo=None) # Mongo hands back naive UTC
+    with metrics.stage('db_read'):
+        tweets = due_tweets(posts_collection, now, window_days, limit)
+    print(f"{len(tweets)} tweets are due for an engagement refresh.")
+
+    looked_up = appended = 0
+    for start in range(0, len(tweets), LOOKUP_BATCH_SIZE):
+        batch = tweets[start:start + LOOKUP_BATCH_SIZE]
+        if not rate_limits.acquire('twitter_lookup'):
+            print(f"  > Tweet lookup rate limit exhausted for another {rate_limits.blocked_for('twitter_lookup'):.0f}s - "
+                  f"{len(tweets) - start} tweets left for the next run.")
+            break
+        by_id = {doc['source_specific_id']: doc for doc in batch}
+        try:
+            found, missing = lookup_metrics(client, list(by_id), metrics)
+        except Exception as lookup_err:
+            print(f"  > Tweet lookup failed: {lookup_err}")
+            metrics.incr('errors')
+            continue
+        looked_up += len(found)
+
+        fetched_at = datetime.utcnow()
+        snapshots = []
+        updates = []
+        for tweet_id, public_metrics in found.items():
+            doc = by_id[tweet_id]
+            if 'metrics_refreshed_at' not in doc and doc.get('public_metrics'):
+                # First refresh: the history starts with what was captured at collection time
+                snapshots.append(snapshot(tweet_id, doc['collected_at'], doc['public_metrics']))
+            if public_metrics != doc.get('public_metrics'):
+                snapshots.append(snapshot(tweet_id, fetched_at, public_metrics))
+            updates.append(UpdateOne({'_id': doc['_id']},
+                                     {'$set': {'public_metrics': public_metrics, 'metrics_refreshed_at': fetched_at}}))
+        for tweet_id in missing & set(by_id):
+            updates.append(UpdateOne({'_id': by_id[tweet_id]['_id']},
+                                     {'$set': {'metrics_unavailable': True, 'metrics_refreshed_at': fetched_at}}))
+
+        with metrics.stage('db_write'):
+            if snapshots:
+                engagement.insert_many(snapshots, ordered=False)
+            if updates:
+                posts_collection.bulk_write(updates, ordered=False)
+        appended += len(snapshots)
+        print(f"  Looked up {len(batch)} tweets: {len(found)} found, {len(missing)} gone, {len(snapshots)} snapshots.")
+    return looked_up, appended
+
+
+def due_reddit_posts(posts_collection, now, window_days=ENGAGEMENT_WINDOW_DAYS, limit=DEFAULT_LIMIT):
+    """Reddit posts inside the window that were never refreshed or whose next_refresh_at has passed.
+    Never-refreshed posts sort first (a missing field sorts lowest), then the longest overdue."""
+    return list(posts_collection.find(
+        {
+            'source': 'reddit',
+            'created_utc': {'$gte': now - timedelta(days=window_days)},
+            'metrics_unavailable': {'$ne': True},
+            '$or': [{'next_refresh_at': {'$exists': False}}, {'next_refresh_at': {'$lte': now}}],
+        },
+        {'source_specific_id': 1, 'refresh_interval_hours': 1, **{field: 1 for field in REDDIT_FIELDS}},
+    ).sort('next_refresh_at', 1).limit(limit))
+
+
+def next_reddit_interval(doc, changed):
+    """Hours until the next refresh: back to the minimum while the numbers move, doubling while they don't."""
+    if changed or 'refresh_interval_hours' not in doc:
+        return REDDIT_MIN_REFRESH_HOURS
+    return min(REDDIT_MAX_REFRESH_HOURS, doc['refresh_interval_hours'] * 2)
+
+
+def lookup_reddit(reddit, ids, metrics):
+    """{submission id: {field: value}} for up to 100 submission IDs. Posts Reddit no longer returns are absent."""
+    def lookup():
+        with metrics.stage('http_fetch'):
+            # reddit.info is lazy - materialise it so the request is timed (and retried) here
+            return list(reddit.info(fullnames=[f"t3_{post_id}" for post_id in ids]))
+
+    submissions = resilience.retry_call(lookup, label=f"reddit info ({len(ids)} ids)")
+    limiter = getattr(getattr(reddit, '_core', None), '_rate_limiter', None)
+    if limiter is not None and limiter.remaining is not None and limiter.reset_timestamp:
+        rate_limits.observe_limits('reddit', limiter.remaining, limiter.reset_timestamp - time.time())
+    return {submission.id: {field: getattr(submission, field) for field in REDDIT_FIELDS} for submission in submissions}
+
+
+def refresh_reddit(db, reddit, metrics, window_days=ENGAGEMENT_WINDOW_DAYS, limit=DEFAULT_LIMIT):
+    """Refresh every due Reddit post. Returns (looked up, changed)."""
+    from pymongo import UpdateOne
+    posts_collection = db['social_media_posts']
+    now = datetime.utcnow()
+    with metrics.stage('db_read'):
+        posts = due_reddit_posts(posts_collection, now, window_days, limit)
+    print(f"{len(posts)} Reddit posts are due for a score refresh.")
+
+    looked_up = changed_count = 0
+    for start in range(0, len(posts), LOOKUP_BATCH_SIZE):
+        batch = posts[start:start + LOOKUP_BATCH_SIZE]
+        if not rate_limits.acquire('reddit'):
+            print(f"  > Reddit rate limit exhausted for another {rate_limits.blocked_for('reddit'):.0f}s - "
+                  f"{len(posts) - start} posts left for the next run.")
+            break
+        by_id = {doc['source_specific_id']: doc for doc in batch}
+        try:
+            found = lookup_reddit(reddit, list(by_id), metrics)
+        except Exception as lookup_err:
+            print(f"  > Reddit info lookup failed: {lookup_err}")
+            metrics.incr('errors')
+            continue
+        looked_up += len(found)
+
+        fetched_at = datetime.utcnow()
+        updates = []
+        batch_changed = 0
+        for post_id, doc in by_id.items():
+            if post_id not in found:
+                updates.append(UpdateOne({'_id': doc['_id']},
+                                         {'$set': {'metrics_unavailable': True, 'metrics_refreshed_at': fetched_at}}))
+                continue
+            fields = found[post_id]
+            changed = any(fields[field] != doc.get(field) for field in REDDIT_FIELDS)
+            batch_changed += changed
+            interval = next_reddit_interval(doc, changed)
+            updates.append(UpdateOne({'_id': doc['_id']}, {'$set': {
+                **fields,
+                'metrics_refreshed_at': fetched_at,
+                'refresh_interval_hours': interval,
+                'next_refresh_at': fetched_at + timedelta(hours=interval),
+            }}))
+
+        with metrics.stage('db_write'):
+            if updates:
+                posts_collection.bulk_write(updates, ordered=False)
+        changed_count += batch_changed
+        print(f"  Looked up {len(batch)} Reddit posts: {len(found)} found, {batch_changed} changed.")
+    return looked_up, changed_count
+
+
+def engagement_history(db, tweet_id):
+    """Snapshots for one tweet, oldest first - reads only that tweet's buckets."""
+    return list(db[ENGAGEMENT_COLLECTION].find({'tweet_id': str(tweet_id)}, {'_id': 0}).sort('ts', 1))
+
+
+def twitter_client():
+    bearer_token = os.environ.get('TWITTER_BEARER_TOKEN')
+    if not bearer_token:
+        raise RuntimeError("TWITTER_BEARER_TOKEN secret not found.")
+    import requests
+    import tweepy
+    # Raw responses, so the rate-limit headers reach rate_limits.py (as in collect_twitter.py)
+    return tweepy.Client(bearer_token=bearer_token, return_type=requests.Response)
+
+
+def reddit_client():
+    client_id = os.environ.get('REDDIT_CLIENT_ID')
+    client_secret = os.environ.get('REDDIT_CLIENT_SECRET')
+    user_agent = os.environ.get('REDDIT_USER_AGENT')
+    if not all([client_id, client_secret, user_agent]):
+        raise RuntimeError("Missing Reddit credentials.")
+    import praw
+    return praw.Reddit(client_id=client_id, client_secret=client_secret, user_agent=user_agent, read_only=True)
+
+
+# source: (client factory, refresh function, what the second count means)
+REFRESHERS = {
+    'twitter': (twitter_client, refresh_tweets, 'engagement snapshots appended'),
+    'reddit': (reddit_client, refresh_reddit, 'posts changed'),
+}
+
+
+def refresh_source(db, source, window_days, limit):
+    """Run one source's refresh with its own run report. Returns True on success."""
+    print(f"\n--- Refreshing {source} engagement ---")
+    make_client, refresh, changed_label = REFRESHERS[source]
+    metrics = RunMetrics(f'{source}_engagement')
+    try:
+        looked_up, changed = refresh(db, make_client(), metrics, window_days, limit)
+        metrics.incr('fetched', looked_up)
+        metrics.incr('inserted', changed)
+        print(f"Refreshed {looked_up} {source} posts, {changed} {changed_label}.")
+        return True
+    except Exception as refresh_err:
+        print(f">>> Error: {source} engagement refresh failed: {refresh_err}")
+        metrics.incr('errors')
+        return False
+    finally:
+        metrics.write()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh engagement metrics of recent tweets and Reddit posts.")
+    parser.add_argument('--source', choices=SOURCES, action='append',
+                        help='Refresh just this source (can be repeated; default: all)')
+    parser.add_argument('--window-days', type=int, default=ENGAGEMENT_WINDOW_DAYS,
+                        help='Refresh posts created this many days back (default: %(default)s)')
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT,
+                        help='Max posts per source per run (default: %(default)s)')
+    parser.add_argument('--history', metavar='TWEET_ID', help='Print the stored engagement history of one tweet')
+    parser.add_argument('--profile', action='store_true', default=profiling.profile_option([]), # COLLECTOR_PROFILE, if set
+                        help='Sample the run and write flame graph files to profiles/ (see profiling.py)')
+    args = parser.parse_args(argv)
+    if args.profile:
+        profiling.start('refresh_engagement')
+
+    mongo_uri = os.environ.get('MONGO_URI')
+    if not mongo_uri:
+        print(">>> Error: MONGO_URI secret not found!")
+        return 1
+    from pymongo import MongoClient
+    mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+    try:
+        db = mongo_client['web3_data']
+        if args.history:
+            for row in engagement_history(db, args.history):
+                print(f"{row.pop('ts').isoformat()}  " + ', '.join(f"{k}={v}" for k, v in row.items() if k != 'tweet_id'))
+            return 0
+
+        print("--- Starting Engagement Refresh ---")
+        try:
+            migrations.require_mongo(db) # tweet_engagement and the refresh indexes are created by migrations.py
+        except Exception as schema_err:
+            print(f">>> Error: {schema_err}")
+            return 1
+        results = [refresh_source(db, source, args.window_days, args.limit) for source in args.source or SOURCES]
+        return 0 if all(results) else 1
+    finally:
+        mongo_client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
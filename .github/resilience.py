@@ -0,0 +1,258 @@
+# ----- resilience.py -----
+# Failure handling shared by the collectors and the task runner:
+#   retry_call / retry_async - retry transient errors (network, timeouts, HTTP 5xx)
+#                              with full-jitter exponential backoff
+#   CircuitBreaker           - per-source; after repeated failed runs the runner skips
+#                              the source for a cooldown that doubles while it keeps failing
+#   Checkpoint               - per-source record of finished work units (a subreddit, a
+#                              search query, a page). A run that was killed or aborted leaves
+#                              its checkpoint behind and the next run skips the units already
+#                              done; a run that reached its end - even with unit errors or a
+#                              rate limit - clears it, so the next run retries everything.
+# State lives under COLLECTOR_STATE_DIR (default: collector_state/).
+#
+# Usage:
+#   python resilience.py status               # breaker and checkpoint state
+#   python resilience.py reset [source]       # close breakers / drop checkpoints
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+STATE_DIR = os.environ.get('COLLECTOR_STATE_DIR', 'collector_state')
+BREAKERS_FILE = 'circuit_breakers.json'
+CHECKPOINT_SUBDIR = 'checkpoints'
+
+RETRY_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+
+FAILURE_THRESHOLD = 3 # Consecutive failed runs before a breaker opens
+COOLDOWN_SECONDS = 60 * 60
+MAX_COOLDOWN_SECONDS = 24 * 60 * 60
+
+CHECKPOINT_MAX_AGE = timedelta(hours=12) # Older leftovers are from a different day's data - start fresh
+
+# Exception class names (anywhere in the MRO) that mean "try again" when there is no HTTP status:
+# requests, aiohttp, prawcore and tweepy network/server errors
+TRANSIENT_ERROR_NAMES = {
+    'ConnectionError', 'Timeout', 'ReadTimeout', 'ConnectTimeout', 'ChunkedEncodingError',
+    'ClientConnectionError', 'ClientPayloadError', 'ServerDisconnectedError', 'ServerTimeoutError',
+    'TimeoutError', 'ServerError', 'TwitterServerError', 'RequestException',
+}
+
+_file_lock = threading.Lock()
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# --- Retry ---
+def _status_code(exc):
+    response = getattr(exc, 'response', None)
+    for attr in ('status_code', 'status'):
+        value = getattr(response, attr, None) if response is not None else None
+        if isinstance(value, int):
+            return value
+    value = getattr(exc, 'status', None) # aiohttp ClientResponseError
+    return value if isinstance(value, int) else None
+
+
+def is_transient(exc):
+    """Worth retrying? HTTP 5xx and network errors are; 4xx (including 429 - rate_limits.py paces those) are not."""
+    status = _status_code(exc)
+    if status is not None:
+        return status >= 500
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(exc).__mro__)
+
+
+def backoff_delay(attempt, base=RETRY_BASE_SECONDS, cap=RETRY_MAX_SECONDS):
+    """Full jitter: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_call(func, *args, label='request', attempts=RETRY_ATTEMPTS, **kwargs):
+    for attempt in range(attempts):
+        try:
+            return func(*args, **kwargs)
+        except Exception as exc:
+            if attempt == attempts - 1 or not is_transient(exc):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"  > {label} failed ({type(exc).__name__}: {exc}) - retry {attempt + 1}/{attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+async def retry_async(func, *args, label='request', attempts=RETRY_ATTEMPTS, **kwargs):
+    for attempt in range(attempts):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as exc:
+            if attempt == attempts - 1 or not is_transient(exc):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"  > {label} failed ({type(exc).__name__}: {exc}) - retry {attempt + 1}/{attempts - 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+# --- Circuit breakers ---
+class CircuitBreaker:
+    """Consecutive-failure breaker for one source, persisted across runs.
+
+    Closed: the source runs. Open: the runner skips it until open_until. Once the
+    cooldown has passed the next run is a trial; success closes the breaker, another
+    failure reopens it with twice the cooldown.
+    """
+
+    def __init__(self, source, directory=None):
+        self.source = source
+        self.path = os.path.join(directory or STATE_DIR, BREAKERS_FILE)
+        state = _read_json(self.path).get(source, {})
+        self.failures = state.get('failures', 0)
+        self.open_until = state.get('open_until') # epoch seconds
+        self.last_error = state.get('last_error')
+
+    def allow(self):
+        return self.open_until is None or time.time() >= self.open_until
+
+    def record(self, success, error=None):
+        if success:
+            self.failures = 0
+            self.open_until = None
+            self.last_error = None
+        else:
+            self.failures += 1
+            self.last_error = str(error)[:500] if error else None
+            if self.failures >= FAILURE_THRESHOLD:
+                cooldown = min(MAX_COOLDOWN_SECONDS, COOLDOWN_SECONDS * 2 ** (self.failures - FAILURE_THRESHOLD))
+                self.open_until = time.time() + cooldown
+                print(f">>> Circuit breaker for {self.source} opened for {cooldown / 3600:.1f}h "
+                      f"after {self.failures} consecutive failures.")
+        self._save()
+
+    def describe(self):
+        if self.allow():
+            return f"closed ({self.failures} recent failures)" if self.failures else "closed"
+        return f"open until {datetime.utcfromtimestamp(self.open_until).isoformat()} ({self.failures} failures: {self.last_error})"
+
+    def _save(self):
+        # Never let bookkeeping break a run
+        try:
+            with _file_lock:
+                state = _read_json(self.path)
+                state[self.source] = {'failures': self.failures, 'open_until': self.open_until,
+                                      'last_error': self.last_error}
+                _write_json(self.path, state)
+        except Exception as state_err:
+            print(f">>> Warning: Could not save circuit breaker state: {state_err}")
+
+
+def source_run_failed(report):
+    """A run that produced errors and nothing else (no items fetched) counts as a failure."""
+    counters = (report or {}).get('counters', {})
+    return counters.get('errors', 0) > 0 and counters.get('fetched', 0) == 0
+
+
+# --- Checkpoints ---
+class Checkpoint:
+    """Finished work units of the current (or crashed previous) run of one source."""
+
+    def __init__(self, source, directory=None, enabled=True):
+        self.source = source
+        self.enabled = enabled
+        self.path = os.path.join(directory or STATE_DIR, CHECKPOINT_SUBDIR, f"{source}.json")
+        self.done = set()
+        self.started_at = datetime.utcnow()
+        self._lock = threading.Lock()
+        if not enabled:
+            return
+        state = _read_json(self.path)
+        if state:
+            started_at = datetime.fromisoformat(state['started_at'])
+            if datetime.utcnow() - started_at <= CHECKPOINT_MAX_AGE:
+                self.started_at = started_at
+                self.done = set(state.get('done', []))
+        if self.done:
+            print(f"Resuming {source} from checkpoint ({len(self.done)} units done since {self.started_at.isoformat()}).")
+
+    @property
+    def resumed(self):
+        return bool(self.done)
+
+    def is_done(self, unit):
+        return unit in self.done
+
+    def mark(self, *units):
+        """Record units whose results are safely written. Never raises."""
+        if not self.enabled or not units:
+            return
+        try:
+            with self._lock:
+                self.done.update(units)
+                _write_json(self.path, {'source': self.source, 'started_at': self.started_at.isoformat(),
+                                        'done': sorted(self.done)})
+        except Exception as checkpoint_err:
+            print(f">>> Warning: Could not write checkpoint for {self.source}: {checkpoint_err}")
+
+    def finish(self):
+        """The run reached its end (complete, or cut short by errors / a rate limit) - the next one starts from scratch."""
+        if not self.enabled:
+            return
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError as checkpoint_err:
+            print(f">>> Warning: Could not clear checkpoint for {self.source}: {checkpoint_err}")
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or reset circuit breakers and checkpoints.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help='Show breaker and checkpoint state')
+    reset = sub.add_parser('reset', help='Close breakers and drop checkpoints')
+    reset.add_argument('source', nargs='?', help='Only this source (default: all)')
+    args = parser.parse_args(argv)
+
+    breakers = _read_json(os.path.join(STATE_DIR, BREAKERS_FILE))
+    checkpoint_dir = os.path.join(STATE_DIR, CHECKPOINT_SUBDIR)
+    checkpoints = sorted(f[:-5] for f in os.listdir(checkpoint_dir) if f.endswith('.json')) if os.path.isdir(checkpoint_dir) else []
+
+    if args.command == 'status':
+        for source in sorted(set(breakers) | set(checkpoints)):
+            line = f"{source:<15} breaker: {CircuitBreaker(source).describe()}"
+            if source in checkpoints:
+                state = _read_json(os.path.join(checkpoint_dir, f"{source}.json"))
+                line += f" | checkpoint: {len(state.get('done', []))} units since {state.get('started_at')}"
+            print(line)
+        if not breakers and not checkpoints:
+            print("No breaker or checkpoint state recorded.")
+        return 0
+
+    for source in [args.source] if args.source else sorted(set(breakers) | set(checkpoints)):
+        CircuitBreaker(source).record(True)
+        if source in checkpoints:
+            os.remove(os.path.join(checkpoint_dir, f"{source}.json"))
+        print(f"Reset {source}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
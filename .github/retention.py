@@ -0,0 +1,468 @@
+# ----- retention.py -----
+# Tiered retention: rows past their hot-tier lifetime move out of Atlas / Neon
+# into zstd-compressed Parquet files, so the hot tables - and every scan and
+# index over them - stop growing with history.
+#
+#   social_media_posts  collected more than POSTS_MAX_AGE_DAYS ago (and already scored)
+#   job_postings        not listed for JOBS_UNSEEN_DAYS (last_seen_on, see mark_listed)
+#
+# Cold files are partitioned by table, source and month of collected_at:
+#   <COLD_STORAGE_DIR>/<table>/<source>/<YYYY-MM>/part-<stamp>-<pid>.parquet
+#
+# Each archived batch is written and fsynced first, then recorded as one
+# summary row in cold_partitions (a Postgres table for jobs, a MongoDB
+# collection for posts: source, month, path, row count, first/last
+# collected_at), and only then deleted from the hot table. A crash in between
+# leaves rows in both tiers; the next run archives them again and readers
+# drop the copies. The daily rollups stay in the hot tier; rollups.py rebuild
+# adds the cold rows back in.
+#
+# The job collectors stamp last_seen_on - at most once a day per posting - for
+# every posting they see listed, including ones the seen-filter skipped, so a
+# posting that is still up never goes cold. Archiving rebuilds the seen-filters
+# of the job sources it deleted rows for: a stale filter would keep skipping a
+# posting that is relisted unchanged, and it would never return to the hot table.
+#
+# find_jobs / find_posts are the read path for historical queries: hot rows
+# plus the cold partitions whose summary rows overlap the range.
+# api_service.py serves them as /history/jobs and /history/posts.
+#
+# COLD_STORAGE_DIR must be durable storage (a mounted volume or synced
+# bucket), not a CI runner's scratch disk - run_all_tasks.py only runs
+# retention when it is set.
+#
+# Usage:
+#   python retention.py run [--only jobs|posts] [--posts-days 180] [--jobs-unseen-days 60] [--dry-run]
+#   python retention.py status
+#   python retention.py query jobs|posts --since 2024-01-01 [--until 2024-02-01] [--source reddit] [--limit 20]
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import export_data # Parquet writer + social post schema
+
+COLD_STORAGE_DIR = os.environ.get('COLD_STORAGE_DIR', 'cold_storage')
+POSTS_MAX_AGE_DAYS = int(os.environ.get('RETENTION_POSTS_DAYS', 180))
+JOBS_UNSEEN_DAYS = int(os.environ.get('RETENTION_JOBS_UNSEEN_DAYS', 60))
+ARCHIVE_BATCH = 5000 # Rows read, written and deleted per round
+HOT_CHECK_BATCH = 1000 # Cold rows checked against the hot table per query
+CATALOG = 'cold_partitions'
+
+JOB_FIELDS = [
+    ('id', 'int64'), ('title', 'string'), ('company_name', 'string'), ('location', 'string'),
+    ('salary_range', 'string'), ('tags', 'json'), ('source', 'string'), ('job_url', 'string'),
+    ('description', 'string'), ('external_id', 'string'), ('is_remote', 'bool'), ('date_posted_epoch', 'int64'),
+    ('collected_at', 'timestamp'), ('skills', 'json'), ('content_hash', 'string'), ('updated_at', 'timestamp'),
+    ('last_seen_on', 'date'), ('raw_payload', 'json'),
+]
+# Everything a post document carries beyond the export schema goes to 'extra'
+POST_FIELDS = export_data.SOCIAL_FIELDS + [('extra', 'json')]
+
+ENSURE_JOBS_SQL = f"""
+    -- Not indexed, so the daily stamp is a heap-only update
+    ALTER TABLE job_postings ADD COLUMN IF NOT EXISTS last_seen_on DATE;
+
+    CREATE TABLE IF NOT EXISTS {CATALOG} (
+        id                 SERIAL PRIMARY KEY,
+        table_name         TEXT NOT NULL,
+        source             TEXT NOT NULL,
+        month              TEXT NOT NULL,
+        path               TEXT NOT NULL,      -- relative to COLD_STORAGE_DIR
+        row_count          INTEGER NOT NULL,
+        first_collected_at TIMESTAMP,
+        last_collected_at  TIMESTAMP,
+        archived_at        TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+    );
+    CREATE INDEX IF NOT EXISTS idx_cold_partitions_range ON {CATALOG} (table_name, first_collected_at, last_collected_at);
+"""
+
+MARK_LISTED_SQL = """
+    UPDATE job_postings SET last_seen_on = %s
+    WHERE job_url = ANY(%s) AND last_seen_on IS DISTINCT FROM %s;
+"""
+
+# {legacy_payload}: j.raw_api_response until job_raw_store.py migrate has dropped that column, else NULL
+EXPIRED_JOBS_SQL = f"""
+    SELECT {', '.join('j.' + name for name, _ in JOB_FIELDS if name != 'raw_payload')}, r.payload_zstd, {{legacy_payload}}
+    FROM job_postings j
+    LEFT JOIN job_postings_raw r ON r.job_url = j.job_url
+    WHERE coalesce(j.last_seen_on, coalesce(j.updated_at, j.collected_at)::date) < %s
+    ORDER BY j.id
+    LIMIT %s;
+"""
+
+
+# --- Collectors: postings still listed ---
+def mark_listed(db_cursor, job_urls, today=None):
+    """Stamp last_seen_on for postings seen in a listing; each row is written at most once a day."""
+    if not job_urls:
+        return 0
+    today = today or datetime.utcnow().date()
+    db_cursor.execute(MARK_LISTED_SQL, (today, list(job_urls), today))
+    return db_cursor.rowcount
+
+
+def ensure_posts_catalog(db):
+    db[CATALOG].create_index([('table_name', 1), ('first_collected_at', 1), ('last_collected_at', 1)])
+
+
+# --- Cold files ---
+def _month(value):
+    return f"{value:%Y-%m}" if value else 'unknown'
+
+
+def write_partition(table, source, month, fields, rows, directory=None):
+    """Write rows (tuples in `fields` order) to a new zstd Parquet file. Returns its path relative to the cold dir."""
+    directory = directory or COLD_STORAGE_DIR
+    relative = os.path.join(table, source.replace(os.sep, '_'), month,
+                            f"part-{datetime.utcnow():%Y%m%dT%H%M%S%f}-{os.getpid()}.parquet")
+    path = os.path.join(directory, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer = export_data.ParquetChunkWriter(f"{path}.tmp", schema=export_data.parquet_schema(fields))
+    try:
+        writer.write_batch([name for name, _ in fields], rows)
+    finally:
+        writer.close()
+    # On disk before the hot copy can be deleted
+    with open(f"{path}.tmp", 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+    return relative
+
+
+def read_partitions(paths, fields, since=None, until=None, directory=None):
+    """Rows of the given cold files as dicts (JSON columns decoded), filtered to since <= collected_at < until."""
+    import pyarrow.parquet as pq
+    json_fields = [name for name, kind in fields if kind == 'json']
+    filters = [('collected_at', '>=', since)] if since else []
+    if until:
+        filters.append(('collected_at', '<', until))
+    for relative in paths:
+        path = os.path.join(directory or COLD_STORAGE_DIR, relative)
+        if not os.path.exists(path):
+            print(f">>> Warning: cold partition {relative} is recorded but missing under {directory or COLD_STORAGE_DIR}")
+            continue
+        for record in pq.read_table(path, filters=filters or None).to_pylist():
+            for name in json_fields:
+                if record.get(name) is not None:
+                    record[name] = json.loads(record[name])
+            yield record
+
+
+def _chunks(records, size=HOT_CHECK_BATCH):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _group_by_partition(rows, source_of, collected_at_of):
+    groups = {}
+    for row in rows:
+        groups.setdefault((source_of(row), _month(collected_at_of(row))), []).append(row)
+    return groups
+
+
+# --- Jobs (PostgreSQL) ---
+def _job_row(row):
+    import job_raw_store
+    *columns, payload_zstd, legacy_payload = row
+    job = dict(zip([name for name, _ in JOB_FIELDS if name != 'raw_payload'], columns))
+    if payload_zstd is not None:
+        job['raw_payload'] = job_raw_store.decompress_payload(payload_zstd)
+    else:
+        # Not yet moved out of job_postings (same fallback as job_raw_store.load)
+        job['raw_payload'] = json.loads(legacy_payload) if isinstance(legacy_payload, str) else legacy_payload
+    return tuple(json.dumps(job[name], default=str) if kind == 'json' and job[name] is not None else job[name]
+                 for name, kind in JOB_FIELDS)
+
+
+def archive_jobs(db_conn, unseen_days=JOBS_UNSEEN_DAYS, dry_run=False, batch_size=ARCHIVE_BATCH, directory=None):
+    """Move postings not listed for unseen_days to cold files. Returns rows archived (or due, with dry_run)."""
+    cutoff = datetime.utcnow().date() - timedelta(days=unseen_days)
+    columns = [name for name, _ in JOB_FIELDS]
+    if dry_run:
+        with db_conn.cursor() as db_cursor:
+            db_cursor.execute("""
+                SELECT count(*) FROM job_postings
+                WHERE coalesce(last_seen_on, coalesce(updated_at, collected_at)::date) < %s;
+            """, (cutoff,))
+            return db_cursor.fetchone()[0]
+    import job_raw_store
+    with db_conn.cursor() as db_cursor:
+        legacy_column = job_raw_store.has_legacy_column(db_cursor)
+    expired_jobs_sql = EXPIRED_JOBS_SQL.format(legacy_payload='j.raw_api_response' if legacy_column else 'NULL')
+    archived = 0
+    archived_sources = set()
+    while True:
+        with db_conn.cursor() as db_cursor:
+            db_cursor.execute(expired_jobs_sql, (cutoff, batch_size))
+            rows = [_job_row(row) for row in db_cursor.fetchall()]
+            if not rows:
+                db_conn.rollback()
+                rebuild_seen_filters(db_conn, archived_sources)
+                return archived
+            source_at, collected_at_at = columns.index('source'), columns.index('collected_at')
+            archived_sources.update(r[source_at] for r in rows)
+            groups = _group_by_partition(rows, lambda r: r[source_at], lambda r: r[collected_at_at])
+            for (source, month), group in groups.items():
+                relative = write_partition('job_postings', source, month, JOB_FIELDS, group, directory)
+                collected = [r[collected_at_at] for r in group if r[collected_at_at]]
+                db_cursor.execute(f"""
+                    INSERT INTO {CATALOG} (table_name, source, month, path, row_count, first_collected_at, last_collected_at)
+                    VALUES ('job_postings', %s, %s, %s, %s, %s, %s);
+                """, (source, month, relative, len(group), min(collected, default=None), max(collected, default=None)))
+            job_urls = [r[columns.index('job_url')] for r in rows]
+            # Summary rows and deletes commit together; the files are already on disk
+            db_cursor.execute("DELETE FROM job_postings_raw WHERE job_url = ANY(%s);", (job_urls,))
+            db_cursor.execute("DELETE FROM job_postings WHERE job_url = ANY(%s);", (job_urls,))
+        db_conn.commit()
+        archived += len(rows)
+        print(f"  job_postings: {archived} rows archived...")
+
+
+def rebuild_seen_filters(db_conn, job_sources):
+    """Rebuild the seen-filters of the collectors writing these job_postings sources. Never raises."""
+    import seen_filter
+    for filter_source, (store, source_value) in seen_filter.SOURCE_KEYS.items():
+        if store != 'postgres' or source_value not in job_sources:
+            continue
+        try:
+            print(f"  Rebuilt seen-filter for {filter_source} from {seen_filter.rebuild(filter_source, db_conn)} stored IDs.")
+        except Exception as rebuild_err:
+            # The filter still holds archived postings: drop it, collectors go to the database until the next rebuild
+            print(f">>> Warning: Could not rebuild seen-filter for {filter_source} ({rebuild_err}) - removing it.")
+            try:
+                os.remove(seen_filter.filter_path(filter_source))
+            except OSError:
+                pass
+        finally:
+            db_conn.rollback() # Read-only
+
+
+def job_partitions(db_cursor, since=None, until=None, source=None):
+    db_cursor.execute(f"""
+        SELECT path FROM {CATALOG}
+        WHERE table_name = 'job_postings'
+          AND (%(source)s::text IS NULL OR source = %(source)s)
+          AND (%(since)s::timestamp IS NULL OR last_collected_at >= %(since)s)
+          AND (%(until)s::timestamp IS NULL OR first_collected_at < %(until)s)
+        ORDER BY first_collected_at;
+    """, {'source': source, 'since': since, 'until': until})
+    return [row[0] for row in db_cursor.fetchall()]
+
+
+def iter_cold_jobs(db_cursor, since=None, until=None, source=None, directory=None):
+    """Archived postings in the range, once each, skipping any that are (still or again) in job_postings."""
+    seen_urls = set()
+    jobs = read_partitions(job_partitions(db_cursor, since, until, source), JOB_FIELDS, since, until, directory)
+    for chunk in _chunks(jobs):
+        db_cursor.execute("SELECT job_url FROM job_postings WHERE job_url = ANY(%s);",
+                          ([job['job_url'] for job in chunk],))
+        seen_urls.update(row[0] for row in db_cursor.fetchall())
+        for job in chunk:
+            if job['job_url'] not in seen_urls:
+                seen_urls.add(job['job_url'])
+                yield job
+
+
+def find_jobs(db_cursor, since, until=None, source=None, limit=None, directory=None):
+    """Postings collected in [since, until), hot and cold, newest first."""
+    until = until or datetime.utcnow()
+    columns = [name for name, _ in JOB_FIELDS if name not in ('id', 'raw_payload')]
+    db_cursor.execute(f"""
+        SELECT {', '.join(columns)} FROM job_postings
+        WHERE collected_at >= %s AND collected_at < %s AND (%s::text IS NULL OR source = %s);
+    """, (since, until, source, source))
+    jobs = [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+    for job in iter_cold_jobs(db_cursor, since, until, source, directory):
+        jobs.append({name: job.get(name) for name in columns})
+    jobs.sort(key=lambda job: job['collected_at'], reverse=True)
+    return jobs[:limit] if limit else jobs
+
+
+# --- Posts (MongoDB) ---
+def _post_row(doc):
+    known = {name for name, _ in export_data.SOCIAL_FIELDS}
+    extra = {key: value for key, value in doc.items() if key not in known}
+    return tuple(export_data._social_row(doc)) + (json.dumps(extra, default=str) if extra else None,)
+
+
+def _post_doc(record):
+    extra = record.pop('extra', None) or {}
+    doc = {name: value for name, value in record.items() if value is not None}
+    doc.update(extra)
+    return doc
+
+
+def archive_posts(db, max_age_days=POSTS_MAX_AGE_DAYS, dry_run=False, batch_size=ARCHIVE_BATCH, directory=None):
+    """Move posts collected more than max_age_days ago to cold files. Returns documents archived (or due)."""
+    posts = db['social_media_posts']
+    # Unscored posts stay until process_sentiment.py has counted them in the rollups
+    query = {'collected_at': {'$lt': datetime.utcnow() - timedelta(days=max_age_days)}, 'sentiment_pending': {'$ne': True}}
+    if dry_run:
+        return posts.count_documents(query)
+    columns = [name for name, _ in POST_FIELDS]
+    source_at, collected_at_at = columns.index('source'), columns.index('collected_at')
+    archived = 0
+    while True:
+        docs = list(posts.find(query).sort('collected_at', 1).limit(batch_size))
+        if not docs:
+            return archived
+        rows = [_post_row(doc) for doc in docs]
+        groups = _group_by_partition(rows, lambda r: r[source_at] or 'unknown', lambda r: r[collected_at_at])
+        for (source, month), group in groups.items():
+            relative = write_partition('social_media_posts', source, month, POST_FIELDS, group, directory)
+            collected = [r[collected_at_at] for r in group if r[collected_at_at]]
+            db[CATALOG].insert_one({
+                'table_name': 'social_media_posts', 'source': source, 'month': month, 'path': relative,
+                'row_count': len(group), 'first_collected_at': min(collected, default=None),
+                'last_collected_at': max(collected, default=None), 'archived_at': datetime.utcnow(),
+            })
+        posts.delete_many({'_id': {'$in': [doc['_id'] for doc in docs]}})
+        archived += len(docs)
+        print(f"  social_media_posts: {archived} documents archived...")
+
+
+def post_partitions(db, since=None, until=None, source=None):
+    query = {'table_name': 'social_media_posts'}
+    if source:
+        query['source'] = source
+    if since:
+        query['last_collected_at'] = {'$gte': since}
+    if until:
+        query['first_collected_at'] = {'$lt': until}
+    return [doc['path'] for doc in db[CATALOG].find(query, {'path': 1}).sort('first_collected_at', 1)]
+
+
+def iter_cold_posts(db, since=None, until=None, source=None, directory=None):
+    """Archived posts in the range (as documents), once each, skipping any still in social_media_posts."""
+    posts = db['social_media_posts']
+    seen_ids = set()
+    records = read_partitions(post_partitions(db, since, until, source), POST_FIELDS, since, until, directory)
+    for chunk in _chunks(_post_doc(record) for record in records):
+        by_source = {}
+        for doc in chunk:
+            by_source.setdefault(doc.get('source'), []).append(doc.get('source_specific_id'))
+        for post_source, ids in by_source.items():
+            # Both fields, so the unique (source, source_specific_id) index serves it
+            hot = posts.find({'source': post_source, 'source_specific_id': {'$in': ids}}, {'source_specific_id': 1})
+            seen_ids.update((post_source, doc['source_specific_id']) for doc in hot)
+        for doc in chunk:
+            post_key = (doc.get('source'), doc.get('source_specific_id'))
+            if post_key not in seen_ids:
+                seen_ids.add(post_key)
+                yield doc
+
+
+def find_posts(db, since, until=None, source=None, limit=None, directory=None):
+    """Posts collected in [since, until), hot and cold, newest first (_id as a string)."""
+    until = until or datetime.utcnow()
+    query = {'collected_at': {'$gte': since, '$lt': until}}
+    if source:
+        query['source'] = source
+    docs = [dict(doc, _id=str(doc['_id'])) for doc in db['social_media_posts'].find(query)]
+    docs.extend(iter_cold_posts(db, since, until, source, directory))
+    docs.sort(key=lambda doc: doc['collected_at'], reverse=True)
+    return docs[:limit] if limit else docs
+
+
+# --- CLI ---
+def _date(value):
+    return datetime.fromisoformat(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old posts and expired postings to Parquet cold storage.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='Archive everything past its hot-tier lifetime')
+    run.add_argument('--only', choices=['jobs', 'posts'])
+    run.add_argument('--posts-days', type=int, default=POSTS_MAX_AGE_DAYS)
+    run.add_argument('--jobs-unseen-days', type=int, default=JOBS_UNSEEN_DAYS)
+    run.add_argument('--dry-run', action='store_true', help='Only count what is due')
+    sub.add_parser('status', help='Rows due now and cold partitions recorded')
+    query = sub.add_parser('query', help='Rows collected in a date range, hot and cold')
+    query.add_argument('table', choices=['jobs', 'posts'])
+    query.add_argument('--since', type=_date, required=True)
+    query.add_argument('--until', type=_date)
+    query.add_argument('--source')
+    query.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    only = args.only if args.command == 'run' else (args.table if args.command == 'query' else None)
+    exit_code = 0
+    if only != 'posts':
+        db_uri = os.environ.get('POSTGRES_URI')
+        if not db_uri:
+            print(">>> Error: POSTGRES_URI secret not found or is empty!")
+            return 1
+        import psycopg2
+        db_conn = psycopg2.connect(db_uri)
+        try:
+            if args.command == 'run':
+                archived = archive_jobs(db_conn, args.jobs_unseen_days, args.dry_run)
+                print(f"job_postings: {archived} postings {'due' if args.dry_run else 'archived'} "
+                      f"(not listed for {args.jobs_unseen_days} days).")
+            elif args.command == 'status':
+                print(f"job_postings: {archive_jobs(db_conn, dry_run=True)} postings due "
+                      f"(not listed for {JOBS_UNSEEN_DAYS} days).")
+                with db_conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT source, count(*), sum(row_count), min(first_collected_at), max(last_collected_at)
+                        FROM {CATALOG} WHERE table_name = 'job_postings' GROUP BY source ORDER BY source;
+                    """)
+                    for source, files, rows, first, last in cur.fetchall():
+                        print(f"  cold {source:<20} {files:>5} files {rows:>9} rows  {first} .. {last}")
+            else:
+                with db_conn.cursor() as cur:
+                    jobs = find_jobs(cur, args.since, args.until, args.source, args.limit)
+                for job in jobs:
+                    print(f"{job['collected_at']:%Y-%m-%d %H:%M}  {job['source']:<15} {job['title']}  {job['job_url']}")
+        except Exception as pg_err:
+            print(f">>> Error (job_postings): {pg_err}")
+            exit_code = 1
+        finally:
+            db_conn.close()
+    if only != 'jobs':
+        mongo_uri = os.environ.get('MONGO_URI')
+        if not mongo_uri:
+            print(">>> Error: MONGO_URI secret not found or is empty!")
+            return 1
+        from pymongo import MongoClient
+        mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        try:
+            db = mongo_client['web3_data']
+            if args.command == 'run':
+                archived = archive_posts(db, args.posts_days, args.dry_run)
+                print(f"social_media_posts: {archived} posts {'due' if args.dry_run else 'archived'} "
+                      f"(collected over {args.posts_days} days ago).")
+            elif args.command == 'status':
+                print(f"social_media_posts: {archive_posts(db, dry_run=True)} posts due "
+                      f"(collected over {POSTS_MAX_AGE_DAYS} days ago).")
+                for row in db[CATALOG].aggregate([
+                    {'$match': {'table_name': 'social_media_posts'}},
+                    {'$group': {'_id': '$source', 'files': {'$sum': 1}, 'rows': {'$sum': '$row_count'},
+                                'first': {'$min': '$first_collected_at'}, 'last': {'$max': '$last_collected_at'}}},
+                    {'$sort': {'_id': 1}},
+                ]):
+                    print(f"  cold {row['_id']:<20} {row['files']:>5} files {row['rows']:>9} rows  {row['first']} .. {row['last']}")
+            else:
+                for doc in find_posts(db, args.since, args.until, args.source, args.limit):
+                    print(f"{doc['collected_at']:%Y-%m-%d %H:%M}  {doc.get('source'):<8} "
+                          f"{(doc.get('title') or doc.get('text') or '')[:80]}")
+        except Exception as mongo_err:
+            print(f">>> Error (social_media_posts): {mongo_err}")
+            exit_code = 1
+        finally:
+            mongo_client.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
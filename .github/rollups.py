@@ -0,0 +1,293 @@
+# ----- rollups.py -----
+# Incrementally maintained daily aggregates, so dashboards read a few hundred
+# rollup rows instead of rescanning social_media_posts and job_postings.
+#
+# MongoDB  sentiment_daily_rollups   - per day / source / (all | subreddit | source_query)
+#                                      count and sums of the VADER scores; averages = sum / count
+# Postgres job_postings_daily_tags   - per day / source / tag: postings, remote postings
+# Postgres job_postings_daily_companies - per day / source / company: postings, remote postings
+#
+# process_sentiment.py adds each newly scored post exactly once; the job
+# collectors add each newly inserted posting in the same transaction as the insert.
+# Rows moved to cold storage (retention.py) keep their counts here; `rebuild`
+# reads the cold partitions back in so it does not drop them.
+#
+# Usage:
+#   python rollups.py sentiment [--days 30] [--dimension subreddit]
+#   python rollups.py tags [--days 30] [--top 25]
+#   python rollups.py rebuild [--only mongo|postgres]   # recompute from the raw tables
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+SENTIMENT_COLLECTION = 'sentiment_daily_rollups'
+SENTIMENT_DIMENSIONS = [('all', None), ('subreddit', 'subreddit'), ('source_query', 'source_query')]
+SENTIMENT_SCORES = ['compound', 'pos', 'neu', 'neg']
+
+CREATE_JOB_ROLLUPS_SQL = """
+    CREATE TABLE IF NOT EXISTS job_postings_daily_tags (
+        day             DATE NOT NULL,
+        source          TEXT NOT NULL,
+        tag             TEXT NOT NULL,
+        postings        INTEGER NOT NULL DEFAULT 0,
+        remote_postings INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, source, tag)
+    );
+    CREATE TABLE IF NOT EXISTS job_postings_daily_companies (
+        day             DATE NOT NULL,
+        source          TEXT NOT NULL,
+        company_name    TEXT NOT NULL,
+        postings        INTEGER NOT NULL DEFAULT 0,
+        remote_postings INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, source, company_name)
+    );
+"""
+
+UPSERT_TAG_SQL = """
+    INSERT INTO job_postings_daily_tags AS t (day, source, tag, postings, remote_postings)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (day, source, tag) DO UPDATE
+    SET postings = t.postings + EXCLUDED.postings,
+        remote_postings = t.remote_postings + EXCLUDED.remote_postings;
+"""
+
+UPSERT_COMPANY_SQL = """
+    INSERT INTO job_postings_daily_companies AS c (day, source, company_name, postings, remote_postings)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (day, source, company_name) DO UPDATE
+    SET postings = c.postings + EXCLUDED.postings,
+        remote_postings = c.remote_postings + EXCLUDED.remote_postings;
+"""
+
+
+# --- Job postings (PostgreSQL) ---
+def ensure_job_rollup_tables(db_cursor):
+    db_cursor.execute(CREATE_JOB_ROLLUPS_SQL)
+
+
+def normalize_tag(tag):
+    return tag.strip().lower() if isinstance(tag, str) and tag.strip() else None
+
+
+class JobRollupAccumulator:
+    """Counts newly inserted postings in memory; flush() applies them in the collector's transaction."""
+
+    def __init__(self):
+        self.tags = {}
+        self.companies = {}
+
+    def add(self, day, source, company, tags, is_remote):
+        remote = 1 if is_remote else 0
+        for tag in {normalize_tag(t) for t in tags or []} - {None}:
+            counts = self.tags.setdefault((day, source, tag), [0, 0])
+            counts[0] += 1
+            counts[1] += remote
+        if company and company != 'N/A':
+            counts = self.companies.setdefault((day, source, company), [0, 0])
+            counts[0] += 1
+            counts[1] += remote
+
+    def reset(self):
+        # Call after a rollback - the counted inserts are gone too
+        self.tags.clear()
+        self.companies.clear()
+
+    def flush(self, db_cursor):
+        if self.tags:
+            db_cursor.executemany(UPSERT_TAG_SQL, [k + tuple(v) for k, v in self.tags.items()])
+        if self.companies:
+            db_cursor.executemany(UPSERT_COMPANY_SQL, [k + tuple(v) for k, v in self.companies.items()])
+        updated = len(self.tags) + len(self.companies)
+        self.reset()
+        return updated
+
+
+def rebuild_job_rollups(db_conn):
+    with db_conn.cursor() as cur:
+        ensure_job_rollup_tables(cur)
+        cur.execute("TRUNCATE job_postings_daily_tags, job_postings_daily_companies;")
+        cur.execute("""
+            INSERT INTO job_postings_daily_tags (day, source, tag, postings, remote_postings)
+            SELECT collected_at::date, source, lower(trim(tag)), count(DISTINCT job_url),
+                   count(DISTINCT job_url) FILTER (WHERE is_remote)
+            FROM job_postings, unnest(tags) AS tag
+            WHERE trim(tag) <> ''
+            GROUP BY 1, 2, 3;
+        """)
+        cur.execute("""
+            INSERT INTO job_postings_daily_companies (day, source, company_name, postings, remote_postings)
+            SELECT collected_at::date, source, company_name, count(*), count(*) FILTER (WHERE is_remote)
+            FROM job_postings
+            WHERE company_name IS NOT NULL AND company_name <> 'N/A'
+            GROUP BY 1, 2, 3;
+        """)
+        # Archived postings (retention.py) - same counts as the statements above
+        import retention
+        job_rollup = JobRollupAccumulator()
+        for job in retention.iter_cold_jobs(cur):
+            job_rollup.add(job['collected_at'].date(), job['source'], job['company_name'], job['tags'], job['is_remote'])
+        job_rollup.flush(cur)
+    db_conn.commit()
+
+
+# --- Sentiment (MongoDB) ---
+def _post_day(doc):
+    posted = doc.get('created_at') or doc.get('created_utc') or doc.get('collected_at') or datetime.utcnow()
+    return datetime(posted.year, posted.month, posted.day)
+
+
+def _rollup_id(day, source, dimension, key):
+    # Field order matters for embedded-document equality - keep it identical to the rebuild pipeline
+    return {'day': day, 'source': source, 'dimension': dimension, 'key': key}
+
+
+def sentiment_rollup_updates(scored_docs):
+    """Build the $inc upserts for a batch of newly scored posts (each post must be counted once)."""
+    from pymongo import UpdateOne
+    increments = {}
+    for doc in scored_docs:
+        sentiment = doc.get('sentiment') or {}
+        day = _post_day(doc)
+        for dimension, field in SENTIMENT_DIMENSIONS:
+            key = 'all' if field is None else doc.get(field)
+            if key is None:
+                continue
+            inc = increments.setdefault((day, doc.get('source'), dimension, key), {'count': 0})
+            inc['count'] += 1
+            for score in SENTIMENT_SCORES:
+                inc[f'{score}_sum'] = inc.get(f'{score}_sum', 0.0) + float(sentiment.get(score, 0.0))
+    return [
+        UpdateOne(
+            {'_id': _rollup_id(day, source, dimension, key)},
+            {'$inc': inc, '$setOnInsert': {'day': day, 'source': source, 'dimension': dimension, 'key': key}},
+            upsert=True
+        )
+        for (day, source, dimension, key), inc in increments.items()
+    ]
+
+
+def apply_sentiment_rollups(db, scored_docs):
+    updates = sentiment_rollup_updates(scored_docs)
+    if updates:
+        db[SENTIMENT_COLLECTION].bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+def ensure_sentiment_indexes(db):
+    db[SENTIMENT_COLLECTION].create_index([('dimension', 1), ('day', 1)])
+
+
+def rebuild_sentiment_rollups(db):
+    rollups = db[SENTIMENT_COLLECTION]
+    rollups.delete_many({})
+    for dimension, field in SENTIMENT_DIMENSIONS:
+        key_expr = 'all' if field is None else f'${field}'
+        group = {
+            '_id': {
+                'day': {'$dateTrunc': {'date': {'$ifNull': ['$created_at', '$created_utc', '$collected_at']}, 'unit': 'day'}},
+                'source': '$source',
+                'dimension': dimension,
+                'key': key_expr,
+            },
+            'count': {'$sum': 1},
+        }
+        for score in SENTIMENT_SCORES:
+            group[f'{score}_sum'] = {'$sum': f'$sentiment.{score}'}
+        pipeline = [{'$match': {'sentiment': {'$exists': True}}}]
+        if field is not None:
+            pipeline.append({'$match': {field: {'$ne': None}}})
+        pipeline += [
+            {'$group': group},
+            {'$set': {'day': '$_id.day', 'source': '$_id.source', 'dimension': '$_id.dimension', 'key': '$_id.key'}},
+            {'$merge': {'into': SENTIMENT_COLLECTION, 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+        ]
+        db['social_media_posts'].aggregate(pipeline, allowDiskUse=True)
+    # Archived posts (retention.py): added on top, exactly as process_sentiment.py would have
+    import retention
+    scored = []
+    for doc in retention.iter_cold_posts(db):
+        if doc.get('sentiment'):
+            scored.append(doc)
+        if len(scored) >= 5000:
+            apply_sentiment_rollups(db, scored)
+            scored = []
+    apply_sentiment_rollups(db, scored)
+    ensure_sentiment_indexes(db)
+
+
+# --- Read side ---
+def sentiment_series(db, days=30, dimension='all', source=None):
+    query = {'dimension': dimension, 'day': {'$gte': datetime.utcnow() - timedelta(days=days)}}
+    if source:
+        query['source'] = source
+    rows = []
+    for doc in db[SENTIMENT_COLLECTION].find(query).sort('day', 1):
+        rows.append({
+            'day': doc['day'], 'source': doc['source'], 'key': doc['key'], 'count': doc['count'],
+            'avg_compound': doc['compound_sum'] / doc['count'] if doc['count'] else None,
+        })
+    return rows
+
+
+def tag_demand(db_cursor, days=30, top=25):
+    db_cursor.execute("""
+        SELECT tag, sum(postings) AS postings, sum(remote_postings) AS remote_postings
+        FROM job_postings_daily_tags
+        WHERE day >= current_date - %s
+        GROUP BY tag
+        ORDER BY postings DESC
+        LIMIT %s;
+    """, (days, top))
+    return db_cursor.fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query or rebuild the daily rollups.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sentiment = sub.add_parser('sentiment', help='Daily average sentiment')
+    sentiment.add_argument('--days', type=int, default=30)
+    sentiment.add_argument('--dimension', choices=[d for d, _ in SENTIMENT_DIMENSIONS], default='all')
+    sentiment.add_argument('--source')
+    tags = sub.add_parser('tags', help='Postings per tag')
+    tags.add_argument('--days', type=int, default=30)
+    tags.add_argument('--top', type=int, default=25)
+    rebuild = sub.add_parser('rebuild', help='Recompute rollups from the raw tables')
+    rebuild.add_argument('--only', choices=['mongo', 'postgres'])
+    args = parser.parse_args(argv)
+
+    if args.command == 'sentiment' or (args.command == 'rebuild' and args.only != 'postgres'):
+        from pymongo import MongoClient
+        mongo_client = MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=5000)
+        db = mongo_client['web3_data']
+        try:
+            if args.command == 'rebuild':
+                print("Rebuilding sentiment rollups...")
+                rebuild_sentiment_rollups(db)
+                print(f"Done: {db[SENTIMENT_COLLECTION].estimated_document_count()} rollup documents.")
+            else:
+                for row in sentiment_series(db, args.days, args.dimension, args.source):
+                    print(f"{row['day']:%Y-%m-%d} {row['source']:<8} {str(row['key'])[:40]:<40} "
+                          f"n={row['count']:<5} avg_compound={row['avg_compound']:+.3f}")
+        finally:
+            mongo_client.close()
+
+    if args.command == 'tags' or (args.command == 'rebuild' and args.only != 'mongo'):
+        import psycopg2
+        db_conn = psycopg2.connect(os.environ['POSTGRES_URI'])
+        try:
+            if args.command == 'rebuild':
+                print("Rebuilding job posting rollups...")
+                rebuild_job_rollups(db_conn)
+                print("Done.")
+            else:
+                with db_conn.cursor() as cur:
+                    for tag, postings, remote in tag_demand(cur, args.days, args.top):
+                        print(f"{tag:<30} {postings:>6} postings ({remote} remote)")
+        finally:
+            db_conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
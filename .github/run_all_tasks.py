@@ -2,20 +2,95 @@
 import subprocess
 import time
 import sys
+import os
 from datetime import datetime
+import run_metrics # Aggregates the per-script metrics files
+import resilience # Per-source circuit breakers
+import spool # Local write spool for database outages
+import source_registry # --shard i/N for matrix runners
+import profiling # --profile
 
 # List of scripts to run in order
 scripts_to_run = [
+    'migrations.py',
+    'seen_filter.py',
     'collect_web3career.py',
     'scrape_cryptojobslist.py',
     'collect_reddit.py',
     'collect_twitter.py',
+    'refresh_engagement.py',
+    'spool.py',
     'process_sentiment.py'
 ]
+# COLLECTOR_ENGINE=async collects all four sources concurrently in one process instead
+if os.environ.get('COLLECTOR_ENGINE') == 'async':
+    scripts_to_run = ['migrations.py', 'seen_filter.py', 'async_collector.py', 'refresh_engagement.py', 'spool.py', 'process_sentiment.py']
+# COLLECTOR_ENGINE=queue runs whatever is due in the collection_tasks queue instead - any number
+# of these runners (or task_queue.py workers) can run at the same time without double-fetching
+elif os.environ.get('COLLECTOR_ENGINE') == 'queue':
+    scripts_to_run = ['migrations.py', 'seen_filter.py', 'task_queue.py', 'refresh_engagement.py', 'spool.py', 'process_sentiment.py']
+# Tiered retention, last so freshly scored posts can go cold - only where COLD_STORAGE_DIR is durable storage
+if os.environ.get('COLD_STORAGE_DIR'):
+    scripts_to_run.append('retention.py')
 
-print(f"--- Starting Task Runner at {datetime.utcnow().isoformat()} ---")
+# --shard i/N (or COLLECTOR_SHARD): this runner collects only its share of sources.json.
+# Post-collection steps that read the whole database run on shard 1 only, so N runners
+# don't refresh, score or archive the same posts N times.
+shard = source_registry.shard_option()
+if shard and shard[0] != 1:
+    scripts_to_run = [s for s in scripts_to_run if s not in ('refresh_engagement.py', 'process_sentiment.py', 'retention.py')]
+
+# Extra command-line arguments per script
+script_args = {
+    'migrations.py': ['apply'], # Only pending migrations; a version check once the schema is current
+    'seen_filter.py': ['rebuild', '--if-needed'], # Only missing or over-capacity seen-ID filters
+    'spool.py': ['flush'], # Write anything collectors spooled while a database was down (this run or earlier ones)
+    'task_queue.py': ['work', '--once', '--sync'], # Pick up sources.json changes, run what is due, exit
+    'retention.py': ['run'], # Move posts / postings past their hot-tier lifetime to cold storage
+}
+
+# Source each script collects, for its circuit breaker (async_collector.py keeps per-source breakers itself)
+script_sources = {
+    'collect_web3career.py': 'web3career',
+    'scrape_cryptojobslist.py': 'cryptojobslist',
+    'collect_reddit.py': 'reddit',
+    'collect_twitter.py': 'twitter',
+    'refresh_engagement.py': 'engagement',
+    'process_sentiment.py': 'sentiment',
+}
+# Run reports a script writes, when they are not named after its breaker source
+script_report_sources = {
+    'refresh_engagement.py': ('twitter_engagement', 'reddit_engagement'),
+}
+
+# Each script writes <source>.json here; the combined report goes to the same place
+metrics_dir = os.path.abspath(run_metrics.METRICS_DIR)
+run_metrics.clear_source_reports(metrics_dir)
+state_dir = os.path.abspath(resilience.STATE_DIR)
+spool_dir = os.path.abspath(spool.SPOOL_DIR)
+script_env = dict(os.environ, RUN_METRICS_DIR=metrics_dir, COLLECTOR_STATE_DIR=state_dir, SPOOL_DIR=spool_dir)
+if shard:
+    # Every collector picks its units from this; the N runners share each API's quota
+    script_env.update(COLLECTOR_SHARD=f"{shard[0]}/{shard[1]}", RATE_LIMIT_SHARES=str(shard[1]))
+# --profile: every script samples itself and writes profiles/<script>.* (see profiling.py)
+profile_dir = os.path.abspath(profiling.PROFILE_DIR) if profiling.profile_option() else None
+if profile_dir:
+    script_env.update(COLLECTOR_PROFILE='1', COLLECTOR_PROFILE_DIR=profile_dir)
+script_results = []
+
+run_started_at = datetime.utcnow()
+script_env['COLLECTOR_RUN_STARTED_AT'] = run_started_at.isoformat() # Groups this run's rows in collector_runs
+print(f"--- Starting Task Runner ({source_registry.describe(shard)}) at {run_started_at.isoformat()} ---")
 
 for script_name in scripts_to_run:
+    source = script_sources.get(script_name)
+    breaker = resilience.CircuitBreaker(source, state_dir) if source else None
+    result = {'script': script_name, 'success': False, 'exit_code': None, 'duration_seconds': None}
+    script_results.append(result)
+    if breaker and not breaker.allow():
+        print(f"\n>>> Skipping {script_name}: circuit breaker {breaker.describe()} <<<")
+        result['error'] = 'circuit_open'
+        continue
     print(f"\n>>> Running script: {script_name} <<<")
     start_time = time.time()
     try:
@@ -23,11 +98,12 @@ for script_name in scripts_to_run:
         # capture_output=True gets stdout/stderr, text=True decodes it
         # check=True raises CalledProcessError if script exits with non-zero code
         process = subprocess.run(
-            [sys.executable, script_name], # Use sys.executable to ensure correct python version
+            [sys.executable, script_name, *script_args.get(script_name, [])], # Use sys.executable to ensure correct python version
             capture_output=True,
             text=True,
             check=True,
-            timeout=900 # Set a timeout (e.g., 15 minutes) per script
+            timeout=900, # Set a timeout (e.g., 15 minutes) per script
+            env=script_env
         )
         # Print the output from the script
         print(f"--- Output from {script_name} ---")
@@ -36,28 +112,77 @@ for script_name in scripts_to_run:
              print(f"--- Errors from {script_name} ---")
              print(process.stderr)
         print(f"--- Finished {script_name} ---")
+        result['success'] = True
+        result['exit_code'] = process.returncode
 
     except subprocess.CalledProcessError as e:
         # Script exited with an error code
         print(f">>> Error running {script_name}: Exited with code {e.returncode}")
         print(f"--- STDOUT ---:\n{e.stdout}")
         print(f"--- STDERR ---:\n{e.stderr}")
-        # Decide if you want to stop the whole process or continue
-        # continue
-        break # Stop if one script fails catastrophically
+        result['exit_code'] = e.returncode
+        result['duration_seconds'] = round(time.time() - start_time, 4)
+        result['error'] = f"exit code {e.returncode}"
     except subprocess.TimeoutExpired as e:
          print(f">>> Timeout running {script_name} after {e.timeout} seconds.")
          print(f"--- STDOUT ---:\n{e.stdout}")
          print(f"--- STDERR ---:\n{e.stderr}")
-         break # Stop if one script times out
+         result['error'] = 'timeout'
+         result['duration_seconds'] = round(time.time() - start_time, 4)
     except Exception as e:
         # Catch other potential errors during subprocess run
          print(f">>> Unexpected error trying to run {script_name}: {e}")
-         break # Stop on unexpected errors
+         result['error'] = str(e)
+         result['duration_seconds'] = round(time.time() - start_time, 4)
 
     end_time = time.time()
+    result['duration_seconds'] = round(end_time - start_time, 4)
     print(f"Script {script_name} took {end_time - start_time:.2f} seconds.")
-    # Optional short pause between scripts
-    time.sleep(5)
+    if breaker:
+        # Scripts usually exit 0 even when their API failed, so also look at what they collected
+        report_sources = script_report_sources.get(script_name, (source,))
+        source_reports = [r for r in run_metrics.load_source_reports(metrics_dir) if r.get('source') in report_sources]
+        source_ok = result['success'] and not any(resilience.source_run_failed(r) for r in source_reports)
+        breaker.record(source_ok, result.get('error') or (None if source_ok else 'errors reported and nothing fetched'))
+    # No pause between scripts - each API is paced by its own bucket in rate_limits.py
+
+# --- Run Report ---
+run_finished_at = datetime.utcnow()
+try:
+    run_report = run_metrics.build_run_report(
+        run_started_at, run_finished_at, script_results,
+        run_metrics.load_source_reports(metrics_dir)
+    )
+    report_path, prom_path = run_metrics.write_run_report(run_report, metrics_dir)
+    print(f"\nRun report written to {report_path}")
+    print(f"Prometheus metrics written to {prom_path}")
+    for source_report in run_report['sources']:
+        stages = ', '.join(f"{k}={v:.2f}s" for k, v in source_report['stage_seconds'].items())
+        print(f"  {source_report['source']}: {source_report['counters']} | {stages}")
+except Exception as report_err:
+    print(f">>> Warning: Could not build run report: {report_err}")
+    run_report = None
+
+# --- Run Ledger ---
+# Each script recorded its own collector_runs rows as it finished; add the script outcomes
+if os.environ.get('POSTGRES_URI'):
+    ledger_conn = None
+    try:
+        import psycopg2
+        import run_ledger
+        ledger_conn = psycopg2.connect(os.environ['POSTGRES_URI'])
+        marked = run_ledger.mark_script_results(ledger_conn, run_started_at, script_results)
+        print(f"Marked {marked} source runs in collector_runs with their script's outcome.")
+    except Exception as ledger_err:
+        print(f">>> Warning: Could not mark script outcomes in collector_runs: {ledger_err}")
+    finally:
+        if ledger_conn: ledger_conn.close()
+
+if profile_dir and os.path.isdir(profile_dir):
+    # Each script printed its own top-N above; point at the flame graph files
+    profiles = sorted(name for name in os.listdir(profile_dir) if name.endswith('.speedscope.json'))
+    print(f"\nProfiles in {profile_dir} (open the .speedscope.json files at https://www.speedscope.app):")
+    for name in profiles:
+        print(f"  {name}")
 
-print(f"\n--- Task Runner Finished at {datetime.utcnow().isoformat()} ---")
\ No newline at end of file
+print(f"\n--- Task Runner Finished at {run_finished_at.isoformat()} ---")
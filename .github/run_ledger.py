@@ -0,0 +1,241 @@
+# ----- run_ledger.py -----
+# Persistent ledger of collector runs in PostgreSQL (Neon).
+# Every source run records one `collector_runs` row where it ends (RunMetrics.write,
+# or RunMetrics.record for daemon / task queue polls), whichever engine ran it, so
+# the numbers from the "Final Summary" blocks outlive the Actions log.
+# Rows written under run_all_tasks.py share its run_started_at
+# (COLLECTOR_RUN_STARTED_AT), and the runner sets their success to the script's
+# exit status afterwards.
+#
+# Usage:
+#   python run_ledger.py trend [--source reddit] [--days 30]
+#   python run_ledger.py regressions [--source reddit] [--window 10] [--threshold 3.5]
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+from datetime import datetime, timedelta
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS collector_runs (
+        id                BIGSERIAL PRIMARY KEY,
+        run_started_at    TIMESTAMP NOT NULL,
+        source            TEXT NOT NULL,
+        script            TEXT,
+        started_at        TIMESTAMP NOT NULL,
+        finished_at       TIMESTAMP NOT NULL,
+        duration_seconds  DOUBLE PRECISION NOT NULL,
+        items_fetched     INTEGER NOT NULL DEFAULT 0,
+        items_inserted    INTEGER NOT NULL DEFAULT 0,
+        items_skipped     INTEGER NOT NULL DEFAULT 0,
+        errors            INTEGER NOT NULL DEFAULT 0,
+        bytes_transferred BIGINT NOT NULL DEFAULT 0,
+        stage_seconds     JSONB NOT NULL DEFAULT '{}'::jsonb,
+        success           BOOLEAN
+    );
+    CREATE INDEX IF NOT EXISTS idx_collector_runs_source_started
+        ON collector_runs (source, started_at);
+"""
+
+INSERT_RUN_SQL = """
+    INSERT INTO collector_runs (
+        run_started_at, source, script, started_at, finished_at, duration_seconds,
+        items_fetched, items_inserted, items_skipped, errors, bytes_transferred,
+        stage_seconds, success
+    ) VALUES (
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+    );
+"""
+
+MARK_SCRIPT_SQL = """
+    UPDATE collector_runs SET success = %s WHERE run_started_at = %s AND script = %s;
+"""
+
+# Runs used as the rolling baseline, and how far (in robust z-score units) a run may drift
+DEFAULT_WINDOW = 10
+DEFAULT_THRESHOLD = 3.5
+# Smallest spread a baseline is given credit for: 5% of its median, and never below 1 (second or row)
+MAD_FLOOR_FRACTION = 0.05
+MAD_FLOOR_MIN = 1.0
+# Field, label and the direction that is bad: longer runs, fewer rows inserted
+REGRESSION_FIELDS = (('duration_seconds', 'duration', 1), ('items_inserted', 'yield', -1))
+
+# One connection per process, reused by every run it records (the daemon records each poll)
+_ledger_conn = None
+_ledger_lock = threading.Lock()
+
+
+def source_run_row(source_report, run_started_at=None, success=None):
+    """INSERT_RUN_SQL parameters for one RunMetrics.to_dict() report."""
+    counters = source_report.get('counters', {})
+    return (
+        run_started_at or source_report['started_at'],
+        source_report['source'],
+        source_report.get('script'),
+        source_report['started_at'],
+        source_report['finished_at'],
+        source_report['duration_seconds'],
+        counters.get('fetched', 0),
+        counters.get('inserted', 0),
+        counters.get('skipped', 0),
+        counters.get('errors', 0),
+        counters.get('bytes_fetched', 0),
+        json.dumps(source_report.get('stage_seconds', {})),
+        success,
+    )
+
+
+def record_source_run(source_report, success=None):
+    """Insert one collector_runs row for a finished source run. Never raises - the ledger must not break a run.
+
+    success defaults to the circuit breaker's verdict (see resilience.source_run_failed).
+    Returns True if the row was written.
+    """
+    global _ledger_conn
+    db_uri = os.environ.get('POSTGRES_URI')
+    if not db_uri:
+        return False
+    if success is None:
+        import resilience
+        success = not resilience.source_run_failed(source_report)
+    row = source_run_row(source_report, os.environ.get('COLLECTOR_RUN_STARTED_AT'), success)
+    try:
+        import psycopg2
+        with _ledger_lock:
+            if _ledger_conn is None or _ledger_conn.closed:
+                _ledger_conn = psycopg2.connect(db_uri, connect_timeout=10)
+            try:
+                with _ledger_conn.cursor() as cur: # collector_runs is created by migrations.py
+                    cur.execute(INSERT_RUN_SQL, row)
+                _ledger_conn.commit()
+            except Exception:
+                if not _ledger_conn.closed:
+                    _ledger_conn.rollback()
+                raise
+        return True
+    except Exception as ledger_err:
+        print(f">>> Warning: Could not record {source_report.get('source')} run in collector_runs: {ledger_err}")
+        return False
+
+
+def mark_script_results(db_conn, run_started_at, script_results):
+    """Set success on the rows a runner's scripts recorded to each script's exit status. Returns rows updated."""
+    updated = 0
+    with db_conn.cursor() as cur:
+        for result in script_results:
+            cur.execute(MARK_SCRIPT_SQL, (result['success'], run_started_at, result['script']))
+            updated += cur.rowcount
+    db_conn.commit()
+    return updated
+
+
+def fetch_runs(db_conn, source=None, days=30):
+    """Return runs (oldest first) as dicts, optionally for a single source."""
+    query = """
+        SELECT source, started_at, duration_seconds, items_fetched, items_inserted,
+               items_skipped, errors, bytes_transferred
+        FROM collector_runs
+        WHERE started_at >= %s
+    """
+    params = [datetime.utcnow() - timedelta(days=days)]
+    if source:
+        query += " AND source = %s"
+        params.append(source)
+    query += " ORDER BY source, started_at;"
+    with db_conn.cursor() as cur:
+        cur.execute(query, params)
+        columns = [c[0] for c in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def rows_per_second(run, field='items_inserted'):
+    duration = run['duration_seconds'] or 0
+    return run[field] / duration if duration > 0 else 0.0
+
+
+def robust_z(value, baseline):
+    """Signed distance of `value` from the baseline median in MAD units. The MAD is floored
+    (MAD_FLOOR_FRACTION of the median, at least MAD_FLOOR_MIN), so a flat baseline does not
+    turn a one-row difference into an outlier."""
+    median = statistics.median(baseline)
+    mad = statistics.median(abs(v - median) for v in baseline)
+    mad = max(mad, MAD_FLOOR_FRACTION * abs(median), MAD_FLOOR_MIN)
+    return 0.6745 * (value - median) / mad
+
+
+def find_regressions(runs, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD):
+    """Flag runs that took far longer, or inserted far fewer rows, than the previous `window` runs of the same source."""
+    flagged = []
+    by_source = {}
+    for run in runs:
+        by_source.setdefault(run['source'], []).append(run)
+    for source, source_runs in by_source.items():
+        for i in range(window, len(source_runs)):
+            run = source_runs[i]
+            baseline = source_runs[i - window:i]
+            reasons = []
+            for field, label, bad_direction in REGRESSION_FIELDS:
+                z = robust_z(run[field], [b[field] for b in baseline])
+                if z * bad_direction >= threshold:
+                    median = statistics.median(b[field] for b in baseline)
+                    reasons.append(f"{label} {run[field]:.2f} vs median {median:.2f} (z={z:+.1f})")
+            if reasons:
+                flagged.append((run, reasons))
+    return flagged
+
+
+# --- CLI ---
+def _connect():
+    import psycopg2 # Only needed when the ledger is actually queried
+    db_uri = os.environ.get('POSTGRES_URI')
+    if not db_uri:
+        print(">>> Error: POSTGRES_URI secret not found or is empty!")
+        sys.exit(1)
+    return psycopg2.connect(db_uri)
+
+
+def print_trend(runs):
+    print(f"{'source':<16} {'started_at':<20} {'secs':>8} {'fetched':>8} {'inserted':>9} {'ins/s':>8} {'fetch/s':>8}")
+    for run in runs:
+        print(f"{run['source']:<16} {run['started_at']:%Y-%m-%d %H:%M:%S} {run['duration_seconds']:>8.1f} "
+              f"{run['items_fetched']:>8} {run['items_inserted']:>9} "
+              f"{rows_per_second(run):>8.2f} {rows_per_second(run, 'items_fetched'):>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the collector_runs ledger.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    trend = sub.add_parser('trend', help='Rows per second over time')
+    trend.add_argument('--source')
+    trend.add_argument('--days', type=int, default=30)
+    regress = sub.add_parser('regressions', help='Runs deviating from the rolling baseline')
+    regress.add_argument('--source')
+    regress.add_argument('--days', type=int, default=30)
+    regress.add_argument('--window', type=int, default=DEFAULT_WINDOW)
+    regress.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    db_conn = _connect()
+    try:
+        runs = fetch_runs(db_conn, args.source, args.days)
+        if not runs:
+            print("No collector runs recorded in this period.")
+            return 0
+        if args.command == 'trend':
+            print_trend(runs)
+            return 0
+        flagged = find_regressions(runs, args.window, args.threshold)
+        if not flagged:
+            print(f"No regressions across {len(runs)} runs (window={args.window}, threshold={args.threshold}).")
+            return 0
+        for run, reasons in flagged:
+            print(f">>> {run['source']} @ {run['started_at']:%Y-%m-%d %H:%M:%S}: " + '; '.join(reasons))
+        return 1
+    finally:
+        db_conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# ----- run_metrics.py -----
+# Shared timers and counters for the collection scripts.
+# Each script creates one RunMetrics for its source, wraps the HTTP fetch,
+# parse, dedupe and DB write steps in metrics.stage(...), counts items with
+# metrics.incr(...) and calls metrics.write() on exit, which also records the
+# run in the collector_runs ledger (run_ledger.py). run_all_tasks.py then
+# merges the per-script files into one JSON run report and a Prometheus textfile.
+# Stages may run on several threads at once (see pipeline.py), so their seconds
+# can add up to more than the run took.
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Directory where each script drops its metrics file (set by run_all_tasks.py)
+METRICS_DIR = os.environ.get('RUN_METRICS_DIR', 'run_reports')
+
+# Standard stage and counter names, so every source reports the same keys
+STAGES = ['http_fetch', 'parse', 'dedupe', 'db_write']
+COUNTERS = ['fetched', 'inserted', 'skipped', 'errors', 'bytes_fetched']
+
+
+class RunMetrics:
+    """Per-source stage timings and item counters for a single script run."""
+
+    def __init__(self, source):
+        self.source = source
+        self.script = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+        self.stage_seconds = {name: 0.0 for name in STAGES}
+        self.stage_calls = {name: 0 for name in STAGES}
+        self.counters = {name: 0 for name in COUNTERS}
+        self._lock = threading.Lock() # Pipeline stages report from worker threads
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of work and add it to the running total for `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        """Add an already-measured duration, for loops where a `with` block does not fit."""
+        with self._lock:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self):
+        finished_at = self.finished_at or datetime.utcnow()
+        return {
+            'source': self.source,
+            'script': self.script,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': finished_at.isoformat(),
+            'duration_seconds': round((finished_at - self.started_at).total_seconds(), 4),
+            'stage_seconds': {k: round(v, 4) for k, v in self.stage_seconds.items()},
+            'stage_calls': dict(self.stage_calls),
+            'counters': dict(self.counters),
+        }
+
+    def record(self, success=None):
+        """Add this run to the collector_runs ledger (if POSTGRES_URI is set). Never raises."""
+        import run_ledger
+        if self.finished_at is None:
+            self.finished_at = datetime.utcnow()
+        return run_ledger.record_source_run(self.to_dict(), success)
+
+    def write(self, directory=None):
+        """Write this run's metrics as <source>.json and record it in the ledger. Never raises - metrics must not break a run."""
+        self.finished_at = datetime.utcnow()
+        directory = directory or METRICS_DIR
+        path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{self.source}.json")
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
+            os.replace(tmp_path, path)
+            print(f"Run metrics written to {path}")
+        except Exception as metrics_err:
+            print(f">>> Warning: Could not write run metrics: {metrics_err}")
+            path = None
+        self.record()
+        return path
+
+
+# --- Aggregation (used by run_all_tasks.py) ---
+def load_source_reports(directory=None):
+    """Read every <source>.json file in the metrics directory."""
+    directory = directory or METRICS_DIR
+    reports = []
+    if not os.path.isdir(directory):
+        return reports
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('.json') or file_name == 'run_report.json':
+            continue
+        try:
+            with open(os.path.join(directory, file_name)) as f:
+                reports.append(json.load(f))
+        except Exception as read_err:
+            print(f">>> Warning: Could not read metrics file {file_name}: {read_err}")
+    return reports
+
+
+def clear_source_reports(directory=None):
+    """Remove per-source files left over from a previous run."""
+    directory = directory or METRICS_DIR
+    if not os.path.isdir(directory):
+        return
+    for file_name in os.listdir(directory):
+        if file_name.endswith('.json') and file_name != 'run_report.json':
+            os.remove(os.path.join(directory, file_name))
+
+
+def build_run_report(started_at, finished_at, script_results, source_reports):
+    """Combine script outcomes and per-source metrics into one run report dict."""
+    totals = {name: 0 for name in COUNTERS}
+    stage_totals = {name: 0.0 for name in STAGES}
+    for report in source_reports:
+        for name, value in report.get('counters', {}).items():
+            totals[name] = totals.get(name, 0) + value
+        for name, value in report.get('stage_seconds', {}).items():
+            stage_totals[name] = round(stage_totals.get(name, 0.0) + value, 4)
+    return {
+        'started_at': started_at.isoformat(),
+        'finished_at': finished_at.isoformat(),
+        'duration_seconds': round((finished_at - started_at).total_seconds(), 4),
+        'success': all(result['success'] for result in script_results),
+        'scripts': script_results,
+        'sources': source_reports,
+        'totals': {'counters': totals, 'stage_seconds': stage_totals},
+    }
+
+
+def _prom_labels(**labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def format_prometheus(run_report):
+    """Render a run report in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, help_text, metric_type, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{_prom_labels(**labels)} {value}")
+
+    sources = run_report.get('sources', [])
+    metric('collector_stage_seconds', 'Seconds spent per collector stage in the last run.', 'gauge',
+           [({'source': r['source'], 'stage': stage}, seconds)
+            for r in sources for stage, seconds in r.get('stage_seconds', {}).items()])
+    metric('collector_stage_calls', 'Number of times each collector stage ran in the last run.', 'gauge',
+           [({'source': r['source'], 'stage': stage}, calls)
+            for r in sources for stage, calls in r.get('stage_calls', {}).items()])
+    metric('collector_items', 'Item counts per collector in the last run.', 'gauge',
+           [({'source': r['source'], 'kind': kind}, count)
+            for r in sources for kind, count in r.get('counters', {}).items()])
+    metric('collector_script_duration_seconds', 'Wall time of each script in the last run.', 'gauge',
+           [({'script': s['script']}, s['duration_seconds']) for s in run_report.get('scripts', [])])
+    metric('collector_script_success', '1 if the script exited cleanly in the last run.', 'gauge',
+           [({'script': s['script']}, 1 if s['success'] else 0) for s in run_report.get('scripts', [])])
+    metric('collector_run_duration_seconds', 'Wall time of the whole task runner.', 'gauge',
+           [({}, run_report['duration_seconds'])])
+    metric('collector_run_last_finished_timestamp_seconds', 'Unix time the last run finished.', 'gauge',
+           [({}, int(datetime.fromisoformat(run_report['finished_at']).replace(tzinfo=timezone.utc).timestamp()))])
+    return '\n'.join(lines) + '\n'
+
+
+def write_run_report(run_report, directory=None, prometheus_path=None):
+    """Write run_report.json and the Prometheus textfile; returns both paths."""
+    directory = directory or METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    report_path = os.path.join(directory, 'run_report.json')
+    with open(report_path + '.tmp', 'w') as f:
+        json.dump(run_report, f, indent=2)
+    os.replace(report_path + '.tmp', report_path)
+
+    prometheus_path = prometheus_path or os.environ.get('PROMETHEUS_TEXTFILE') or os.path.join(directory, 'collector_metrics.prom')
+    with open(prometheus_path + '.tmp', 'w') as f:
+        f.write(format_prometheus(run_report))
+    os.replace(prometheus_path + '.tmp', prometheus_path)
+    return report_path, prometheus_path
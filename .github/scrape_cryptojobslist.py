@@ -3,14 +3,38 @@ import requests
 from bs4 import BeautifulSoup
 import time
 import json
-from urllib.parse import urljoin
-import re
 import psycopg2 # Import PostgreSQL driver
 import os
 import sys      # To cleanly exit on major errors
 from datetime import datetime # For timestamp
+from urllib.parse import urljoin # Listing path from sources.json
+from run_metrics import RunMetrics # Shared stage timers/counters
+import raw_archive # Raw page archive + replay
+import rollups # Daily tag/company aggregates
+import ingest_version # Cache-invalidation stamp for readers
+import documents # Shared job row mapping
+import job_history # Content-hash upsert (edits are recorded, unchanged rows untouched)
+import retention # last_seen_on stamp for postings still listed
+import rate_limits # Shared per-API token buckets
+import resilience # Retry with backoff
+import spool # Local write-ahead spool for database outages
+import migrations # Schema version check
+import source_registry # Page to scrape (sources.json) and --shard
+import seen_filter # Local Bloom filter of job URLs already stored
+import profiling # --profile
 
+profiling.start_if_requested('scrape_cryptojobslist') # Samples the rest of the run, report at exit
 print("--- Starting CryptoJobsList Scraper ---")
+metrics = RunMetrics('cryptojobslist')
+replay = raw_archive.replay_options()
+shard = source_registry.shard_option()
+source_units = source_registry.units_for('cryptojobslist', shard)
+if not replay.replay and not source_units:
+    print(f"CryptoJobsList is not part of {source_registry.describe(shard)} - nothing to scrape.")
+    sys.exit(0)
+archive = raw_archive.RawArchiveWriter('cryptojobslist', enabled=not replay.replay)
+job_spool = spool.SpoolWriter(spool.JOB_TARGET) # Used only while the database is unreachable
+seen = seen_filter.SeenFilter('cryptojobslist') # Job URLs + content hashes the database already has
 
 # --- Database Connection Setup ---
 db_conn = None
@@ -23,150 +47,188 @@ try:
         sys.exit(1)
 
     print("Connecting to external PostgreSQL database (Neon)...")
-    db_conn = psycopg2.connect(db_uri)
+    db_conn = psycopg2.connect(db_uri, connect_timeout=spool.CONNECT_TIMEOUT)
     db_cursor = db_conn.cursor()
     print("Database connection successful!")
 
-    # Verify table exists
-    db_cursor.execute("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'job_postings');")
-    table_exists = db_cursor.fetchone()[0]
-    if not table_exists:
-         print(">>> Error: 'job_postings' table does not exist! Run CREATE TABLE script first.")
-         sys.exit(1)
-    else:
-        print("'job_postings' table found.")
+    # Tables and indexes are created by migrations.py, not by every run
+    migrations.require_postgres(db_cursor)
+    db_conn.commit()
+    print("Database schema is up to date.")
 
 except Exception as db_err:
     print(f">>> Database connection error: {db_err}")
     if db_cursor: db_cursor.close()
     if db_conn: db_conn.close()
-    sys.exit(1)
+    if not spool.is_connection_error(db_err):
+        sys.exit(1)
+    # Database down or too slow - still scrape, and let spool.py write the rows later
+    db_conn = db_cursor = None
+    print(">>> Database unreachable - job rows will be spooled locally (see spool.py).")
 
 
 # --- Scraper Configuration ---
-BASE_URL = 'https://cryptojobslist.com'
-target_url = 'https://cryptojobslist.com/' # Scraping homepage
+base_url = 'https://cryptojobslist.com/'
+target_url = urljoin(base_url, source_units[0]['query']) if source_units else base_url # One listing page per run
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'
 }
 REQUEST_TIMEOUT = 25
-POLITENESS_DELAY = 2
 
 # --- Scrape and Insert ---
 inserted_count = 0
+updated_count = 0 # Known postings whose content changed (old version kept in job_postings_history)
 skipped_count = 0
 api_error = False # Reusing variable name, here means scraping error
+job_rollup = rollups.JobRollupAccumulator() # Counts only rows that were actually inserted
+uncommitted = [] # Jobs inserted since the last commit - spooled if the connection drops
+unchanged = [] # Seen-filter keys of stored rows whose content hash matched - marked once the transaction commits
+updated_jobs = [] # Jobs updated since the last commit - spooled (and replayed as updates) if the connection drops
+listed_urls = set() # Every posting on the live listing, stored or skipped - keeps them out of cold storage
+
+
+def spool_jobs(jobs):
+    for pending_job in jobs:
+        job_spool.add_job('cryptojobslist', documents.CRYPTOJOBSLIST_COLUMNS, pending_job)
 
 try:
-    # Step 1: Fetch HTML
-    print(f"\nAttempting to scrape: {target_url}")
-    response = requests.get(target_url, headers=headers, timeout=REQUEST_TIMEOUT)
-    print(f"Request sent. Status Code: {response.status_code}")
-    response.raise_for_status()
-    print("Successfully fetched page.")
-
-    # Step 2: Parse HTML
-    soup = BeautifulSoup(response.text, 'lxml')
-
-    # Step 3: Find Job Rows
-    table_body_selector = 'table.job-preview-inline-table tbody'
-    table_body = soup.select_one(table_body_selector)
-
-    if not table_body:
-        print(f"\n>>> ERROR: Could not find table body using selector: '{table_body_selector}'")
-        raise Exception("Table body not found, cannot proceed.") # Raise exception to trigger finally block
-
-    job_row_selector = 'tr[role="button"]'
-    job_rows = table_body.select(job_row_selector)
-    print(f"\nFound {len(job_rows)} potential job rows using selector '{job_row_selector}'.")
-
-    if not job_rows:
-        print("\n>>> Warning: No job rows found.")
+    if replay.replay:
+        # Re-parse archived pages; collected_at keeps the original fetch time
+        print(f"\nReplaying archived pages (since={replay.since}, until={replay.until})...")
+        pages = ((record['payload'], datetime.fromisoformat(record['fetched_at']))
+                 for record in raw_archive.iter_records('cryptojobslist', replay.since, replay.until))
     else:
-        print(f"\nProcessing {len(job_rows)} potential job rows...")
-
-    # Step 4: Loop through rows, extract data, and insert into DB
-    for row_index, row in enumerate(job_rows):
-        if row.has_attr('class') and 'notAJobAd' in row['class']:
-            continue # Skip ads
-
-        # Extract data using previously validated logic
-        title_element = row.select_one('a.job-title-text')
-        company_element = row.select_one('a.job-company-name-text')
-        link_element = title_element
-        tag_elements = row.select('td.job-tags span.category')
-
-        title = title_element.get_text(strip=True) if title_element else 'N/A'
-        company = company_element.get_text(strip=True) if company_element else 'N/A'
-        tags_list = [tag.get_text(strip=True) for tag in tag_elements] if tag_elements else []
-        relative_link = link_element['href'] if link_element and link_element.has_attr('href') else None
-        job_url = urljoin(BASE_URL, relative_link) if relative_link else 'N/A'
-
-        salary = 'N/A'
-        salary_span = row.select_one('td span.align-middle')
-        if salary_span:
-             parent_div = salary_span.find_parent('div')
-             if parent_div and parent_div.select_one('svg[stroke="currentColor"]'):
-                  salary = salary_span.get_text(strip=True)
-
-        location = 'N/A'
-        potential_loc_td = None
-        tags_td = row.select_one('td.job-tags')
-        location_tds = row.select('td')
-        if tags_td:
-            potential_loc_td = tags_td.find_previous_sibling('td')
-        elif len(location_tds) >= 5:
-            potential_loc_td = location_tds[4]
-        if potential_loc_td:
-             location_span = potential_loc_td.select_one('span.text-sm')
-             if location_span:
-                  raw_location_text = location_span.get_text(strip=True)
-                  if salary == 'N/A' or salary != raw_location_text:
-                       location = re.sub(r'^\s*📍\s*', '', raw_location_text).strip()
-        if location == 'N/A' and 'Remote' in tags_list:
-             location = 'Remote'
-        is_remote = location == 'Remote' or 'Remote' in tags_list
-
-
-        # Insert data into PostgreSQL
-        if title != 'N/A' and job_url != 'N/A':
-            sql_insert_query = """
-                INSERT INTO job_postings (
-                    title, company_name, location, salary_range, tags, source,
-                    job_url, is_remote, collected_at
-                    -- external_id, description could be added if scraped from detail page later
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-                ON CONFLICT (job_url) DO NOTHING;
-            """
-            # Get current timestamp for collected_at
-            collected_timestamp = datetime.utcnow()
-
-            data_to_insert = (
-                title, company, location, salary if salary != 'N/A' else None, tags_list, 'CryptoJobsList',
-                job_url, is_remote, collected_timestamp
-            )
-
-            try:
-                db_cursor.execute(sql_insert_query, data_to_insert)
-                if db_cursor.rowcount > 0:
-                    inserted_count += 1
-                else:
-                    skipped_count += 1 # Likely duplicate based on job_url
-            except Exception as insert_err:
-                print(f"  > DB insert error for job URL {job_url}: {insert_err}")
-                db_conn.rollback() # Rollback failed transaction
-                skipped_count += 1
+        # Step 1: Fetch HTML
+        print(f"\nAttempting to scrape: {target_url}")
+        def fetch_page():
+            rate_limits.acquire('cryptojobslist', max_wait=None)
+            with metrics.stage('http_fetch'):
+                page_response = requests.get(target_url, headers=headers, timeout=REQUEST_TIMEOUT)
+            rate_limits.observe('cryptojobslist', page_response.headers, page_response.status_code)
+            metrics.incr('bytes_fetched', len(page_response.content))
+            print(f"Request sent. Status Code: {page_response.status_code}")
+            page_response.raise_for_status()
+            return page_response
+
+        # Timeouts, connection errors and 5xx are retried with jittered backoff
+        response = resilience.retry_call(fetch_page, label='CryptoJobsList request')
+        print("Successfully fetched page.")
+        archive.append(response.text, kind='html', meta={'url': target_url, 'status': response.status_code})
+        pages = [(response.text, datetime.utcnow())]
+
+    for page_html, page_collected_at in pages:
+        # Step 2: Parse HTML
+        with metrics.stage('parse'):
+            soup = BeautifulSoup(page_html, 'lxml')
+
+        # Step 3: Find Job Rows
+        job_rows = documents.cryptojobslist_rows(soup)
+
+        if job_rows is None:
+            # Skip just this page - the others (when replaying) and the commit still go ahead
+            print(f"\n>>> ERROR: Could not find job rows (selector: '{documents.TABLE_BODY_SELECTOR}'), skipping page.")
+            metrics.incr('errors')
+            continue
+
+        metrics.incr('fetched', len(job_rows))
+        print(f"\nFound {len(job_rows)} potential job rows using selector '{documents.JOB_ROW_SELECTOR}'.")
+
+        if not job_rows:
+            print("\n>>> Warning: No job rows found.")
         else:
-            print(f"Skipping row - Missing title or URL. Title: {title}, URL: {job_url}")
-            skipped_count += 1
+            print(f"\nProcessing {len(job_rows)} potential job rows...")
+
+        # Step 4: Loop through rows, extract data, and insert into DB
+        for row_index, row in enumerate(job_rows):
+            # Extract data (see documents.py for the column mapping)
+            parse_start = time.perf_counter()
+            job = documents.cryptojobslist_job(row, page_collected_at)
+            metrics.add_time('parse', time.perf_counter() - parse_start)
+            if job is None:
+                continue # Skip ads
+            title = job['title']
+            job_url = job['job_url']
+
+            # Insert data into PostgreSQL
+            job_key = job_history.seen_key(job_url, job['content_hash'])
+            if not replay.replay and job_url != 'N/A':
+                listed_urls.add(job_url)
+            if seen.skip(job_key):
+                skipped_count += 1 # Stored unchanged by an earlier run - no database round trip
+                continue
+            if title != 'N/A' and job_url != 'N/A':
+                # external_id, description could be added if scraped from detail page later
+                # Known URLs are only rewritten if their content hash changed (see job_history.py)
+                sql_insert_query = job_history.upsert_sql(documents.CRYPTOJOBSLIST_COLUMNS)
+                data_to_insert = documents.job_values(job, documents.CRYPTOJOBSLIST_COLUMNS)
+                if db_conn is None:
+                    spool_jobs([job])
+                    continue
+
+                try:
+                    with metrics.stage('db_write'):
+                        # A bad row rolls back to here, not the whole run's transaction
+                        db_cursor.execute("SAVEPOINT job_row;")
+                        db_cursor.execute(sql_insert_query, data_to_insert)
+                        upserted = db_cursor.fetchone() # (job_url, inserted), or None if stored unchanged
+                        db_cursor.execute("RELEASE SAVEPOINT job_row;")
+                    if upserted is None:
+                        skipped_count += 1 # Duplicate based on job_url, same content
+                        unchanged.append(job_key)
+                    elif upserted[1]:
+                        inserted_count += 1
+                        uncommitted.append(job)
+                        job_rollup.add(page_collected_at.date(), 'CryptoJobsList', job['company_name'], job['tags'], job['is_remote'])
+                    else:
+                        updated_count += 1
+                        updated_jobs.append(job)
+                except Exception as insert_err:
+                    if spool.is_connection_error(insert_err):
+                        # Lost the database mid-run: spool this transaction's rows and everything after
+                        print(f"  > Database connection lost ({insert_err}) - spooling the rest of this run.")
+                        spool_jobs(uncommitted + updated_jobs + [job])
+                        inserted_count -= len(uncommitted)
+                        updated_count -= len(updated_jobs)
+                        uncommitted = []
+                        updated_jobs = []
+                        unchanged = []
+                        job_rollup.reset()
+                        db_conn.close()
+                        db_conn = db_cursor = None
+                        continue
+                    print(f"  > DB insert error for job URL {job_url}: {insert_err}")
+                    db_cursor.execute("ROLLBACK TO SAVEPOINT job_row;") # Only this job is lost
+                    skipped_count += 1
+                    metrics.incr('errors')
+            else:
+                print(f"Skipping row - Missing title or URL. Title: {title}, URL: {job_url}")
+                skipped_count += 1
 
     # Commit all successful insertions after the loop
-    if inserted_count > 0:
-        print(f"\nAttempting to commit {inserted_count} insertions...")
-        db_conn.commit()
-        print("Database commit successful.")
+    if db_conn is not None:
+        if inserted_count or updated_count:
+            print(f"\nAttempting to commit {inserted_count} insertions and {updated_count} updates...")
+        else:
+            print("\nNo new jobs were inserted (they might be duplicates or had errors).")
+        try:
+            with metrics.stage('db_write'):
+                job_rollup.flush(db_cursor) # Same transaction as the inserts
+                if inserted_count or updated_count:
+                    ingest_version.bump_postgres(db_cursor, 'cryptojobslist')
+                retention.mark_listed(db_cursor, listed_urls)
+                db_conn.commit()
+            print("Database commit successful.")
+            seen.mark([job_history.seen_key(pending_job['job_url'], pending_job['content_hash'])
+                       for pending_job in uncommitted + updated_jobs] + unchanged)
+        except Exception as commit_err:
+            if not spool.is_connection_error(commit_err):
+                raise
+            print(f"\n>>> Database connection lost before commit ({commit_err}) - spooling {len(uncommitted) + len(updated_jobs)} rows.")
+            spool_jobs(uncommitted + updated_jobs)
+            inserted_count -= len(uncommitted)
+            updated_count -= len(updated_jobs)
+    elif job_spool.records_written:
+        print(f"\nDatabase unreachable - {job_spool.records_written} rows spooled for spool.py to write.")
     else:
         print("\nNo new jobs were inserted (they might be duplicates or had errors).")
 
@@ -189,10 +251,23 @@ except Exception as proc_err:
 finally:
     print("\n--- Final Summary ---")
     print(f"Jobs Inserted: {inserted_count}")
+    print(f"Jobs Updated (content changed): {updated_count}")
     print(f"Jobs Skipped (Duplicate/Error/Incomplete): {skipped_count}")
+    if job_spool.records_written:
+        print(f"Jobs Spooled (database unreachable): {job_spool.records_written}")
     if api_error:
          print(">>> There was an error fetching or processing data from the website.")
+         metrics.incr('errors')
+    metrics.incr('inserted', inserted_count)
+    metrics.incr('updated', updated_count)
+    metrics.incr('skipped', skipped_count)
+    metrics.incr('spooled', job_spool.records_written)
+    metrics.incr('filtered', seen.dropped)
+    metrics.write()
 
+    archive.close()
+    job_spool.close()
+    seen.save()
     print("Closing database connection...")
     if db_cursor: db_cursor.close()
     if db_conn: db_conn.close()
@@ -0,0 +1,195 @@
+# ----- search_index.py -----
+# Full-text search over job descriptions (PostgreSQL) and social posts (MongoDB).
+#
+# job_postings gets a stored, generated `search_tsv` column (title > company >
+# description weights) with a GIN index; social_media_posts gets a weighted
+# text index on title + text. Results are ranked (ts_rank_cd / textScore) and
+# paginated with keyset cursors on (rank, unique key), so page N costs the
+# same as page 1 instead of an ever-growing OFFSET.
+#
+# Usage:
+#   python search_index.py ensure                                # create column + indexes (idempotent)
+#   python search_index.py query "solidity auditor" [--in jobs|posts|all] [--limit 20] [--cursor ...]
+import argparse
+import base64
+import json
+import os
+import sys
+
+TEXT_SEARCH_CONFIG = 'english'
+POSTS_TEXT_INDEX = 'posts_text_search'
+# MongoDB reads a document's `language` field as its text-search language by default,
+# and tweets carry Twitter's codes there ('und', 'qme', 'ja', ...), which it rejects.
+# Point the override at a field no document has so every post uses the default.
+POSTS_LANGUAGE_OVERRIDE = 'text_language'
+
+ENSURE_JOBS_SQL = f"""
+    ALTER TABLE job_postings ADD COLUMN IF NOT EXISTS search_tsv tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(company_name, '')), 'B') ||
+            setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce(description, '')), 'C')
+        ) STORED;
+    CREATE INDEX IF NOT EXISTS idx_job_postings_search_tsv ON job_postings USING GIN (search_tsv);
+"""
+
+# rank is cast to float8 so the value handed back in the cursor compares exactly
+SEARCH_JOBS_SQL = f"""
+    SELECT title, company_name, location, source, job_url, collected_at, rank
+    FROM (
+        SELECT title, company_name, location, source, job_url, collected_at,
+               ts_rank_cd(search_tsv, q)::float8 AS rank
+        FROM job_postings, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %(query)s) AS q
+        WHERE search_tsv @@ q
+    ) ranked
+    WHERE %(after_rank)s::float8 IS NULL OR (rank, job_url) < (%(after_rank)s::float8, %(after_key)s)
+    ORDER BY rank DESC, job_url DESC
+    LIMIT %(limit)s;
+"""
+
+
+def encode_cursor(rank, key):
+    return base64.urlsafe_b64encode(json.dumps([rank, key]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None, None
+    rank, key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return rank, key
+
+
+# --- Index management ---
+def ensure_jobs_index(db_cursor):
+    # Adding a STORED generated column rewrites the table once; afterwards this is a no-op
+    db_cursor.execute(ENSURE_JOBS_SQL)
+
+
+def ensure_posts_index(db):
+    posts = db['social_media_posts']
+    existing = posts.index_information().get(POSTS_TEXT_INDEX)
+    if existing and existing.get('language_override', 'language') != POSTS_LANGUAGE_OVERRIDE:
+        # Built before the override was set; same name, different options, so drop and rebuild
+        posts.drop_index(POSTS_TEXT_INDEX)
+    posts.create_index(
+        [('title', 'text'), ('text', 'text')],
+        weights={'title': 3, 'text': 1},
+        default_language=TEXT_SEARCH_CONFIG,
+        language_override=POSTS_LANGUAGE_OVERRIDE,
+        name=POSTS_TEXT_INDEX,
+    )
+
+
+# --- Queries ---
+def search_jobs(db_cursor, query, limit=20, cursor=None):
+    """One page of ranked job matches. Returns {'results': [...], 'next_cursor': str|None}."""
+    after_rank, after_key = decode_cursor(cursor)
+    db_cursor.execute(SEARCH_JOBS_SQL, {
+        'query': query, 'limit': limit, 'after_rank': after_rank, 'after_key': after_key,
+    })
+    columns = [c[0] for c in db_cursor.description]
+    results = [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+    next_cursor = None
+    if len(results) == limit:
+        last = results[-1]
+        next_cursor = encode_cursor(last['rank'], last['job_url'])
+    return {'results': results, 'next_cursor': next_cursor}
+
+
+def search_posts(db, query, limit=20, cursor=None, source=None):
+    """One page of ranked social post matches. Returns {'results': [...], 'next_cursor': str|None}."""
+    from bson import ObjectId
+    after_score, after_id = decode_cursor(cursor)
+    match = {'$text': {'$search': query}}
+    if source:
+        match['source'] = source
+    pipeline = [
+        {'$match': match},
+        # Named search_score because Reddit documents already carry a 'score' field
+        {'$addFields': {'search_score': {'$meta': 'textScore'}}},
+    ]
+    if after_score is not None:
+        after_id = ObjectId(after_id)
+        pipeline.append({'$match': {'$or': [
+            {'search_score': {'$lt': after_score}},
+            {'search_score': after_score, '_id': {'$lt': after_id}},
+        ]}})
+    pipeline += [
+        {'$sort': {'search_score': -1, '_id': -1}},
+        {'$limit': limit},
+        {'$project': {'source': 1, 'source_specific_id': 1, 'title': 1, 'text': 1, 'url': 1,
+                      'subreddit': 1, 'created_at': 1, 'created_utc': 1, 'search_score': 1}},
+    ]
+    results = list(db['social_media_posts'].aggregate(pipeline))
+    next_cursor = None
+    if len(results) == limit:
+        last = results[-1]
+        next_cursor = encode_cursor(last['search_score'], str(last['_id']))
+    for doc in results:
+        doc['_id'] = str(doc['_id'])
+    return {'results': results, 'next_cursor': next_cursor}
+
+
+def search(query, where='all', limit=20, jobs_cursor=None, posts_cursor=None, db_cursor=None, db=None):
+    """Unified entry point. Rankers differ per store, so each source keeps its own list and cursor."""
+    response = {}
+    if where in ('all', 'jobs') and db_cursor is not None:
+        response['jobs'] = search_jobs(db_cursor, query, limit, jobs_cursor)
+    if where in ('all', 'posts') and db is not None:
+        response['posts'] = search_posts(db, query, limit, posts_cursor)
+    return response
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Full-text search over jobs and social posts.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('ensure', help='Create the tsvector column, GIN index and Mongo text index')
+    query_parser = sub.add_parser('query', help='Run a ranked search')
+    query_parser.add_argument('query')
+    query_parser.add_argument('--in', dest='where', choices=['all', 'jobs', 'posts'], default='all')
+    query_parser.add_argument('--limit', type=int, default=20)
+    query_parser.add_argument('--cursor', help='next_cursor from the previous page (single source only)')
+    args = parser.parse_args(argv)
+
+    db_conn = mongo_client = None
+    try:
+        db_cursor = db = None
+        if args.command == 'ensure' or args.where in ('all', 'jobs'):
+            import psycopg2
+            db_conn = psycopg2.connect(os.environ['POSTGRES_URI'])
+            db_cursor = db_conn.cursor()
+        if args.command == 'ensure' or args.where in ('all', 'posts'):
+            from pymongo import MongoClient
+            mongo_client = MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=5000)
+            db = mongo_client['web3_data']
+
+        if args.command == 'ensure':
+            print("Ensuring job_postings.search_tsv and GIN index...")
+            ensure_jobs_index(db_cursor)
+            db_conn.commit()
+            print("Ensuring social_media_posts text index...")
+            ensure_posts_index(db)
+            print("Search indexes ready.")
+            return 0
+
+        response = search(args.query, args.where, args.limit,
+                          jobs_cursor=args.cursor if args.where == 'jobs' else None,
+                          posts_cursor=args.cursor if args.where == 'posts' else None,
+                          db_cursor=db_cursor, db=db)
+        for name, page in response.items():
+            print(f"\n--- {name} ({len(page['results'])} results) ---")
+            for row in page['results']:
+                rank = row.get('rank', row.get('search_score'))
+                label = row.get('title') or (row.get('text') or '')[:80].replace('\n', ' ')
+                print(f"  {rank:.4f}  {label}  {row.get('job_url') or row.get('url') or ''}")
+            if page['next_cursor']:
+                print(f"  next page: --in {name} --cursor {page['next_cursor']}")
+        return 0
+    finally:
+        if db_conn: db_conn.close()
+        if mongo_client: mongo_client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+# ----- seen_filter.py -----
+# Per-source Bloom filter of the IDs already stored (job_url + content hash
+# for the job boards, so an edited posting still reaches the database - see
+# job_history.py; source_specific_id for Reddit and Twitter), kept on disk in
+# collector_state/seen/<source>.bloom. In steady state most fetched items are
+# ones we already have; the collectors drop those locally and only send the
+# rest to the database, instead of paying a round trip (find_one, a
+# duplicate-key error, ON CONFLICT) to learn the same thing.
+#
+# The filter only ever contains IDs the database confirmed: an item is added
+# after its write succeeded, whether it was new or a duplicate. Spooled items
+# are not added. A missing or lost filter therefore only costs database work.
+# A Bloom filter can answer "seen" for an ID it never saw: at the default
+# ERROR_RATE about one new item in a million is dropped. Bit positions depend
+# on the filter size, so the next rebuild at a new size re-rolls them.
+#
+# Once a filter holds more IDs than it was sized for its error rate climbs, so
+# it stops being used until `rebuild` re-sizes it from the database.
+# run_all_tasks.py runs `rebuild --if-needed` before the collectors.
+#
+# Usage:
+#   python seen_filter.py status
+#   python seen_filter.py rebuild [--source reddit] [--if-needed]
+import argparse
+import hashlib
+import math
+import os
+import struct
+import sys
+
+import documents
+import job_history
+import resilience
+
+SEEN_DIR = os.path.join(resilience.STATE_DIR, 'seen')
+ERROR_RATE = 1e-6
+MIN_CAPACITY = 100_000
+GROWTH = 2 # Rebuilds size the filter for this many times the current row count
+HEADER = struct.Struct('>4sQIQQ') # magic, bits, hashes, capacity, count
+MAGIC = b'BLM1'
+
+# Where each source's IDs live, for rebuilds: (store, job_postings.source or posts source)
+SOURCE_KEYS = {
+    'web3career': ('postgres', documents.WEB3CAREER_SOURCE),
+    'cryptojobslist': ('postgres', documents.CRYPTOJOBSLIST_SOURCE),
+    'reddit': ('mongo', 'reddit'),
+    'twitter': ('mongo', 'twitter'),
+}
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=ERROR_RATE, bits=None, hashes=None, count=0, data=None):
+        self.capacity = capacity
+        self.bits = bits or max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.bits / capacity * math.log(2)))
+        self.count = count
+        self.data = data if data is not None else bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing (Kirsch-Mitzenmacher): k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('>QQ', digest)
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        added = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.data[byte] & (1 << bit):
+                self.data[byte] |= 1 << bit
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, key):
+        return all(self.data[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+    @property
+    def full(self):
+        return self.count > self.capacity
+
+    def to_bytes(self):
+        return HEADER.pack(MAGIC, self.bits, self.hashes, self.capacity, self.count) + bytes(self.data)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        magic, bits, hashes, capacity, count = HEADER.unpack_from(blob)
+        data = bytearray(blob[HEADER.size:])
+        if magic != MAGIC or len(data) != (bits + 7) // 8:
+            raise ValueError("not a Bloom filter file")
+        return cls(capacity, bits=bits, hashes=hashes, count=count, data=data)
+
+
+def filter_path(source, directory=None):
+    return os.path.join(directory or SEEN_DIR, f"{source}.bloom")
+
+
+def load(source, directory=None):
+    """The source's filter, or None if there is none (or it can't be read)."""
+    try:
+        with open(filter_path(source, directory), 'rb') as f:
+            return BloomFilter.from_bytes(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error) as load_err:
+        print(f">>> Warning: Ignoring unreadable seen-filter for {source}: {load_err}")
+        return None
+
+
+def save(source, bloom, directory=None):
+    # Never let bookkeeping break a collection run - a lost update only means more database work
+    path = filter_path(source, directory)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.{os.getpid()}.tmp", 'wb') as f:
+            f.write(bloom.to_bytes())
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+    except Exception as save_err:
+        print(f">>> Warning: Could not save seen-filter for {source}: {save_err}")
+
+
+class SeenFilter:
+    """What a collector uses: drop known IDs before writing, mark IDs once the database has them."""
+
+    def __init__(self, source, directory=None):
+        self.source = source
+        self.directory = directory
+        self.bloom = load(source, directory)
+        if self.bloom is not None and self.bloom.full:
+            print(f">>> Warning: seen-filter for {source} is over capacity - not used until "
+                  f"`python seen_filter.py rebuild` re-sizes it.")
+            self.bloom = None
+        self.dirty = False
+        self.dropped = 0
+
+    @property
+    def active(self):
+        return self.bloom is not None
+
+    def drop_seen(self, items, key):
+        """The items whose key(item) is not in the filter (all of them if there is no filter)."""
+        if self.bloom is None:
+            return list(items)
+        fresh = [item for item in items if key(item) not in self.bloom]
+        self.dropped += len(items) - len(fresh)
+        return fresh
+
+    def __contains__(self, item_key):
+        return self.bloom is not None and item_key in self.bloom
+
+    def skip(self, item_key):
+        """drop_seen for a single item: True (and counted as dropped) if the key is in the filter."""
+        if item_key in self:
+            self.dropped += 1
+            return True
+        return False
+
+    def mark(self, keys):
+        if self.bloom is None:
+            return
+        for item_key in keys:
+            if item_key and self.bloom.add(item_key):
+                self.dirty = True
+
+    def save(self):
+        if self.dirty:
+            save(self.source, self.bloom, self.directory)
+            self.dirty = False
+
+
+# --- Rebuild from the databases ---
+def iter_postgres_keys(db_conn, job_source):
+    # Named cursor: streamed from the server, not loaded into memory at once
+    with db_conn.cursor(name='seen_filter_rebuild') as db_cursor:
+        db_cursor.itersize = 10000
+        db_cursor.execute("SELECT job_url, content_hash FROM job_postings WHERE source = %s;", (job_source,))
+        for job_url, job_hash in db_cursor:
+            yield job_history.seen_key(job_url, job_hash)
+
+
+def iter_mongo_keys(db, post_source):
+    cursor = db['social_media_posts'].find({'source': post_source}, {'_id': 0, 'source_specific_id': 1}).batch_size(10000)
+    for doc in cursor:
+        yield doc.get('source_specific_id')
+
+
+def count_keys(store, handle, source_value):
+    if store == 'postgres':
+        with handle.cursor() as db_cursor:
+            db_cursor.execute("SELECT count(*) FROM job_postings WHERE source = %s;", (source_value,))
+            return db_cursor.fetchone()[0]
+    return handle['social_media_posts'].count_documents({'source': source_value})
+
+
+def rebuild(source, handle, directory=None):
+    """Re-create a source's filter from every ID in its database. Returns the number of IDs."""
+    store, source_value = SOURCE_KEYS[source]
+    rows = count_keys(store, handle, source_value)
+    bloom = BloomFilter(max(MIN_CAPACITY, rows * GROWTH))
+    keys = iter_postgres_keys(handle, source_value) if store == 'postgres' else iter_mongo_keys(handle, source_value)
+    for item_key in keys:
+        if item_key:
+            bloom.add(item_key)
+    save(source, bloom, directory)
+    return rows
+
+
+def needs_rebuild(source, directory=None):
+    bloom = load(source, directory)
+    return bloom is None or bloom.full
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or rebuild the per-source seen-ID Bloom filters.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help='Show each filter\'s size and fill')
+    rebuild_parser = sub.add_parser('rebuild', help='Rebuild filters from the databases')
+    rebuild_parser.add_argument('--source', choices=list(SOURCE_KEYS), action='append',
+                                help='Only this source (can be repeated; default: all)')
+    rebuild_parser.add_argument('--if-needed', action='store_true',
+                                help='Only sources whose filter is missing or over capacity')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        for source in SOURCE_KEYS:
+            bloom = load(source)
+            if bloom is None:
+                print(f"{source:<15} no filter")
+                continue
+            note = ' - OVER CAPACITY, rebuild' if bloom.full else ''
+            print(f"{source:<15} {bloom.count:>9} / {bloom.capacity} IDs, {len(bloom.data) / 1024:.0f} KiB, "
+                  f"{bloom.hashes} hashes{note}")
+        return 0
+
+    sources = [s for s in args.source or list(SOURCE_KEYS) if not args.if_needed or needs_rebuild(s)]
+    if not sources:
+        print("All seen-filters are usable - nothing to rebuild.")
+        return 0
+    db_conn = mongo_client = None
+    failed = False
+    try:
+        for source in sources:
+            store, _ = SOURCE_KEYS[source]
+            try:
+                if store == 'postgres':
+                    if db_conn is None:
+                        import psycopg2
+                        db_conn = psycopg2.connect(os.environ['POSTGRES_URI'], connect_timeout=10)
+                    handle = db_conn
+                else:
+                    if mongo_client is None:
+                        from pymongo import MongoClient
+                        mongo_client = MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=10000)
+                    handle = mongo_client['web3_data']
+                print(f"Rebuilt seen-filter for {source} from {rebuild(source, handle)} stored IDs.")
+            except KeyError as missing:
+                print(f">>> Error: {missing.args[0]} secret not found - cannot rebuild {source}.")
+                failed = True
+            except Exception as rebuild_err:
+                # Collectors just go to the database for every item until the next rebuild
+                print(f">>> Error: Could not rebuild seen-filter for {source}: {rebuild_err}")
+                failed = True
+    finally:
+        if db_conn: db_conn.close()
+        if mongo_client: mongo_client.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
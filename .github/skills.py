@@ -0,0 +1,284 @@
+# ----- skills.py -----
+# Skill / technology extraction (Solidity, Rust, Move, ZK, Foundry...) from
+# job titles, descriptions and tags and from Reddit / Twitter text.
+#
+# The vocabulary is skills.json (or the file named by SKILLS_FILE): one entry
+# per canonical skill with its category and aliases. "aliases" match in any
+# case; "exact" aliases only match as written, for names that are also common
+# words ("Sui", "NEAR", "React"). Adding a skill is a vocabulary edit.
+#
+# All aliases are compiled once per process into one Aho-Corasick automaton,
+# so a document is scanned in a single pass whatever the vocabulary size - a
+# regex per keyword would rescan the text once per term. A match counts only
+# on word boundaries, so "go" does not fire inside "good" nor "sql" inside
+# "postgresql".
+#
+# documents.py extracts at ingest (job_postings.skills TEXT[], GIN indexed;
+# social_media_posts.skills, multikey indexed). `backfill` fills rows stored
+# before the column existed, or - with --all - re-extracts everything after a
+# vocabulary change.
+#
+# Usage:
+#   python skills.py extract "Senior Solidity engineer, Foundry + zk-SNARKs"
+#   python skills.py backfill [--only postgres|mongo] [--all]
+#   python skills.py demand [--days 30] [--top 25] [--in jobs|posts] [--category language]
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+VOCABULARY_PATH = os.environ.get('SKILLS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'skills.json'))
+BACKFILL_BATCH = 1000
+
+ENSURE_JOBS_SQL = """
+    ALTER TABLE job_postings ADD COLUMN IF NOT EXISTS skills TEXT[];
+    -- skill filters: skills @> ARRAY['Solidity']
+    CREATE INDEX IF NOT EXISTS idx_job_postings_skills ON job_postings USING GIN (skills);
+"""
+
+JOB_SKILL_DEMAND_SQL = """
+    SELECT skill, count(*) AS postings, count(*) FILTER (WHERE is_remote) AS remote_postings
+    FROM job_postings, unnest(skills) AS skill
+    WHERE collected_at >= %(since)s AND (%(names)s::text[] IS NULL OR skill = ANY(%(names)s::text[]))
+    GROUP BY skill
+    ORDER BY postings DESC, skill
+    LIMIT %(top)s;
+"""
+
+
+def load_vocabulary(path=None):
+    """{canonical: {'category', 'aliases', 'exact'}}. Raises ValueError if malformed."""
+    path = path or VOCABULARY_PATH
+    with open(path) as f:
+        entries = json.load(f).get('skills', {})
+    vocabulary = {}
+    for canonical, entry in entries.items():
+        aliases = [a for a in entry.get('aliases', []) if isinstance(a, str) and a.strip()]
+        exact = [a for a in entry.get('exact', []) if isinstance(a, str) and a.strip()]
+        if not aliases and not exact:
+            raise ValueError(f"{path}: skill '{canonical}' has no aliases")
+        vocabulary[canonical] = {'category': entry.get('category'), 'aliases': aliases, 'exact': exact}
+    return vocabulary
+
+
+class SkillMatcher:
+    """Aho-Corasick automaton over every alias (lower-cased); find() returns the canonical skills in a text."""
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        self.goto = [{}] # state -> {char: next state}
+        self.fail = [0]
+        self.out = [()] # state -> ((length, canonical, exact alias or None, left boundary, right boundary), ...)
+        for canonical, entry in vocabulary.items():
+            for alias in entry['aliases']:
+                self._add(alias.strip(), canonical, None)
+            for alias in entry['exact']:
+                self._add(alias.strip(), canonical, alias.strip())
+        self._link()
+
+    def _add(self, alias, canonical, exact):
+        state = 0
+        for char in alias.lower():
+            if char not in self.goto[state]:
+                self.goto[state][char] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state = self.goto[state][char]
+        # Boundaries only matter next to letters/digits: "c++" may be followed by anything
+        self.out[state] += ((len(alias), canonical, exact, alias[0].isalnum(), alias[-1].isalnum()),)
+
+    def _link(self):
+        # Breadth-first: a state's failure link points at its longest proper suffix in the trie,
+        # and it inherits that state's matches
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child] += self.out[self.fail[child]]
+                queue.append(child)
+
+    def find(self, text):
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # A few characters lower-case to two ('İ'); keep positions aligned with the original
+            lowered = ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        state = 0
+        for end, char in enumerate(lowered):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not out[state]:
+                continue
+            for length, canonical, exact, left, right in out[state]:
+                if canonical in found:
+                    continue
+                start = end - length + 1
+                if left and start > 0 and lowered[start - 1].isalnum():
+                    continue
+                if right and end + 1 < len(lowered) and lowered[end + 1].isalnum():
+                    continue
+                if exact is not None and text[start:end + 1] != exact:
+                    continue
+                found.add(canonical)
+        return found
+
+
+_matcher = None
+
+
+def matcher():
+    """The process-wide automaton, compiled on first use."""
+    global _matcher
+    if _matcher is None:
+        _matcher = SkillMatcher(load_vocabulary())
+    return _matcher
+
+
+def extract(*texts):
+    """Sorted canonical skills mentioned in any of the texts (None and non-strings are ignored)."""
+    text = '\n'.join(t for t in texts if isinstance(t, str) and t) # One scan for all fields
+    return sorted(matcher().find(text)) if text else []
+
+
+def names_in(category):
+    return [name for name, entry in matcher().vocabulary.items() if entry['category'] == category]
+
+
+# --- Indexes ---
+def ensure_posts_index(db):
+    # Posts mentioning a skill, newest first; multikey over the skills array
+    db['social_media_posts'].create_index([('skills', 1), ('collected_at', -1)])
+
+
+# --- Backfill ---
+def backfill_jobs(db_conn, everything=False, batch_size=BACKFILL_BATCH):
+    """Extract skills for job rows without them (every row with everything=True). Returns rows updated."""
+    from psycopg2.extras import execute_values
+    updated = 0
+    last_id = 0
+    while True:
+        with db_conn.cursor() as db_cursor:
+            # Keyset over id: each batch is an index range scan, and rows just written aren't revisited
+            db_cursor.execute(f"""
+                SELECT id, title, description, tags FROM job_postings
+                WHERE id > %s {'' if everything else 'AND skills IS NULL'}
+                ORDER BY id LIMIT %s;
+            """, (last_id, batch_size))
+            rows = db_cursor.fetchall()
+            if not rows:
+                return updated
+            values = [(job_id, extract(title, description, *(tags or []))) for job_id, title, description, tags in rows]
+            execute_values(db_cursor, """
+                UPDATE job_postings AS j SET skills = v.skills
+                FROM (VALUES %s) AS v (id, skills) WHERE j.id = v.id;
+            """, values, template='(%s, %s::text[])')
+        db_conn.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+        print(f"  job_postings: {updated} rows extracted...")
+
+
+def backfill_posts(db, everything=False, batch_size=BACKFILL_BATCH):
+    """Same for social_media_posts, in _id order. Returns documents updated."""
+    from pymongo import UpdateOne
+    posts = db['social_media_posts']
+    query = {} if everything else {'skills': {'$exists': False}}
+    updated = 0
+    last_id = None
+    while True:
+        batch_query = dict(query, _id={'$gt': last_id}) if last_id is not None else query
+        docs = list(posts.find(batch_query, {'title': 1, 'text': 1}).sort('_id', 1).limit(batch_size))
+        if not docs:
+            return updated
+        posts.bulk_write([UpdateOne({'_id': doc['_id']}, {'$set': {'skills': extract(doc.get('title'), doc.get('text'))}})
+                          for doc in docs], ordered=False)
+        updated += len(docs)
+        last_id = docs[-1]['_id']
+        print(f"  social_media_posts: {updated} documents extracted...")
+
+
+# --- Queries ---
+def job_skill_demand(db_cursor, days=30, top=25, category=None):
+    db_cursor.execute(JOB_SKILL_DEMAND_SQL, {
+        'since': datetime.utcnow() - timedelta(days=days), 'top': top,
+        'names': names_in(category) if category else None,
+    })
+    return db_cursor.fetchall()
+
+
+def post_skill_demand(db, days=30, top=25, category=None, source=None):
+    match = {'collected_at': {'$gte': datetime.utcnow() - timedelta(days=days)}}
+    if source:
+        match['source'] = source
+    pipeline = [{'$match': match}, {'$unwind': '$skills'}]
+    if category:
+        pipeline.append({'$match': {'skills': {'$in': names_in(category)}}})
+    pipeline += [
+        {'$group': {'_id': '$skills', 'mentions': {'$sum': 1}}},
+        {'$sort': {'mentions': -1, '_id': 1}},
+        {'$limit': top},
+    ]
+    return [(row['_id'], row['mentions']) for row in db['social_media_posts'].aggregate(pipeline)]
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract skills from jobs and posts, and query skill demand.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    extract_parser = sub.add_parser('extract', help='Print the skills found in a text')
+    extract_parser.add_argument('text')
+    backfill = sub.add_parser('backfill', help='Extract skills for stored rows that have none')
+    backfill.add_argument('--only', choices=['postgres', 'mongo'])
+    backfill.add_argument('--all', dest='everything', action='store_true',
+                          help='Re-extract every row (after a vocabulary change)')
+    demand = sub.add_parser('demand', help='Most-mentioned skills')
+    demand.add_argument('--days', type=int, default=30)
+    demand.add_argument('--top', type=int, default=25)
+    demand.add_argument('--in', dest='where', choices=['all', 'jobs', 'posts'], default='all')
+    demand.add_argument('--category', help='Only skills of this vocabulary category (language, chain, ...)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'extract':
+        print(', '.join(extract(args.text)) or '(no skills found)')
+        return 0
+
+    use_postgres = args.only != 'mongo' if args.command == 'backfill' else args.where != 'posts'
+    use_mongo = args.only != 'postgres' if args.command == 'backfill' else args.where != 'jobs'
+    if use_postgres:
+        import psycopg2
+        db_conn = psycopg2.connect(os.environ['POSTGRES_URI'])
+        try:
+            if args.command == 'backfill':
+                print(f"Extracted skills for {backfill_jobs(db_conn, args.everything)} job postings.")
+            else:
+                print(f"--- Job postings, last {args.days} days ---")
+                with db_conn.cursor() as cur:
+                    for skill, postings, remote in job_skill_demand(cur, args.days, args.top, args.category):
+                        print(f"{skill:<25} {postings:>6} postings ({remote} remote)")
+        finally:
+            db_conn.close()
+    if use_mongo:
+        from pymongo import MongoClient
+        mongo_client = MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=5000)
+        try:
+            db = mongo_client['web3_data']
+            if args.command == 'backfill':
+                print(f"Extracted skills for {backfill_posts(db, args.everything)} social posts.")
+            else:
+                print(f"--- Social posts, last {args.days} days ---")
+                for skill, mentions in post_skill_demand(db, args.days, args.top, args.category):
+                    print(f"{skill:<25} {mentions:>6} posts")
+        finally:
+            mongo_client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# ----- source_registry.py -----
+# The source registry: every job board listing, subreddit, Reddit search and
+# Twitter query the collectors fetch is one work unit in sources.json
+# (or the file named by SOURCES_FILE). Adding a query is a registry edit, not
+# a code change.
+#
+# Sharding: `--shard i/N` (or COLLECTOR_SHARD=i/N) gives this runner the i-th of
+# N deterministic slices of the units, so N runners - e.g. a GitHub Actions
+# matrix - each collect a different part. Units are ordered by a hash of their
+# key and dealt out round-robin, so every runner computes the same split, the
+# slices differ in size by at most one unit, and units of one source spread
+# over all runners. Every collector (sync scripts, async_collector.py,
+# collector_daemon.py) selects its units through units_for().
+#
+# Usage:
+#   python source_registry.py list                   # every unit
+#   python source_registry.py list --shards 4        # ... and which of 4 runners gets it
+#   python source_registry.py list --shard 2/4       # just the units of runner 2 of 4
+import argparse
+import json
+import os
+import sys
+import zlib
+
+REGISTRY_PATH = os.environ.get('SOURCES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sources.json'))
+SHARD_ENV = 'COLLECTOR_SHARD'
+
+# source: methods its collectors know how to fetch
+SOURCE_METHODS = {
+    'web3career': ('api',),
+    'cryptojobslist': ('listing',),
+    'reddit': ('subreddit_new', 'search'),
+    'twitter': ('search_recent',),
+}
+
+
+def unit_key(unit):
+    return f"{unit['source']}:{unit['method']}:{unit['query']}"
+
+
+def load_units(path=None):
+    """Every unit in the registry with its source defaults applied and 'key' set. Raises ValueError if malformed."""
+    path = path or REGISTRY_PATH
+    with open(path) as f:
+        registry = json.load(f)
+    defaults = registry.get('defaults', {})
+    units = []
+    seen = set()
+    for position, entry in enumerate(registry.get('units', [])):
+        missing = [field for field in ('source', 'method', 'query') if not entry.get(field)]
+        if missing:
+            raise ValueError(f"{path}: unit #{position + 1} is missing {', '.join(missing)}")
+        if entry['method'] not in SOURCE_METHODS.get(entry['source'], ()):
+            raise ValueError(f"{path}: unit #{position + 1} has unknown source/method {entry['source']}/{entry['method']}")
+        unit = {**defaults.get(entry['source'], {}), **entry}
+        unit['key'] = unit_key(unit)
+        if unit['key'] in seen:
+            raise ValueError(f"{path}: duplicate unit {unit['key']}")
+        seen.add(unit['key'])
+        units.append(unit)
+    return units
+
+
+def parse_shard(text):
+    """'i/N' (1-based) -> (i, N)."""
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like i/N, got '{text}'")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {text}: need 1 <= i <= N")
+    return index, count
+
+
+def shard_option(argv=None):
+    """The --shard flag (unknown args are left for the script), else COLLECTOR_SHARD, else None (everything)."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--shard', type=parse_shard, default=None)
+    options, _ = parser.parse_known_args(argv)
+    if options.shard is None and os.environ.get(SHARD_ENV):
+        return parse_shard(os.environ[SHARD_ENV])
+    return options.shard
+
+
+def shard_of(units, shard):
+    """The units that belong to shard (i, N), in their original order. None means no sharding."""
+    if shard is None:
+        return list(units)
+    index, count = shard
+    # crc32 rather than hash(): str hashes are salted per process, so runners would disagree
+    ordered = sorted(units, key=lambda unit: (zlib.crc32(unit['key'].encode('utf-8')), unit['key']))
+    selected = {unit['key'] for position, unit in enumerate(ordered) if position % count == index - 1}
+    return [unit for unit in units if unit['key'] in selected]
+
+
+def units_for(source, shard=None, method=None):
+    """This runner's units of one source (optionally one method), in registry order."""
+    # Shard over the whole registry, not per source, so every collector agrees on the split
+    return [unit for unit in shard_of(load_units(), shard)
+            if unit['source'] == source and (method is None or unit['method'] == method)]
+
+
+def describe(shard):
+    return f"shard {shard[0]}/{shard[1]}" if shard else "all units"
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the source registry and its shard assignment.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    list_parser = sub.add_parser('list', help='Show the work units (of one shard)')
+    list_parser.add_argument('--shard', type=parse_shard, help='Only the units of runner i of N')
+    list_parser.add_argument('--shards', type=int, default=None,
+                             help='Show which of this many shards each unit lands in')
+    args = parser.parse_args(argv)
+
+    try:
+        all_units = load_units()
+    except (OSError, ValueError) as registry_err:
+        print(f">>> Error: Could not load source registry: {registry_err}")
+        return 1
+    units = shard_of(all_units, args.shard)
+    assignment = {}
+    if args.shards:
+        for index in range(1, args.shards + 1):
+            assignment.update({unit['key']: index for unit in shard_of(all_units, (index, args.shards))})
+    print(f"{len(units)} units ({describe(args.shard)}):")
+    for unit in units:
+        shard_note = f"[{assignment[unit['key']]}/{args.shards}] " if assignment else ''
+        print(f"  {shard_note}{unit['key']}" + (f" (limit {unit['limit']})" if 'limit' in unit else ''))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
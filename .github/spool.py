@@ -0,0 +1,431 @@
+# ----- spool.py -----
+# Local write-ahead spool for when PostgreSQL (Neon) or MongoDB (Atlas) is down.
+# Collectors that can't reach their database - at startup or mid-run - append
+# what they fetched here instead of exiting, and the flusher later drains it
+# into the databases with bulk writes. A database outage no longer loses the
+# collection window.
+#
+# Layout: spool/<target>/<run_stamp>-<pid>-<n>.seg, target = job_postings | social_media_posts
+# Each record: 4-byte length + 4-byte CRC32 (big-endian) + UTF-8 JSON
+#   job_postings:        {"source", "spooled_at", "columns", "job", "raw"}
+#   social_media_posts:  {"source", "spooled_at", "doc"}
+# Segments are written as .seg.open, fsynced every FSYNC_EVERY records, and
+# renamed to .seg when closed; only closed segments are flushed. A torn record
+# at the end of a crashed writer's segment is dropped, everything before it is kept.
+#
+# Records the database rejects outright (anything but a duplicate key) go to
+# <segment>.seg.rejected and are counted as 'rejected' in the run metrics; a
+# segment that keeps failing as a whole is moved there after MAX_FLUSH_ATTEMPTS
+# runs. Either way the segments behind it still drain.
+#
+# Usage:
+#   python spool.py status         # pending and rejected segments and records
+#   python spool.py flush          # drain into the databases (run_all_tasks.py does this every run)
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime
+
+SPOOL_DIR = os.environ.get('SPOOL_DIR', 'spool')
+JOB_TARGET = 'job_postings'
+POST_TARGET = 'social_media_posts'
+TARGETS = [JOB_TARGET, POST_TARGET]
+
+CONNECT_TIMEOUT = 10 # Seconds before a slow database counts as down
+FSYNC_EVERY = 100 # Records between fsyncs
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+STALE_OPEN_SECONDS = 60 * 60 # A .seg.open this old belongs to a crashed writer - flush it anyway
+FLUSH_BATCH_SIZE = 500
+MAX_FLUSH_ATTEMPTS = 5 # Failed flushes (database up) before a segment is set aside as rejected
+
+HEADER = struct.Struct('>II')
+
+# Exception class names (anywhere in the MRO) that mean "the database is unreachable":
+# psycopg2, asyncpg, pymongo and socket-level errors
+CONNECTION_ERROR_NAMES = {
+    'OperationalError', 'InterfaceError', 'ConnectionFailure', 'AutoReconnect',
+    'ServerSelectionTimeoutError', 'NetworkTimeout', 'ConnectionDoesNotExistError',
+    'CannotConnectNowError', 'PostgresConnectionError', 'ConnectionError', 'TimeoutError', 'gaierror',
+}
+
+
+def is_connection_error(exc):
+    return any(cls.__name__ in CONNECTION_ERROR_NAMES for cls in type(exc).__mro__)
+
+
+# --- Encoding (datetimes survive the round trip, unlike plain json) ---
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    return str(value)
+
+
+def _object_hook(obj):
+    if len(obj) == 1 and '$dt' in obj:
+        return datetime.fromisoformat(obj['$dt'])
+    return obj
+
+
+def encode_record(record):
+    body = json.dumps(record, default=_json_default, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def read_segment(path):
+    """Every intact record in a segment. Stops at the first torn or corrupt record."""
+    records = []
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(HEADER.size)
+            if not header:
+                break
+            if len(header) < HEADER.size:
+                print(f">>> Warning: {path} ends in a torn record header - ignoring it.")
+                break
+            length, crc = HEADER.unpack(header)
+            body = f.read(length)
+            if len(body) < length or zlib.crc32(body) != crc:
+                print(f">>> Warning: {path} has a torn/corrupt record after {len(records)} records - ignoring the rest.")
+                break
+            records.append(json.loads(body, object_hook=_object_hook))
+    return records
+
+
+# --- Writing ---
+class SpoolWriter:
+    """Appends records for one target to length-prefixed segment files. Opens nothing until the first record."""
+
+    def __init__(self, target, directory=None):
+        self.target = target
+        self.directory = os.path.join(directory or SPOOL_DIR, target)
+        self.run_stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        self.records_written = 0
+        self._file = None
+        self._path = None
+        self._segment = 0
+        self._unsynced = 0
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._segment += 1
+        self._path = os.path.join(self.directory, f"{self.run_stamp}-{os.getpid()}-{self._segment}.seg")
+        self._file = open(self._path + '.open', 'ab')
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._sync()
+        self._file.close()
+        os.replace(self._path + '.open', self._path) # Sealed - the flusher may take it now
+        self._file = None
+
+    def append(self, record):
+        if self._file is None:
+            self._open_segment()
+        self._file.write(encode_record(record))
+        self.records_written += 1
+        self._unsynced += 1
+        if self._unsynced >= FSYNC_EVERY:
+            self._sync()
+        if self._file.tell() >= SEGMENT_MAX_BYTES:
+            self._close_segment()
+
+    def add_job(self, source, columns, job, raw=None):
+        self.append({'source': source, 'spooled_at': datetime.utcnow(), 'columns': list(columns),
+                     'job': {c: job[c] for c in columns}, 'raw': raw})
+
+    def add_posts(self, source, docs):
+        spooled_at = datetime.utcnow()
+        for doc in docs:
+            # insert_many may already have assigned an ObjectId - let the real insert assign a new one
+            self.append({'source': source, 'spooled_at': spooled_at,
+                         'doc': {k: v for k, v in doc.items() if k != '_id'}})
+
+    def seal(self):
+        """Close the current segment so the flusher can take it; the next record opens a new one."""
+        try:
+            self._close_segment()
+        except Exception as spool_err:
+            print(f">>> Warning: Could not close spool segment {self._path}: {spool_err}")
+
+    def close(self):
+        self.seal()
+
+
+# --- Flushing ---
+def _writer_alive(name):
+    # <run_stamp>-<pid>-<n>.seg.open
+    try:
+        os.kill(int(name.split('-')[1]), 0)
+        return True
+    except (IndexError, ValueError, ProcessLookupError):
+        return False
+    except OSError:
+        return True # Exists, just not ours to signal
+
+
+def pending_segments(target, directory=None):
+    """Sealed segments, oldest first, plus .seg.open files abandoned by a crashed writer."""
+    target_dir = os.path.join(directory or SPOOL_DIR, target)
+    if not os.path.isdir(target_dir):
+        return []
+    segments = []
+    for name in sorted(os.listdir(target_dir)):
+        path = os.path.join(target_dir, name)
+        if name.endswith('.seg'):
+            segments.append(path)
+        elif (name.endswith('.seg.open') and time.time() - os.path.getmtime(path) > STALE_OPEN_SECONDS
+              and not _writer_alive(name)):
+            os.replace(path, path[:-len('.open')])
+            segments.append(path[:-len('.open')])
+    return segments
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def flush_jobs(db_conn, records):
+    """Bulk-upsert spooled job rows (plus raw payloads, rollups and version stamps) in one transaction.
+    Returns the number of new rows; rows whose content changed are updated (see job_history.py)."""
+    from psycopg2.extras import execute_values
+    import ingest_version
+    import job_history
+    import job_raw_store
+    import rollups
+
+    inserted = 0
+    new_sources = set()
+    job_rollup = rollups.JobRollupAccumulator()
+    try:
+        with db_conn.cursor() as db_cursor:
+            by_columns = {}
+            for record in records:
+                columns = tuple(record['columns'])
+                if 'content_hash' not in columns:
+                    # Spooled before rows carried a hash
+                    record['job']['content_hash'] = job_history.content_hash(record['job'])
+                    columns += ('content_hash',)
+                by_columns.setdefault(columns, []).append(record)
+            for columns, group in by_columns.items():
+                sql = job_history.upsert_sql(columns, 'VALUES %s')
+                for chunk in _chunks(group, FLUSH_BATCH_SIZE):
+                    chunk = job_history.unique_by_url(chunk, lambda record: record['job']) # A URL spooled twice is written once
+                    values = [tuple(record['job'][c] for c in columns) for record in chunk]
+                    written = dict(execute_values(db_cursor, sql, values, fetch=True))
+                    new_sources.update(record['source'] for record in chunk if record['job']['job_url'] in written)
+                    for record in chunk:
+                        job = record['job']
+                        if not written.get(job['job_url']):
+                            continue # Unchanged, or an update of a row stored earlier
+                        inserted += 1
+                        if record.get('raw') is not None:
+                            job_raw_store.save(db_cursor, job['job_url'], job['source'], job.get('external_id'), record['raw'])
+                        day = (job.get('collected_at') or record['spooled_at']).date()
+                        job_rollup.add(day, job['source'], job['company_name'], job['tags'], job['is_remote'])
+            job_rollup.flush(db_cursor)
+            for source in sorted(new_sources):
+                ingest_version.bump_postgres(db_cursor, source)
+        db_conn.commit()
+    except Exception:
+        # A failed statement aborts the transaction: roll back so the next segment can use the connection
+        if not db_conn.closed:
+            db_conn.rollback()
+        raise
+    return inserted
+
+
+def flush_posts(db, records):
+    """Unordered insert_many of spooled documents; duplicates fall to the unique index.
+    Returns (number new, records rejected for any other reason)."""
+    from pymongo.errors import BulkWriteError
+    import ingest_version
+
+    collection = db['social_media_posts'] # Dedupe relies on the unique index from migrations.py
+    inserted = 0
+    rejected = []
+    new_sources = set()
+    for chunk in _chunks(records, FLUSH_BATCH_SIZE):
+        docs = [record['doc'] for record in chunk]
+        try:
+            chunk_inserted = len(collection.insert_many(docs, ordered=False).inserted_ids)
+        except BulkWriteError as bwe:
+            # ordered=False has written every other document by now
+            chunk_inserted = bwe.details.get('nInserted', 0)
+            rejected.extend(chunk[err['index']] for err in bwe.details.get('writeErrors', [])
+                            if err.get('code') != 11000)
+        inserted += chunk_inserted
+        if chunk_inserted:
+            new_sources.update(record['source'] for record in chunk)
+    for source in sorted(new_sources):
+        ingest_version.bump_mongo(db, source)
+    return inserted, rejected
+
+
+def _failure_count(path, increment=False):
+    # <segment>.seg.failures: flushes of this segment that failed while its database was up
+    counter = f"{path}.failures"
+    try:
+        with open(counter) as f:
+            count = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        count = 0
+    if increment:
+        count += 1
+        with open(counter, 'w') as f:
+            f.write(str(count))
+    return count
+
+
+def _clear_failures(path):
+    try:
+        os.remove(f"{path}.failures")
+    except FileNotFoundError:
+        pass
+
+
+def reject_records(path, records):
+    """Append records to <segment>.rejected (same format as a segment) so they can be inspected or replayed."""
+    with open(f"{path}.rejected", 'ab') as f:
+        for record in records:
+            f.write(encode_record(record))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def rejected_segments(target, directory=None):
+    target_dir = os.path.join(directory or SPOOL_DIR, target)
+    if not os.path.isdir(target_dir):
+        return []
+    return [os.path.join(target_dir, name) for name in sorted(os.listdir(target_dir)) if name.endswith('.seg.rejected')]
+
+
+def flush_target(target, write, directory=None):
+    """Drain one target's segments through write(records) -> (inserted, rejected records). A segment
+    is deleted only after its records are written, so a failed flush is retried next time - up to
+    MAX_FLUSH_ATTEMPTS times, then it is set aside as rejected. Returns (records, inserted, rejected, failed segments)."""
+    total_records = total_inserted = total_rejected = failed = 0
+    for path in pending_segments(target, directory):
+        records = read_segment(path)
+        try:
+            inserted, rejected = write(records) if records else (0, [])
+        except Exception as flush_err:
+            print(f">>> Error flushing {path}: {flush_err}")
+            failed += 1
+            if is_connection_error(flush_err):
+                break # Still down - keep the rest for next time
+            if _failure_count(path, increment=True) >= MAX_FLUSH_ATTEMPTS:
+                # The data, not the database: stop retrying it so it can't hold up the spool
+                os.replace(path, f"{path}.rejected")
+                _clear_failures(path)
+                total_records += len(records)
+                total_rejected += len(records)
+                print(f">>> Warning: {path} failed {MAX_FLUSH_ATTEMPTS} flushes - moved to {path}.rejected.")
+            continue
+        if rejected:
+            reject_records(path, rejected)
+            print(f">>> Warning: {len(rejected)} records in {path} were rejected - kept in {path}.rejected.")
+        os.remove(path)
+        _clear_failures(path)
+        total_records += len(records)
+        total_inserted += inserted
+        total_rejected += len(rejected)
+        print(f"  Flushed {path}: {len(records)} records, {inserted} new.")
+    return total_records, total_inserted, total_rejected, failed
+
+
+def flush_all(directory=None):
+    """Drain every target whose database is configured. Returns the number of segments that failed."""
+    from run_metrics import RunMetrics
+    metrics = RunMetrics('spool')
+    failed = 0
+
+    if pending_segments(JOB_TARGET, directory):
+        db_conn = None
+        try:
+            import psycopg2
+            if not os.environ.get('POSTGRES_URI'):
+                raise RuntimeError("POSTGRES_URI secret not found or is empty!")
+            db_conn = psycopg2.connect(os.environ['POSTGRES_URI'], connect_timeout=CONNECT_TIMEOUT)
+            with metrics.stage('db_write'):
+                # One transaction per segment: a bad row fails the whole segment (see MAX_FLUSH_ATTEMPTS)
+                records, inserted, rejected, target_failed = flush_target(
+                    JOB_TARGET, lambda batch: (flush_jobs(db_conn, batch), []), directory)
+            metrics.incr('fetched', records)
+            metrics.incr('inserted', inserted)
+            metrics.incr('skipped', records - inserted - rejected)
+            metrics.incr('rejected', rejected)
+            failed += target_failed
+        except Exception as pg_err:
+            print(f">>> Could not flush spooled job rows: {pg_err}")
+            failed += 1
+        finally:
+            if db_conn: db_conn.close()
+
+    if pending_segments(POST_TARGET, directory):
+        mongo_client = None
+        try:
+            from pymongo import MongoClient
+            if not os.environ.get('MONGO_URI'):
+                raise RuntimeError("MONGO_URI secret not found!")
+            mongo_client = MongoClient(os.environ['MONGO_URI'], serverSelectionTimeoutMS=CONNECT_TIMEOUT * 1000)
+            mongo_client.admin.command('ismaster')
+            db = mongo_client['web3_data']
+            with metrics.stage('db_write'):
+                records, inserted, rejected, target_failed = flush_target(
+                    POST_TARGET, lambda batch: flush_posts(db, batch), directory)
+            metrics.incr('fetched', records)
+            metrics.incr('inserted', inserted)
+            metrics.incr('skipped', records - inserted - rejected)
+            metrics.incr('rejected', rejected)
+            failed += target_failed
+        except Exception as mongo_err:
+            print(f">>> Could not flush spooled posts: {mongo_err}")
+            failed += 1
+        finally:
+            if mongo_client: mongo_client.close()
+
+    metrics.incr('errors', failed)
+    metrics.write()
+    return failed
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or drain the local write spool.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help='Show pending spool segments')
+    sub.add_parser('flush', help='Write spooled records to the databases')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        empty = True
+        for target in TARGETS:
+            for path in pending_segments(target):
+                empty = False
+                print(f"{target:<20} {os.path.basename(path)}: {len(read_segment(path))} records")
+            for path in rejected_segments(target):
+                print(f"{target:<20} {os.path.basename(path)}: {len(read_segment(path))} records (rejected)")
+        if empty:
+            print("Spool is empty.")
+        return 0
+
+    print(f"--- Flushing Write Spool at {datetime.utcnow().isoformat()} ---")
+    if not any(pending_segments(target) for target in TARGETS):
+        print("Spool is empty - nothing to flush.")
+        return 0
+    return 1 if flush_all() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+# ----- task_queue.py -----
+# Lets any number of collector workers, on any number of machines, share the
+# work without fetching anything twice. Every unit in sources.json is a row in
+# the `collection_tasks` table with its own next_run_at; a worker claims due
+# rows with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never
+# block on or pick the same task, and adding workers adds throughput.
+#
+# A claimed task is leased to its worker for LEASE_SECONDS and the worker
+# heartbeats the lease while the fetch runs. If the worker dies the lease runs
+# out and another worker picks the task up. A failed fetch is retried with
+# exponential backoff up to MAX_ATTEMPTS times, then waits for its next
+# regular run. Successful runs reschedule the task with the same yield-based
+# interval as collector_daemon.py (the polling code is shared with it).
+#
+# Usage:
+#   python task_queue.py sync                          # sources.json -> collection_tasks
+#   python task_queue.py work                          # claim and run due tasks forever
+#   python task_queue.py work --once --sync            # run what is due now, then exit (cron / CI)
+#   python task_queue.py work --concurrency 8 --only reddit
+#   python task_queue.py status
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+from datetime import datetime
+
+import profiling
+import resilience
+import source_registry
+import spool
+
+TASKS_TABLE = 'collection_tasks'
+LEASE_SECONDS = 5 * 60
+HEARTBEAT_SECONDS = 60 # Well inside the lease, so one missed beat doesn't lose the task
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 60 # 1, 2, 4, 8 min between retries
+IDLE_POLL_SECONDS = 30 # Nothing due - look again after this
+DEFAULT_CONCURRENCY = 4
+
+CREATE_TABLE_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {TASKS_TABLE} (
+        task_key         TEXT PRIMARY KEY, -- sources.json unit key, e.g. 'reddit:search:Coinbase hiring'
+        source           TEXT NOT NULL,
+        spec             JSONB NOT NULL,
+        enabled          BOOLEAN NOT NULL DEFAULT TRUE, -- FALSE once the unit leaves sources.json
+        interval_seconds DOUBLE PRECISION NOT NULL,
+        last_yield       DOUBLE PRECISION,
+        next_run_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+        leased_by        TEXT,
+        lease_expires_at TIMESTAMPTZ,
+        heartbeat_at     TIMESTAMPTZ,
+        attempts         INTEGER NOT NULL DEFAULT 0, -- Consecutive failed (or abandoned) runs
+        runs             INTEGER NOT NULL DEFAULT 0,
+        last_run_at      TIMESTAMPTZ,
+        last_status      TEXT,
+        last_error       TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_collection_tasks_due ON {TASKS_TABLE} (next_run_at) WHERE enabled;
+"""
+
+SYNC_SQL = f"""
+    INSERT INTO {TASKS_TABLE} (task_key, source, spec, interval_seconds) VALUES %s
+    ON CONFLICT (task_key) DO UPDATE SET source = EXCLUDED.source, spec = EXCLUDED.spec, enabled = TRUE;
+"""
+DISABLE_REMOVED_SQL = f"UPDATE {TASKS_TABLE} SET enabled = FALSE WHERE enabled AND NOT (task_key = ANY(%s::text[]));"
+
+# Due and not leased (or the lease ran out - its worker died). SKIP LOCKED: rows another
+# worker is claiming right now are passed over instead of waited on.
+CLAIM_SQL = f"""
+    UPDATE {TASKS_TABLE} t
+    SET leased_by = %(worker)s,
+        lease_expires_at = now() + make_interval(secs => %(lease)s),
+        heartbeat_at = now(),
+        attempts = t.attempts + 1
+    FROM (
+        SELECT task_key FROM {TASKS_TABLE}
+        WHERE enabled AND next_run_at <= now()
+          AND (lease_expires_at IS NULL OR lease_expires_at < now())
+          AND source = ANY(%(sources)s)
+        ORDER BY next_run_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ) due
+    WHERE t.task_key = due.task_key
+    RETURNING t.task_key, t.spec, t.interval_seconds, t.last_yield, t.runs, t.attempts;
+"""
+
+HEARTBEAT_SQL = f"""
+    UPDATE {TASKS_TABLE} SET lease_expires_at = now() + make_interval(secs => %s), heartbeat_at = now()
+    WHERE task_key = ANY(%s) AND leased_by = %s;
+"""
+
+# Only while we still hold the lease - if it expired and another worker took over, its result wins
+COMPLETE_SQL = f"""
+    UPDATE {TASKS_TABLE}
+    SET leased_by = NULL, lease_expires_at = NULL,
+        next_run_at = now() + make_interval(secs => %(delay)s),
+        interval_seconds = %(interval)s, last_yield = %(last_yield)s,
+        attempts = %(attempts)s, runs = runs + 1,
+        last_run_at = now(), last_status = %(status)s, last_error = %(error)s
+    WHERE task_key = %(task_key)s AND leased_by = %(worker)s;
+"""
+
+STATUS_SQL = f"""
+    SELECT source, count(*) FILTER (WHERE enabled),
+           count(*) FILTER (WHERE enabled AND next_run_at <= now() AND (lease_expires_at IS NULL OR lease_expires_at < now())),
+           count(*) FILTER (WHERE lease_expires_at >= now()),
+           count(*) FILTER (WHERE enabled AND attempts > 0),
+           min(next_run_at) FILTER (WHERE enabled)
+    FROM {TASKS_TABLE} GROUP BY source ORDER BY source;
+"""
+LEASED_SQL = f"""
+    SELECT task_key, leased_by, heartbeat_at, attempts FROM {TASKS_TABLE}
+    WHERE lease_expires_at >= now() ORDER BY heartbeat_at;
+"""
+
+
+def connect():
+    db_uri = os.environ.get('POSTGRES_URI')
+    if not db_uri:
+        raise RuntimeError("POSTGRES_URI secret not found or is empty!")
+    import psycopg2
+    import migrations # Not at module level: migrations.py imports this module for CREATE_TABLE_SQL
+    db_conn = psycopg2.connect(db_uri, connect_timeout=spool.CONNECT_TIMEOUT)
+    with db_conn.cursor() as db_cursor:
+        migrations.require_postgres(db_cursor) # collection_tasks is created by migrations.py
+    db_conn.commit()
+    return db_conn
+
+
+def sync_tasks(db_conn, units):
+    """Upsert the registry units as tasks (new ones are due now) and disable tasks whose unit is gone."""
+    from psycopg2.extras import Json, execute_values
+    from collector_daemon import SOURCE_INTERVALS
+    values = [(unit['key'], unit['source'], Json(unit), SOURCE_INTERVALS[unit['source']][0]) for unit in units]
+    with db_conn.cursor() as db_cursor:
+        execute_values(db_cursor, SYNC_SQL, values)
+        db_cursor.execute(DISABLE_REMOVED_SQL, ([unit['key'] for unit in units],))
+        disabled = db_cursor.rowcount
+    db_conn.commit()
+    return len(values), disabled
+
+
+def retry_delay(attempts):
+    return RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+
+
+class Worker:
+    """Claims due tasks and runs up to `concurrency` of them at once on one event loop."""
+
+    def __init__(self, db_conn, daemon, sources, concurrency):
+        self.db_conn = db_conn
+        self.daemon = daemon # collector_daemon.Daemon - does the actual fetch + write of one unit
+        self.sources = sources
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = set() # task_keys we hold a lease on
+        self._db_lock = asyncio.Lock() # One psycopg2 connection, used from worker threads one call at a time
+        from collector_daemon import RedditAuth
+        self.reddit_auth = RedditAuth()
+        self.completed = self.failed = 0
+
+    async def db(self, func, *args):
+        async with self._db_lock:
+            return await asyncio.to_thread(func, *args)
+
+    def _execute(self, sql, params, fetch=False):
+        try:
+            with self.db_conn.cursor() as db_cursor:
+                db_cursor.execute(sql, params)
+                result = db_cursor.fetchall() if fetch else db_cursor.rowcount
+            self.db_conn.commit()
+            return result
+        except Exception:
+            self.db_conn.rollback()
+            raise
+
+    async def claim(self, limit):
+        # Sources whose breaker is open (on this node) are left for later or for other workers
+        sources = [source for source in self.sources if resilience.CircuitBreaker(source).allow()]
+        if not sources or limit <= 0:
+            return []
+        return await self.db(self._execute, CLAIM_SQL, {'worker': self.worker_id, 'lease': LEASE_SECONDS,
+                                                        'sources': sources, 'limit': limit}, True)
+
+    async def heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            if not self.running:
+                continue
+            try:
+                await self.db(self._execute, HEARTBEAT_SQL, (LEASE_SECONDS, list(self.running), self.worker_id))
+            except Exception as heartbeat_err:
+                print(f">>> Warning: Heartbeat failed: {heartbeat_err}")
+
+    async def run_task(self, row):
+        from collector_daemon import PollUnit, make_poll
+        task_key, spec, interval, last_yield, runs, attempts = row
+        unit = PollUnit(spec, make_poll(spec, self.reddit_auth),
+                        {'interval': interval, 'last_yield': last_yield, 'polls': runs})
+        error = None
+        try:
+            failed = await self.daemon.poll_once(unit)
+        except Exception as task_err:
+            failed, error = True, str(task_err)
+            print(f"  > [{task_key}] Task failed: {task_err}")
+
+        if not failed:
+            params = {'status': 'ok', 'attempts': 0, 'interval': unit.interval,
+                      'delay': max(0.0, unit.next_poll - time.time())}
+            self.completed += 1
+        elif attempts < MAX_ATTEMPTS:
+            # Retry soon, and don't let the failure grow the learned interval yet
+            params = {'status': 'retry', 'attempts': attempts, 'interval': interval, 'delay': retry_delay(attempts)}
+            self.failed += 1
+        else:
+            print(f"  > [{task_key}] Failed {attempts} times in a row - waiting for its next regular run.")
+            params = {'status': 'failed', 'attempts': 0, 'interval': unit.interval, 'delay': unit.interval}
+            self.failed += 1
+        params.update(task_key=task_key, worker=self.worker_id, last_yield=unit.last_yield,
+                      error=error or ('poll failed' if failed else None))
+        try:
+            if not await self.db(self._execute, COMPLETE_SQL, params):
+                print(f">>> Warning: Lease on {task_key} expired before it finished - another worker took it over.")
+        except Exception as complete_err:
+            # The lease runs out and the task is picked up again
+            print(f">>> Warning: Could not record result of {task_key}: {complete_err}")
+        finally:
+            self.running.discard(task_key)
+
+    async def run(self, once=False):
+        heartbeat = asyncio.create_task(self.heartbeat_loop())
+        in_flight = set()
+        try:
+            while True:
+                rows = await self.claim(self.concurrency - len(in_flight))
+                for row in rows:
+                    self.running.add(row[0])
+                    in_flight.add(asyncio.create_task(self.run_task(row)))
+                if once and not rows and not in_flight:
+                    return
+                if in_flight:
+                    # Claim again as soon as a slot frees up
+                    _, in_flight = await asyncio.wait(in_flight, timeout=IDLE_POLL_SECONDS,
+                                                      return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(IDLE_POLL_SECONDS)
+        finally:
+            heartbeat.cancel()
+            for task in in_flight:
+                task.cancel()
+
+
+async def run_worker(db_conn, sources, concurrency, once):
+    import aiohttp
+    import async_collector
+    import collector_daemon
+    import raw_archive
+    stores = {}
+    archives = {}
+    try:
+        try:
+            await async_collector.open_stores(sources, stores)
+        except RuntimeError as config_err:
+            print(f">>> Error: {config_err}")
+            return 1
+        connector = aiohttp.TCPConnector(limit_per_host=async_collector.CONNECTIONS_PER_HOST)
+        timeout = aiohttp.ClientTimeout(total=async_collector.REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            daemon = collector_daemon.Daemon([], session, stores)
+            archives = daemon.archives = {source: raw_archive.RawArchiveWriter(source) for source in sources}
+            worker = Worker(db_conn, daemon, sources, concurrency)
+            print(f"Worker {worker.worker_id} claiming up to {concurrency} tasks at a time ({', '.join(sources)}).")
+            try:
+                await worker.run(once)
+            finally:
+                print(f"Worker {worker.worker_id}: {worker.completed} tasks done, {worker.failed} failed.")
+        return 0
+    finally:
+        for archive in archives.values():
+            archive.close()
+        await async_collector.close_stores(stores)
+
+
+def print_status(db_conn):
+    with db_conn.cursor() as db_cursor:
+        db_cursor.execute(STATUS_SQL)
+        rows = db_cursor.fetchall()
+        db_cursor.execute(LEASED_SQL)
+        leased = db_cursor.fetchall()
+    if not rows:
+        print(f"{TASKS_TABLE} is empty - run `python task_queue.py sync` first.")
+        return
+    for source, enabled, due, running, retrying, next_run in rows:
+        next_note = next_run.isoformat(timespec='seconds') if next_run else '-'
+        print(f"{source:<15} {enabled:4} tasks | {due:4} due | {running:4} running | {retrying:4} retrying | next {next_note}")
+    for task_key, leased_by, heartbeat_at, attempts in leased:
+        print(f"  running: {task_key[:60]:<60} on {leased_by} (heartbeat {heartbeat_at.isoformat(timespec='seconds')}, attempt {attempts})")
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared Postgres task queue for collector workers.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('sync', help='Load sources.json into collection_tasks')
+    work = sub.add_parser('work', help='Claim and run due tasks')
+    work.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Tasks run at once (default: %(default)s)')
+    work.add_argument('--only', choices=list(source_registry.SOURCE_METHODS), action='append',
+                      help='Claim only this source\'s tasks (can be repeated)')
+    work.add_argument('--once', action='store_true', help='Exit once nothing is due instead of waiting')
+    work.add_argument('--sync', action='store_true', help='Sync sources.json into the queue first')
+    work.add_argument('--profile', action='store_true', default=profiling.profile_option([]), # COLLECTOR_PROFILE, if set
+                      help='Sample the worker and write flame graph files to profiles/ (see profiling.py)')
+    sub.add_parser('status', help='Tasks per source, due, running and retrying')
+    args = parser.parse_args(argv)
+
+    try:
+        db_conn = connect()
+    except Exception as db_err:
+        print(f">>> Error: Could not open the task queue: {db_err}")
+        return 1
+    try:
+        if args.command == 'status':
+            print_status(db_conn)
+            return 0
+        if args.command == 'sync' or args.sync:
+            synced, disabled = sync_tasks(db_conn, source_registry.load_units())
+            print(f"Synced {synced} tasks from the source registry, disabled {disabled} removed ones.")
+        if args.command == 'sync':
+            return 0
+
+        if args.profile:
+            profiling.start('task_queue')
+        print(f"--- Starting Queue Worker at {datetime.utcnow().isoformat()} ---")
+        try:
+            return asyncio.run(run_worker(db_conn, args.only or list(source_registry.SOURCE_METHODS),
+                                          args.concurrency, args.once))
+        except KeyboardInterrupt:
+            print("--- Queue Worker stopped (leases expire and other workers take over) ---")
+            return 0
+    finally:
+        db_conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())